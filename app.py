@@ -1,30 +1,229 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context
+from flask import g, has_request_context, before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import IntegrityError
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from geopy.geocoders import Nominatim
 from geopy.distance import geodesic
+from geopy.adapters import RequestsAdapter, requests_available
+from geopy.exc import GeocoderTimedOut, GeocoderUnavailable, GeocoderRateLimited
 import os
 import csv
+import json
+import io
+import click
 import pandas as pd
-from functools import wraps
+import numpy as np
+import heapq
+import math
+from functools import wraps, partial
 from datetime import datetime, timedelta
 import re
+import sys
 import secrets
 import string
+import threading
+import time
+import bisect
+import uuid
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import unicodedata
+import cProfile
+import pstats
+from collections import OrderedDict, deque
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'tajny-klucz-aplikacji')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///baza.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///baza.db')  # Domyślnie SQLite
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['GPZ_CSV_PATH'] = 'gpz_database.csv'  # Ścieżka do pliku CSV
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')  # Czytelnicy nie blokują zapisu
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')  # W trybie WAL bezpieczne i szybsze niż FULL
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # ms oczekiwania na blokadę zapisu
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))  # s oczekiwania na wolne połączenie
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # s, dotyczy zewnętrznych baz danych
+app.config['GPZ_CSV_PATH'] = os.environ.get('GPZ_CSV_PATH', 'gpz_database.csv')  # Ścieżka do pliku CSV
+app.config['GPZ_STORAGE'] = os.environ.get('GPZ_STORAGE', 'csv')  # 'csv' (plik GPZ_CSV_PATH) lub 'db' (tabela gpz)
+# Binarny zrzut GPZ (plik GPZ_CSV_PATH + '.snap') mapowany do pamięci i współdzielony przez procesy
+app.config['GPZ_BINARY_SNAPSHOT'] = os.environ.get('GPZ_BINARY_SNAPSHOT', '0') == '1'
+app.config['GPZ_DB_VERSION_CHECK'] = float(os.environ.get('GPZ_DB_VERSION_CHECK', 1.0))  # s między odczytami wersji GPZ z bazy
+app.config['GPZ_BBOX_START_KM'] = 10  # Początkowy promień prostokąta wyszukiwania w bazie (GPZ_STORAGE = 'db')
+app.config['GPZ_PELNY_SKAN_MAX'] = 20000  # Do tej liczby GPZ wektorowy skan zamiast drzewa k-d
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
+app.config['REGISTRATION_KEYS_MAX_BATCH'] = 10000  # Maksymalna liczba kluczy generowanych naraz
+app.config['REGISTRATION_KEYS_PER_PAGE'] = 50
+app.config['GPZ_ADMIN_PER_PAGE'] = 50  # Liczba GPZ na stronie tabeli w panelu administracyjnym
+app.config['GPZ_ADMIN_MAX_PER_PAGE'] = 500
+app.config['API_BATCH_MAX_POINTS'] = 500  # Maksymalna liczba punktów w jednym zapytaniu API
+app.config['API_GEOCODE_WORKERS'] = 8  # Równoległe geokodowanie adresów zapytania API
+app.config['API_BATCH_MATRIX_MAX'] = 4_000_000  # Maksymalny rozmiar bloku macierzy odległości (punkty x GPZ)
+app.config['GPZ_PROGI_MOCY'] = [0, 1, 2, 5, 10, 20, 50]  # Progi (MW) osobnych indeksów przestrzennych wyszukiwania z mocą
+app.config['GPZ_INDEKSY_MOCY_MAX'] = 256  # Zapamiętane indeksy wyszukiwania z mocą (kolumna x próg x dystrybutor)
+app.config['GPZ_PROMIEN_MAX_KM'] = 500  # Maksymalny promień wyszukiwania "wszystkie GPZ w promieniu"
+app.config['ASYNC_SEARCH_WORKERS'] = int(os.environ.get('ASYNC_SEARCH_WORKERS', 16))  # Wątki wyszukiwania asynchronicznego
+app.config['ASYNC_SEARCH_MAX_PENDING'] = 500  # Maksymalna liczba wyszukiwań w toku (na proces)
+app.config['ASYNC_SEARCH_TTL'] = 3600  # s przechowywania wyszukiwań w bazie do odczytu wyniku
+app.config['QUERY_LIMIT'] = 100  # Miesięczny limit zapytań użytkownika
+app.config['QUOTA_CACHE_TTL'] = timedelta(seconds=60)  # Ważność licznika zapytań w pamięci procesu
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Maksymalny rozmiar importowanego pliku
+app.config['GPZ_IMPORT_WORKERS'] = 4  # Równoległe geokodowanie przy imporcie (limit zapytań Nominatim nadal obowiązuje)
+app.config['GPZ_IMPORT_PROGRESS_INTERVAL'] = 0.5  # s między zapisami postępu importu do bazy
+app.config['GPZ_IMPORT_STALE'] = 300  # s bez zapisu postępu, po których import uznawany jest za przerwany
+app.config['GEOCODER_BACKEND'] = os.environ.get('GEOCODER_BACKEND', 'nominatim')  # 'nominatim', 'local' lub np. 'local,nominatim'
+app.config['NOMINATIM_DOMAIN'] = 'nominatim.openstreetmap.org'
+app.config['NOMINATIM_SCHEME'] = 'https'
+app.config['NOMINATIM_USER_AGENT'] = 'gpz-finder'
+app.config['NOMINATIM_RATE'] = 1.0  # Zapytań na sekundę - zasady korzystania z Nominatim
+app.config['NOMINATIM_BURST'] = 1
+app.config['NOMINATIM_TIMEOUT'] = 5  # Sekundy na jedno zapytanie HTTP
+app.config['NOMINATIM_QUEUE_TIMEOUT'] = 10  # Maksymalne oczekiwanie na wolny limit zapytań
+app.config['NOMINATIM_RETRIES'] = 2
+app.config['NOMINATIM_BACKOFF'] = 0.5  # Opóźnienie pierwszej ponownej próby, podwajane
+app.config['NOMINATIM_POOL_SIZE'] = 10
+app.config['GAZETTEER_CSV_PATH'] = 'gazetteer.csv'  # Punkty adresowe: ulica, numer, kod_pocztowy, miasto, latitude, longitude
+app.config['GEOCODE_CACHE_SIZE'] = 10000  # Liczba adresów w pamięci procesu
+app.config['SEARCH_CACHE_SIZE'] = int(os.environ.get('SEARCH_CACHE_SIZE', 5000))  # Komórki siatki w pamięci wyników (0 = wyłączona)
+app.config['SEARCH_CACHE_GRID_DEG'] = 0.01  # Rozmiar komórki siatki (stopnie, ok. 1 km)
+app.config['SEARCH_CACHE_POINTS'] = 16  # Gotowe wyniki dokładnych punktów zapamiętane w jednej komórce
+app.config['GEOCODE_CACHE_TTL'] = timedelta(days=90)  # Ważność znalezionych współrzędnych
+app.config['GEOCODE_CACHE_NEGATIVE_TTL'] = timedelta(days=1)  # Ważność wyniku "nie znaleziono"
+app.config['AUTOCOMPLETE_MIN_CHARS'] = 3  # Minimalna długość tekstu, dla którego podawane są podpowiedzi
+app.config['AUTOCOMPLETE_LIMIT'] = 8  # Liczba podpowiedzi adresów
+app.config['AUTOCOMPLETE_MAX_GEOCODED'] = 100000  # Najnowsze adresy z pamięci geokodowania wczytywane do indeksu
+app.config['METRICS_LOCALHOST'] = os.environ.get('METRICS_LOCALHOST', '0') == '1'  # /metrics bez logowania z adresu lokalnego (poza tym tylko dla administratorów)
+app.config['METRICS_BUCKETS'] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Przedziały histogramów (s)
+app.config['PROFILING_KEEP'] = 20  # Liczba zapamiętanych profili żądań administratorów
+
+# Opcje silnika bazy danych: pula połączeń dla plikowego SQLite i baz zewnętrznych
+# (SQLite w pamięci korzysta z jednego współdzielonego połączenia)
+def opcje_silnika(uri):
+    opcje = {'pool_pre_ping': True}
+    if uri.startswith('sqlite') and (uri in ('sqlite://', 'sqlite:///') or ':memory:' in uri):
+        return opcje
+    opcje.update(
+        pool_size=app.config['DB_POOL_SIZE'],
+        max_overflow=app.config['DB_MAX_OVERFLOW'],
+        pool_timeout=app.config['DB_POOL_TIMEOUT'],
+    )
+    if not uri.startswith('sqlite'):
+        opcje['pool_recycle'] = app.config['DB_POOL_RECYCLE']
+    return opcje
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opcje_silnika(app.config['SQLALCHEMY_DATABASE_URI'])
 
 db = SQLAlchemy(app)
+
+# Ustawienia każdego nowego połączenia SQLite
+def skonfiguruj_sqlite(polaczenie_dbapi, rekord_polaczenia=None):
+    kursor = polaczenie_dbapi.cursor()
+    kursor.execute(f"PRAGMA busy_timeout = {int(app.config['SQLITE_BUSY_TIMEOUT'])}")
+    if re.fullmatch(r'[A-Za-z]+', app.config['SQLITE_JOURNAL_MODE']):
+        kursor.execute(f"PRAGMA journal_mode = {app.config['SQLITE_JOURNAL_MODE']}")
+    if re.fullmatch(r'[A-Za-z]+', app.config['SQLITE_SYNCHRONOUS']):
+        kursor.execute(f"PRAGMA synchronous = {app.config['SQLITE_SYNCHRONOUS']}")
+    kursor.close()
+
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', skonfiguruj_sqlite)
+
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
+# Metryki wydajności: histogramy czasu etapów obsługi żądań (geokodowanie,
+# wczytywanie GPZ, wyszukiwanie, limit zapytań, renderowanie) i całych żądań
+# oraz liczniki błędów. Liczone w pamięci procesu, udostępniane w /metrics.
+class StageMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramy = {}
+        self._bledy = {}
+
+    def obserwuj(self, nazwa, etykieta, czas):
+        progi = app.config['METRICS_BUCKETS']
+        with self._lock:
+            histogram = self._histogramy.get((nazwa, etykieta))
+            if histogram is None:
+                histogram = self._histogramy[(nazwa, etykieta)] = [[0] * len(progi), 0.0, 0]
+            i = bisect.bisect_left(progi, czas)
+            if i < len(progi):
+                histogram[0][i] += 1
+            histogram[1] += czas
+            histogram[2] += 1
+
+    # Pomiar etapu; w żądaniu czas trafia też do profilu żądania (nagłówek Server-Timing)
+    @contextmanager
+    def etap(self, nazwa):
+        poczatek = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self._bledy[nazwa] = self._bledy.get(nazwa, 0) + 1
+            raise
+        finally:
+            self.zapisz_etap(nazwa, time.perf_counter() - poczatek)
+
+    def zapisz_etap(self, nazwa, czas):
+        self.obserwuj('gpz_etap_sekundy', nazwa, czas)
+        if has_request_context() and 'etapy' in g:
+            g.etapy.append((nazwa, czas))
+
+    def mierz(self, nazwa):
+        def dekorator(f):
+            @wraps(f)
+            def opakowanie(*args, **kwargs):
+                with self.etap(nazwa):
+                    return f(*args, **kwargs)
+            return opakowanie
+        return dekorator
+
+    def clear(self):
+        with self._lock:
+            self._histogramy.clear()
+            self._bledy.clear()
+
+    # Histogramy i liczniki w formacie tekstowym Prometheus
+    def prometheus(self):
+        progi = app.config['METRICS_BUCKETS']
+        with self._lock:
+            histogramy = {klucz: ([*kubelki], suma, liczba) for klucz, (kubelki, suma, liczba) in self._histogramy.items()}
+            bledy = dict(self._bledy)
+        opisy = {
+            'gpz_etap_sekundy': ('etap', 'Czas etapów obsługi żądań'),
+            'gpz_zadanie_sekundy': ('endpoint', 'Czas obsługi żądań HTTP'),
+        }
+        linie = []
+        for nazwa, (etykieta, opis) in opisy.items():
+            linie += [f'# HELP {nazwa} {opis}', f'# TYPE {nazwa} histogram']
+            for (metryka, wartosc), (kubelki, suma, liczba) in sorted(histogramy.items()):
+                if metryka != nazwa:
+                    continue
+                narastajaco = 0
+                for prog, kubelek in zip(progi, kubelki):
+                    narastajaco += kubelek
+                    linie.append(f'{nazwa}_bucket{{{etykieta}="{wartosc}",le="{prog}"}} {narastajaco}')
+                linie.append(f'{nazwa}_bucket{{{etykieta}="{wartosc}",le="+Inf"}} {liczba}')
+                linie.append(f'{nazwa}_sum{{{etykieta}="{wartosc}"}} {suma:.6f}')
+                linie.append(f'{nazwa}_count{{{etykieta}="{wartosc}"}} {liczba}')
+        linie += ['# HELP gpz_etap_bledy_total Etapy zakończone wyjątkiem', '# TYPE gpz_etap_bledy_total counter']
+        linie += [f'gpz_etap_bledy_total{{etap="{etap}"}} {liczba}' for etap, liczba in sorted(bledy.items())]
+        return linie
+
+metrics = StageMetrics()
+
 # Model użytkownika
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -60,20 +259,173 @@ class RegistrationKey(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     used = db.Column(db.Boolean, default=False)
     used_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    # Identyfikator partii kluczy wygenerowanych jednym żądaniem (eksport CSV)
+    partia = db.Column(db.String(32), nullable=True, index=True)
     
     def __repr__(self):
         return f'<RegistrationKey {self.key}>'
+
+# Model trwałej pamięci podręcznej geokodowania (brak współrzędnych = adres nie znaleziony)
+class GeocodeCacheEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    address_key = db.Column(db.String(300), unique=True, nullable=False, index=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Wyszukiwanie asynchroniczne: stan i wynik w bazie danych, więc odpytywanie
+# o stan może trafić do dowolnego procesu serwera
+class SearchJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    adres = db.Column(db.String(300), nullable=False)
+    filtry = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='w_toku')
+    komunikat = db.Column(db.String(300), nullable=True)
+    lat = db.Column(db.Float, nullable=True)
+    lon = db.Column(db.Float, nullable=True)
+    # Lista {'gpz': pola GPZ, 'odleglosc': km}
+    wyniki = db.Column(db.JSON, nullable=True)
+    znalezione_adresy = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    @property
+    def najblizsze(self):
+        return [(wynik['gpz'], wynik['odleglosc']) for wynik in self.wyniki or []]
+
+    def jako_slownik(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'komunikat': self.komunikat,
+            'adres': self.adres,
+            'lat': self.lat,
+            'lon': self.lon,
+            'gpz': [gpz_do_json(gpz, odleglosc) for gpz, odleglosc in self.najblizsze],
+            'znalezione_adresy': self.znalezione_adresy or [],
+        }
+
+# Zadanie importu GPZ: postęp i błędy w bazie danych, więc panel może odpytywać
+# o stan dowolny proces serwera
+class ImportJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    nazwa_pliku = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='w_toku')
+    wszystkie = db.Column(db.Integer, nullable=False, default=0)
+    przetworzone = db.Column(db.Integer, nullable=False, default=0)
+    dodane = db.Column(db.Integer, nullable=False, default=0)
+    bledy = db.Column(db.JSON, nullable=False, default=list)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Czas ostatniego zapisu postępu - brak zmian przez GPZ_IMPORT_STALE s oznacza przerwany import
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def jako_slownik(self):
+        return {
+            'id': self.id,
+            'plik': self.nazwa_pliku,
+            'status': self.status,
+            'wszystkie': self.wszystkie,
+            'przetworzone': self.przetworzone,
+            'dodane': self.dodane,
+            'bledy': self.bledy or [],
+        }
+
+# Model GPZ przechowywanego w bazie danych (GPZ_STORAGE = 'db')
+class Gpz(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    nazwa = db.Column(db.String(200), nullable=False)
+    adres = db.Column(db.String(200), nullable=False)
+    miasto = db.Column(db.String(100), nullable=False, index=True)
+    kod_pocztowy = db.Column(db.String(10), nullable=True)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    dostepna_moc = db.Column(db.Float, nullable=False, default=0.0)
+    dystrybutor = db.Column(db.String(50), nullable=True, index=True)
+    prognozy = db.relationship('GpzMoc', backref='gpz', cascade='all, delete-orphan', order_by='GpzMoc.rok')
+
+    __table_args__ = (
+        db.Index('ix_gpz_latitude_longitude', 'latitude', 'longitude'),
+        db.Index('ix_gpz_longitude', 'longitude'),
+    )
+
+# Prognoza dostępnej mocy GPZ w danym roku
+class GpzMoc(db.Model):
+    gpz_id = db.Column(db.Integer, db.ForeignKey('gpz.id', ondelete='CASCADE'), primary_key=True)
+    rok = db.Column(db.Integer, primary_key=True)
+    moc = db.Column(db.Float, nullable=False, default=0.0)
+
+# Wersja danych GPZ w bazie (jeden wiersz) - zwiększana przy każdym zapisie tabel gpz i gpz_moc
+class GpzMeta(db.Model):
+    __tablename__ = 'gpz_meta'
+    id = db.Column(db.Integer, primary_key=True)
+    wersja = db.Column(db.Integer, nullable=False, default=0)
     
+# Kolumny pliku z danymi GPZ
+KOLUMNY_GPZ = ['nazwa', 'adres', 'miasto', 'kod_pocztowy', 'latitude', 'longitude', 'dostepna_moc',
+               'dystrybutor', 'moc_2025', 'moc_2026', 'moc_2027', 'moc_2028', 'moc_2029', 'moc_2030']
+KOLUMNY_MOCY = ['moc_2025', 'moc_2026', 'moc_2027', 'moc_2028', 'moc_2029', 'moc_2030']
+ROKI_PROGNOZY = [int(kolumna[4:]) for kolumna in KOLUMNY_MOCY]
+
+# Powtarzające się napisy (miasto, dystrybutor, kod pocztowy) trzymane w jednej kopii
+def internuj(wartosc):
+    return sys.intern(wartosc) if isinstance(wartosc, str) else wartosc
+
+# Zwarty rekord GPZ: atrybuty w __slots__ zamiast słownika na każdy wiersz,
+# pełny adres formatowany dopiero przy odczycie. Dostęp gpz['pole'], gpz.get()
+# i 'pole' in gpz działa jak dla słownika, a szablony używają gpz.pole.
+class GpzRecord:
+    __slots__ = ('id', 'nazwa', 'adres', 'miasto', 'kod_pocztowy', 'latitude', 'longitude', 'dostepna_moc',
+                 'dystrybutor') + tuple(KOLUMNY_MOCY)
+    POLA = frozenset(__slots__) | {'pelny_adres'}
+
+    def __init__(self, nazwa, adres, miasto, kod_pocztowy, latitude, longitude, dostepna_moc, dystrybutor,
+                 moce=(), id=None):
+        self.id = id
+        self.nazwa = nazwa
+        self.adres = adres
+        self.miasto = internuj(miasto)
+        self.kod_pocztowy = internuj(kod_pocztowy)
+        self.latitude = latitude
+        self.longitude = longitude
+        self.dostepna_moc = dostepna_moc
+        self.dystrybutor = internuj(dystrybutor)
+        for kolumna, moc in zip(KOLUMNY_MOCY, moce or (0.0,) * len(KOLUMNY_MOCY)):
+            setattr(self, kolumna, moc)
+
+    @property
+    def pelny_adres(self):
+        if self.kod_pocztowy:
+            return f"{self.adres}, {self.miasto}, {self.kod_pocztowy}"
+        return f"{self.adres}, {self.miasto}"
+
+    # GPZ wczytane z pliku CSV nie mają id - tak jak słownik bez tego klucza
+    def __contains__(self, klucz):
+        return klucz in self.POLA and (klucz != 'id' or self.id is not None)
+
+    def __getitem__(self, klucz):
+        if klucz not in self:
+            raise KeyError(klucz)
+        return getattr(self, klucz)
+
+    def get(self, klucz, domyslna=None):
+        return getattr(self, klucz) if klucz in self else domyslna
+
+    def keys(self):
+        return [pole for pole in self.__slots__ if pole in self] + ['pelny_adres']
+
+    def __repr__(self):
+        return f'GpzRecord({self.nazwa!r}, {self.miasto!r}, {self.latitude}, {self.longitude})'
+
+
 # Funkcja do wczytania danych GPZ z pliku CSV
+@metrics.mierz('wczytywanie_csv')
 def load_gpz_data():
     gpz_data = []
     
     # Sprawdź czy plik CSV istnieje, jeśli nie - utwórz przykładowy plik
     if not os.path.exists(app.config['GPZ_CSV_PATH']):
         with open(app.config['GPZ_CSV_PATH'], 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['nazwa', 'adres', 'miasto', 'kod_pocztowy', 'latitude', 'longitude', 'dostepna_moc', 
-                         'dystrybutor', 'moc_2025', 'moc_2026', 'moc_2027', 'moc_2028', 'moc_2029', 'moc_2030']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer = csv.DictWriter(csvfile, fieldnames=KOLUMNY_GPZ, lineterminator='\n')
             
             writer.writeheader()
             writer.writerow({
@@ -125,35 +477,888 @@ def load_gpz_data():
                 'moc_2030': 14.5
             })
     
-    # Wczytaj dane z pliku CSV
+    # Wczytaj dane z pliku CSV (kolumnami, bez iterowania po wierszach DataFrame)
     try:
         df = pd.read_csv(app.config['GPZ_CSV_PATH'])
-        for _, row in df.iterrows():
-            gpz_data.append({
-                'nazwa': row['nazwa'],
-                'adres': row['adres'],
-                'miasto': row['miasto'],
-                'kod_pocztowy': row['kod_pocztowy'] if 'kod_pocztowy' in row and pd.notna(row['kod_pocztowy']) else '',
-                'pelny_adres': f"{row['adres']}, {row['miasto']}{', ' + row['kod_pocztowy'] if 'kod_pocztowy' in row and pd.notna(row['kod_pocztowy']) else ''}",
-                'latitude': float(row['latitude']),
-                'longitude': float(row['longitude']),
-                'dostepna_moc': float(row['dostepna_moc']),
-                'dystrybutor': row['dystrybutor'] if 'dystrybutor' in row and pd.notna(row['dystrybutor']) else 'Nieznany',
-                'moc_2025': float(row['moc_2025']) if 'moc_2025' in row and pd.notna(row['moc_2025']) else 0.0,
-                'moc_2026': float(row['moc_2026']) if 'moc_2026' in row and pd.notna(row['moc_2026']) else 0.0,
-                'moc_2027': float(row['moc_2027']) if 'moc_2027' in row and pd.notna(row['moc_2027']) else 0.0,
-                'moc_2028': float(row['moc_2028']) if 'moc_2028' in row and pd.notna(row['moc_2028']) else 0.0,
-                'moc_2029': float(row['moc_2029']) if 'moc_2029' in row and pd.notna(row['moc_2029']) else 0.0,
-                'moc_2030': float(row['moc_2030']) if 'moc_2030' in row and pd.notna(row['moc_2030']) else 0.0
-            })
+        def kolumna(nazwa, domyslna):
+            if nazwa not in df:
+                return [domyslna] * len(df)
+            return df[nazwa].astype(object).where(df[nazwa].notna(), domyslna).tolist()
+
+        moce = zip(*(pd.to_numeric(df[k], errors='coerce').fillna(0.0).astype(float).tolist() if k in df
+                     else [0.0] * len(df) for k in KOLUMNY_MOCY))
+        for wiersz in zip(df['nazwa'].tolist(), df['adres'].tolist(), df['miasto'].tolist(),
+                          kolumna('kod_pocztowy', ''), df['latitude'].astype(float).tolist(),
+                          df['longitude'].astype(float).tolist(), df['dostepna_moc'].astype(float).tolist(),
+                          kolumna('dystrybutor', 'Nieznany'), moce):
+            gpz_data.append(GpzRecord(*wiersz))
     except Exception as e:
         print(f"Błąd wczytywania danych GPZ: {e}")
     
     return gpz_data
+
+# Zapis pliku CSV z danymi GPZ. Dopisywanie odbywa się w miejscu pod blokadą
+# pliku, a zmiany i usuwanie przez zapis do pliku tymczasowego i os.replace,
+# więc czytelnik nigdy nie zobaczy pliku zapisanego w połowie. Każdy zapis
+# zwiększa licznik wersji (plik .version), po którym rejestry GPZ wszystkich
+# procesów poznają, że muszą przeładować dane.
+class GpzCsvWriter:
+    @property
+    def sciezka(self):
+        return app.config['GPZ_CSV_PATH']
+
+    @contextmanager
+    def _blokada(self):
+        with open(self.sciezka + '.lock', 'a+b') as plik_blokady:
+            if fcntl is not None:
+                fcntl.flock(plik_blokady, fcntl.LOCK_EX)
+            else:
+                plik_blokady.seek(0)
+                msvcrt.locking(plik_blokady.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(plik_blokady, fcntl.LOCK_UN)
+                else:
+                    plik_blokady.seek(0)
+                    msvcrt.locking(plik_blokady.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def wersja(self):
+        try:
+            with open(self.sciezka + '.version', encoding='utf-8') as plik:
+                return int(plik.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _zapisz_atomowo(self, sciezka, zapis, binarnie=False):
+        katalog = os.path.dirname(os.path.abspath(sciezka))
+        deskryptor, tymczasowy = tempfile.mkstemp(dir=katalog, prefix='.gpz-', suffix='.tmp')
+        try:
+            with (os.fdopen(deskryptor, 'wb') if binarnie else
+                  os.fdopen(deskryptor, 'w', newline='', encoding='utf-8')) as plik:
+                zapis(plik)
+                plik.flush()
+                os.fsync(plik.fileno())
+            os.replace(tymczasowy, sciezka)
+        except BaseException:
+            if os.path.exists(tymczasowy):
+                os.remove(tymczasowy)
+            raise
+
+    def _zwieksz_wersje(self):
+        nowa = self.wersja() + 1
+        self._zapisz_atomowo(self.sciezka + '.version', lambda plik: plik.write(str(nowa)))
+        return nowa
+
+    # Dopisanie wierszy na końcu pliku - koszt zależy tylko od liczby nowych wierszy
+    def dopisz(self, wiersze):
+        if not wiersze:
+            return self.wersja()
+        with self._blokada():
+            # Nagłówek, zakończenie wierszy i ostatni znak sprawdzane w trybie binarnym -
+            # dopisane wiersze mają takie same zakończenia jak reszta pliku
+            with open(self.sciezka, 'rb') as plik:
+                pierwszy = plik.readline()
+                plik.seek(0, os.SEEK_END)
+                koniec = plik.tell()
+                if koniec > 0:
+                    plik.seek(koniec - 1)
+                brak_konca_wiersza = koniec > 0 and plik.read(1) != b'\n'
+            naglowek = next(csv.reader([pierwszy.decode('utf-8-sig')]), None) or KOLUMNY_GPZ
+            zakonczenie = '\r\n' if pierwszy.endswith(b'\r\n') else '\n'
+            with open(self.sciezka, 'a', newline='', encoding='utf-8') as plik:
+                if brak_konca_wiersza:
+                    plik.write(zakonczenie)
+                writer = csv.DictWriter(plik, fieldnames=naglowek, extrasaction='ignore', lineterminator=zakonczenie)
+                writer.writerows(wiersze)
+                plik.flush()
+                os.fsync(plik.fileno())
+            return self._zwieksz_wersje()
+
+    # Zmiana zawartości pliku: funkcja dostaje listę wierszy i zwraca nową listę
+    # (albo None, gdy nic nie trzeba zapisywać)
+    def przepisz(self, zmiana):
+        with self._blokada():
+            with open(self.sciezka, newline='', encoding='utf-8') as plik:
+                reader = csv.DictReader(plik)
+                naglowek = reader.fieldnames or KOLUMNY_GPZ
+                wiersze = list(reader)
+            nowe_wiersze = zmiana(wiersze)
+            if nowe_wiersze is None:
+                return None
+
+            def zapis(plik):
+                writer = csv.DictWriter(plik, fieldnames=naglowek, extrasaction='ignore', lineterminator='\n')
+                writer.writeheader()
+                writer.writerows(nowe_wiersze)
+
+            self._zapisz_atomowo(self.sciezka, zapis)
+            return self._zwieksz_wersje()
+
+    # Usunięcie GPZ o podanej pozycji w pliku (nazwa chroni przed usunięciem innego wiersza)
+    def usun(self, indeks, nazwa):
+        def zmiana(wiersze):
+            if 0 <= indeks < len(wiersze) and wiersze[indeks].get('nazwa') == nazwa:
+                return wiersze[:indeks] + wiersze[indeks + 1:]
+            return None
+        return self.przepisz(zmiana) is not None
+
+gpz_csv_writer = GpzCsvWriter()
+
+# Binarny zrzut GPZ: nagłówek JSON (liczba GPZ, sygnatura źródłowego CSV,
+# położenie tablic) i tablice wyrównane do 64 bajtów - współrzędne, moce,
+# kody pól tekstowych oraz tablica napisów. Plik jest mapowany do pamięci
+# tylko do odczytu, więc wszystkie procesy dzielą jedną kopię w pamięci
+# podręcznej stron, a rekordy GPZ powstają dopiero przy odczycie wiersza.
+# Nowa wersja zastępuje plik atomowo (os.replace); procesy, które mają
+# zmapowaną starą wersję, czytają ją do czasu przeładowania.
+class GpzBinarySnapshot:
+    MAGIC = b'GPZSNAP1'
+    WYROWNANIE = 64
+    KOLUMNY_TEKSTOWE = ('nazwa', 'adres', 'miasto', 'kod_pocztowy', 'dystrybutor')
+
+    @staticmethod
+    def sciezka():
+        return app.config['GPZ_CSV_PATH'] + '.snap'
+
+    @classmethod
+    def zapisz(cls, gpz_data, sciezka, zrodlo):
+        napisy = {}
+        tablice = {
+            'latitude': np.array([g['latitude'] for g in gpz_data], dtype=np.float64),
+            'longitude': np.array([g['longitude'] for g in gpz_data], dtype=np.float64),
+            'dostepna_moc': np.array([g['dostepna_moc'] for g in gpz_data], dtype=np.float64),
+            'moce': np.array([[g.get(k, 0.0) for k in KOLUMNY_MOCY] for g in gpz_data],
+                             dtype=np.float64).reshape(len(gpz_data), len(KOLUMNY_MOCY)),
+        }
+        for kolumna in cls.KOLUMNY_TEKSTOWE:
+            tablice[kolumna] = np.array([napisy.setdefault(str(g.get(kolumna) or ''), len(napisy)) for g in gpz_data],
+                                        dtype=np.int32)
+        zakodowane = [napis.encode('utf-8') for napis in napisy]
+        tablice['napisy_offsety'] = np.cumsum([0] + [len(n) for n in zakodowane], dtype=np.uint64)
+        tablice['napisy'] = np.frombuffer(b''.join(zakodowane), dtype=np.uint8)
+
+        uklad = {}
+        przesuniecie = 0
+        for nazwa, tablica in tablice.items():
+            uklad[nazwa] = [przesuniecie, tablica.dtype.str, list(tablica.shape)]
+            przesuniecie += -(-tablica.nbytes // cls.WYROWNANIE) * cls.WYROWNANIE
+        naglowek = json.dumps({'liczba': len(gpz_data), 'zrodlo': zrodlo, 'tablice': uklad}).encode('utf-8')
+        poczatek_danych = -(-(len(cls.MAGIC) + 4 + len(naglowek)) // cls.WYROWNANIE) * cls.WYROWNANIE
+
+        def zapis(plik):
+            plik.write(cls.MAGIC + np.uint32(len(naglowek)).tobytes() + naglowek)
+            for nazwa, tablica in tablice.items():
+                plik.seek(poczatek_danych + uklad[nazwa][0])
+                plik.write(np.ascontiguousarray(tablica).tobytes())
+            plik.truncate(poczatek_danych + przesuniecie)
+
+        gpz_csv_writer._zapisz_atomowo(sciezka, zapis, binarnie=True)
+
+    # Otwiera zrzut; None, jeśli plik nie istnieje, jest uszkodzony (np. obcięty
+    # albo z nieprawidłowym nagłówkiem) lub powstał z innej wersji pliku CSV niż
+    # oczekiwana - wtedy zrzut zostanie zbudowany od nowa z CSV
+    @classmethod
+    def otworz(cls, sciezka, zrodlo=None):
+        try:
+            dane = np.memmap(sciezka, dtype=np.uint8, mode='r')
+        except (OSError, ValueError):
+            return None
+        try:
+            return cls._odczytaj(dane, zrodlo)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            print(f"Uszkodzony binarny zrzut GPZ {sciezka}: {e}")
+            return None
+
+    @classmethod
+    def _odczytaj(cls, dane, zrodlo):
+        koniec_dlugosci = len(cls.MAGIC) + 4
+        if len(dane) < koniec_dlugosci or dane[:len(cls.MAGIC)].tobytes() != cls.MAGIC:
+            raise ValueError('brak nagłówka')
+        dlugosc = int(dane[len(cls.MAGIC):koniec_dlugosci].view(np.uint32)[0])
+        if koniec_dlugosci + dlugosc > len(dane):
+            raise ValueError('nagłówek poza końcem pliku')
+        naglowek = json.loads(dane[koniec_dlugosci:koniec_dlugosci + dlugosc].tobytes())
+        if zrodlo is not None and naglowek['zrodlo'] != zrodlo:
+            return None
+        liczba = int(naglowek['liczba'])
+        poczatek_danych = -(-(koniec_dlugosci + dlugosc) // cls.WYROWNANIE) * cls.WYROWNANIE
+        tablice = {}
+        for nazwa, (przesuniecie, typ, ksztalt) in naglowek['tablice'].items():
+            typ = np.dtype(typ)
+            poczatek = poczatek_danych + int(przesuniecie)
+            liczba_bajtow = int(np.prod(ksztalt, dtype=np.int64)) * typ.itemsize
+            if przesuniecie < 0 or min(ksztalt, default=0) < 0 or poczatek + liczba_bajtow > len(dane):
+                raise ValueError(f'tablica {nazwa} poza końcem pliku')
+            tablice[nazwa] = dane[poczatek:poczatek + liczba_bajtow].view(typ).reshape(ksztalt)
+
+        for nazwa in ('latitude', 'longitude', 'dostepna_moc') + cls.KOLUMNY_TEKSTOWE:
+            if tablice[nazwa].shape != (liczba,):
+                raise ValueError(f'nieprawidłowy rozmiar tablicy {nazwa}')
+        if tablice['moce'].shape != (liczba, len(KOLUMNY_MOCY)):
+            raise ValueError('nieprawidłowy rozmiar tablicy moce')
+        offsety = tablice['napisy_offsety']
+        if not len(offsety) or int(offsety[-1]) != len(tablice['napisy']):
+            raise ValueError('nieprawidłowe offsety napisów')
+        return GpzBinaryRows(tablice, liczba)
+
+# Wiersze binarnego zrzutu jako sekwencja rekordów GPZ tworzonych przy odczycie
+class GpzBinaryRows:
+    def __init__(self, tablice, liczba):
+        self._tablice = tablice
+        self._liczba = liczba
+        self._napisy = {}
+
+    def __len__(self):
+        return self._liczba
+
+    # Tablice współrzędnych bez kopiowania - GpzSnapshot nie przechodzi po rekordach
+    @property
+    def wspolrzedne(self):
+        return self._tablice['latitude'], self._tablice['longitude']
+
+    @property
+    def macierz_mocy(self):
+        return self._tablice['moce']
+
+    def _napis(self, kod):
+        napis = self._napisy.get(kod)
+        if napis is None:
+            offsety = self._tablice['napisy_offsety']
+            napis = self._tablice['napisy'][int(offsety[kod]):int(offsety[kod + 1])].tobytes().decode('utf-8')
+            napis = self._napisy[kod] = sys.intern(napis)
+        return napis
+
+    def __getitem__(self, indeks):
+        if isinstance(indeks, slice):
+            return [self[i] for i in range(*indeks.indices(self._liczba))]
+        if indeks < 0:
+            indeks += self._liczba
+        if not 0 <= indeks < self._liczba:
+            raise IndexError(indeks)
+        t = self._tablice
+        teksty = [self._napis(int(t[kolumna][indeks])) for kolumna in GpzBinarySnapshot.KOLUMNY_TEKSTOWE]
+        return GpzRecord(*teksty[:4], float(t['latitude'][indeks]), float(t['longitude'][indeks]),
+                         float(t['dostepna_moc'][indeks]), teksty[4], t['moce'][indeks].tolist())
+
+    def __iter__(self):
+        for i in range(self._liczba):
+            yield self[i]
+
+# Dane GPZ z binarnego zrzutu zgodnego z sygnaturą pliku CSV; brak zgodnego
+# zrzutu oznacza jednorazowe sparsowanie CSV i zapisanie nowego zrzutu
+def wczytaj_gpz_binarnie(sygnatura):
+    if sygnatura[1] is None:
+        return None
+    zrodlo = list(sygnatura[1:])
+    sciezka = GpzBinarySnapshot.sciezka()
+    wiersze = GpzBinarySnapshot.otworz(sciezka, zrodlo)
+    if wiersze is None:
+        GpzBinarySnapshot.zapisz(load_gpz_data(), sciezka, zrodlo)
+        wiersze = GpzBinarySnapshot.otworz(sciezka, zrodlo)
+    return wiersze
+
+# Rekord GPZ z wiersza tabeli gpz i jego prognoz mocy (pola jak w load_gpz_data)
+def gpz_z_bazy(gpz, moce):
+    return GpzRecord(gpz.nazwa, gpz.adres, gpz.miasto, gpz.kod_pocztowy or '', gpz.latitude, gpz.longitude,
+                     gpz.dostepna_moc, gpz.dystrybutor or 'Nieznany',
+                     [moce.get(kolumna, 0.0) for kolumna in KOLUMNY_MOCY], id=gpz.id)
+
+# Funkcja do wczytania danych GPZ z bazy danych (dwa zapytania zamiast jednego na GPZ)
+@metrics.mierz('wczytywanie_bazy')
+def load_gpz_data_db(identyfikatory=None):
+    with app.app_context():
+        zapytanie_moce = db.select(GpzMoc.gpz_id, GpzMoc.rok, GpzMoc.moc)
+        zapytanie_gpz = db.select(Gpz).order_by(Gpz.id)
+        if identyfikatory is not None:
+            zapytanie_moce = zapytanie_moce.where(GpzMoc.gpz_id.in_(identyfikatory))
+            zapytanie_gpz = zapytanie_gpz.where(Gpz.id.in_(identyfikatory))
+
+        prognozy = {}
+        for gpz_id, rok, moc in db.session.execute(zapytanie_moce):
+            prognozy.setdefault(gpz_id, {})[f'moc_{rok}'] = moc
+        return [gpz_z_bazy(gpz, prognozy.get(gpz.id, {})) for gpz in db.session.execute(zapytanie_gpz).scalars()]
+
+# Dodanie GPZ do bazy danych - wiersze w formacie pliku CSV
+def dodaj_gpz_do_bazy(wiersze):
+    with app.app_context():
+        for wiersz in wiersze:
+            db.session.add(Gpz(
+                nazwa=wiersz['nazwa'],
+                adres=wiersz['adres'],
+                miasto=wiersz['miasto'],
+                kod_pocztowy=wiersz.get('kod_pocztowy') or None,
+                latitude=float(wiersz['latitude']),
+                longitude=float(wiersz['longitude']),
+                dostepna_moc=float(wiersz['dostepna_moc']),
+                dystrybutor=wiersz.get('dystrybutor'),
+                prognozy=[GpzMoc(rok=int(kolumna[4:]), moc=float(wiersz.get(kolumna) or 0.0)) for kolumna in KOLUMNY_MOCY],
+            ))
+        db.session.commit()
+
+# Kolumny dodane do istniejących tabel (db.create_all tworzy tylko brakujące tabele)
+KOLUMNY_UZUPELNIANE = [
+    ('registration_key', 'partia', 'VARCHAR(32)'),
+]
+
+def uzupelnij_schemat():
+    inspektor = inspect(db.engine)
+    with db.engine.begin() as polaczenie:
+        for tabela, kolumna, typ in KOLUMNY_UZUPELNIANE:
+            if kolumna not in {k['name'] for k in inspektor.get_columns(tabela)}:
+                polaczenie.execute(text(f'ALTER TABLE {tabela} ADD COLUMN {kolumna} {typ}'))
+                polaczenie.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{tabela}_{kolumna} ON {tabela} ({kolumna})'))
+
+# Indeks R*Tree SQLite nad współrzędnymi GPZ (jeśli SQLite ma moduł rtree)
+RTREE_GPZ = {'dostepny': False}
+
+def przygotuj_rtree_gpz():
+    if db.engine.dialect.name != 'sqlite':
+        return
+    try:
+        with db.engine.begin() as polaczenie:
+            polaczenie.execute(text(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS gpz_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)'
+            ))
+            # Odbudowa indeksu, jeśli nie odpowiada tabeli gpz (np. po ręcznych zmianach)
+            niezgodne = polaczenie.execute(text(
+                'SELECT (SELECT count(*) FROM gpz) != (SELECT count(*) FROM gpz_rtree JOIN gpz USING (id))'
+                ' OR (SELECT count(*) FROM gpz) != (SELECT count(*) FROM gpz_rtree)'
+            )).scalar()
+            if niezgodne:
+                polaczenie.execute(text('DELETE FROM gpz_rtree'))
+                polaczenie.execute(text(
+                    'INSERT INTO gpz_rtree SELECT id, latitude, latitude, longitude, longitude FROM gpz'
+                ))
+        RTREE_GPZ['dostepny'] = True
+    except Exception as e:
+        print(f"Indeks R*Tree niedostępny, używane będą indeksy B-drzewa: {e}")
+        RTREE_GPZ['dostepny'] = False
+
+@event.listens_for(Gpz, 'after_insert')
+@event.listens_for(Gpz, 'after_update')
+def _gpz_rtree_zapisz(mapper, polaczenie, gpz):
+    if RTREE_GPZ['dostepny']:
+        polaczenie.execute(text('INSERT OR REPLACE INTO gpz_rtree VALUES (:id, :lat, :lat, :lon, :lon)'),
+                           {'id': gpz.id, 'lat': gpz.latitude, 'lon': gpz.longitude})
+
+@event.listens_for(Gpz, 'after_delete')
+def _gpz_rtree_usun(mapper, polaczenie, gpz):
+    if RTREE_GPZ['dostepny']:
+        polaczenie.execute(text('DELETE FROM gpz_rtree WHERE id = :id'), {'id': gpz.id})
+
+def zwieksz_wersje_gpz(polaczenie):
+    if not polaczenie.execute(db.update(GpzMeta).where(GpzMeta.id == 1).values(wersja=GpzMeta.wersja + 1)).rowcount:
+        polaczenie.execute(db.insert(GpzMeta).values(id=1, wersja=1))
+
+# Jedno podbicie wersji na flush zmieniający GPZ lub ich prognozy (także przy imporcie wielu wierszy)
+@event.listens_for(db.session, 'after_flush')
+def _gpz_wersja_po_zapisie(sesja, kontekst):
+    if any(isinstance(obiekt, (Gpz, GpzMoc)) for obiekt in (*sesja.new, *sesja.dirty, *sesja.deleted)):
+        zwieksz_wersje_gpz(sesja.connection())
+
+# Dane GPZ z magazynu wybranego w konfiguracji
+def wczytaj_gpz():
+    if app.config['GPZ_STORAGE'] == 'db':
+        return load_gpz_data_db()
+    return load_gpz_data()
+
+# Średni promień Ziemi używany w przybliżeniu sferycznym
+PROMIEN_ZIEMI_KM = 6371.0088
+# Górne ograniczenie względnej różnicy między odległością na sferze
+# a odległością geodezyjną na elipsoidzie WGS84 (faktycznie ok. 0,5%)
+BLAD_SFERY = 0.01
+# Liczba dodatkowych kandydatów pobieranych z indeksu ponad limit wyników
+ZAPAS_KANDYDATOW = 2
+
+# Zamiana współrzędnych geograficznych na wektory jednostkowe 3D
+def wektory_jednostkowe(lat, lon):
+    lat_r = np.radians(np.asarray(lat, dtype=np.float64))
+    lon_r = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat_r)
+    return np.stack((cos_lat * np.cos(lon_r), cos_lat * np.sin(lon_r), np.sin(lat_r)), axis=-1)
+
+# Odległość po okręgu wielkim (wzór haversine) liczona wektorowo; współrzędne
+# tablic podane w radianach razem z cosinusem szerokości
+def haversine_km(lat, lon, lat_rad, lon_rad, cos_lat):
+    lat0 = np.radians(lat)
+    lon0 = np.radians(lon)
+    a = np.sin((lat_rad - lat0) / 2.0) ** 2 + np.cos(lat0) * cos_lat * np.sin((lon_rad - lon0) / 2.0) ** 2
+    return 2.0 * PROMIEN_ZIEMI_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+# Indeksy k najmniejszych wartości, posortowane rosnąco (remisy wg indeksu)
+def najmniejsze_indeksy(wartosci, k):
+    if k < len(wartosci):
+        wybrane = np.argpartition(wartosci, k - 1)[:k]
+    else:
+        wybrane = np.arange(len(wartosci))
+    return wybrane[np.lexsort((wybrane, wartosci[wybrane]))]
+
+# Długość cięciwy sfery jednostkowej odpowiadająca odległości po łuku w km
+def km_na_cieciwe(km):
+    kat = km / PROMIEN_ZIEMI_KM
+    if kat >= math.pi:
+        return 2.0
+    return 2.0 * math.sin(kat / 2.0)
+
+# Indeks przestrzenny GPZ - drzewo k-d nad wektorami jednostkowymi.
+# Odległość euklidesowa (cięciwa) jest monotoniczna względem odległości
+# po okręgu wielkim, więc najbliżsi sąsiedzi na sferze są najbliżsi w 3D.
+class GpzSpatialIndex:
+    ROZMIAR_LISCIA = 32
+
+    def __init__(self, lat, lon):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        # Wiersze bez poprawnych współrzędnych nie trafiają do indeksu
+        poprawne = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+        self._kolejnosc = poprawne
+        self._start = []
+        self._koniec = []
+        self._lewy = []
+        self._prawy = []
+        dolne = []
+        gorne = []
+
+        punkty = wektory_jednostkowe(lat[poprawne], lon[poprawne]).reshape(-1, 3)
+        pozycje = np.arange(len(poprawne))
+        if len(pozycje):
+            self._zbuduj(punkty, pozycje, 0, len(pozycje), dolne, gorne)
+
+        # Punkty ułożone w kolejności liści - skan liścia to ciągły wycinek
+        self._punkty = np.ascontiguousarray(punkty[pozycje])
+        self._kolejnosc = poprawne[pozycje]
+        self._dolne = np.array(dolne).reshape(-1, 3)
+        self._gorne = np.array(gorne).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self._kolejnosc)
+
+    def _zbuduj(self, punkty, pozycje, start, koniec, dolne, gorne):
+        wezel = len(self._start)
+        fragment = punkty[pozycje[start:koniec]]
+        dol = fragment.min(axis=0)
+        gora = fragment.max(axis=0)
+        self._start.append(start)
+        self._koniec.append(koniec)
+        self._lewy.append(-1)
+        self._prawy.append(-1)
+        dolne.append(dol)
+        gorne.append(gora)
+
+        if koniec - start <= self.ROZMIAR_LISCIA:
+            return wezel
+
+        # Podział wzdłuż najszerszej osi w medianie
+        os_podzialu = int(np.argmax(gora - dol))
+        srodek = (koniec - start) // 2
+        podzial = np.argpartition(fragment[:, os_podzialu], srodek)
+        pozycje[start:koniec] = pozycje[start:koniec][podzial]
+
+        self._lewy[wezel] = self._zbuduj(punkty, pozycje, start, start + srodek, dolne, gorne)
+        self._prawy[wezel] = self._zbuduj(punkty, pozycje, start + srodek, koniec, dolne, gorne)
+        return wezel
+
+    def _odleglosc_do_wezla(self, wezel, punkt):
+        roznica = np.maximum(self._dolne[wezel] - punkt, 0.0) + np.maximum(punkt - self._gorne[wezel], 0.0)
+        return float(roznica @ roznica)
+
+    # Zwraca indeksy (w liście GPZ) k najbliższych punktów i kwadraty cięciw
+    def najblizsze(self, lat, lon, k):
+        if not len(self) or k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        punkt = wektory_jednostkowe(lat, lon)
+        najlepsze_d2 = np.empty(0)
+        najlepsze_poz = np.empty(0, dtype=np.intp)
+        kolejka = [(0.0, 0)]
+
+        while kolejka:
+            minimum, wezel = heapq.heappop(kolejka)
+            if len(najlepsze_d2) == k and minimum > najlepsze_d2.max():
+                break
+            lewy = self._lewy[wezel]
+            if lewy < 0:
+                start, koniec = self._start[wezel], self._koniec[wezel]
+                roznica = self._punkty[start:koniec] - punkt
+                d2 = np.einsum('ij,ij->i', roznica, roznica)
+                najlepsze_d2 = np.concatenate((najlepsze_d2, d2))
+                najlepsze_poz = np.concatenate((najlepsze_poz, np.arange(start, koniec)))
+                if len(najlepsze_d2) > k:
+                    wybrane = np.argpartition(najlepsze_d2, k - 1)[:k]
+                    najlepsze_d2 = najlepsze_d2[wybrane]
+                    najlepsze_poz = najlepsze_poz[wybrane]
+                continue
+            for dziecko in (lewy, self._prawy[wezel]):
+                heapq.heappush(kolejka, (self._odleglosc_do_wezla(dziecko, punkt), dziecko))
+
+        porzadek = np.argsort(najlepsze_d2, kind='stable')
+        return self._kolejnosc[najlepsze_poz[porzadek]], najlepsze_d2[porzadek]
+
+    # Zwraca indeksy wszystkich punktów w zasięgu cięciwy i kwadraty cięciw
+    def w_promieniu(self, lat, lon, cieciwa):
+        if not len(self):
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        punkt = wektory_jednostkowe(lat, lon)
+        limit_d2 = cieciwa * cieciwa
+        pozycje = []
+        odleglosci = []
+        stos = [0]
+
+        while stos:
+            wezel = stos.pop()
+            if self._odleglosc_do_wezla(wezel, punkt) > limit_d2:
+                continue
+            lewy = self._lewy[wezel]
+            if lewy < 0:
+                start, koniec = self._start[wezel], self._koniec[wezel]
+                roznica = self._punkty[start:koniec] - punkt
+                d2 = np.einsum('ij,ij->i', roznica, roznica)
+                maska = d2 <= limit_d2
+                pozycje.append(np.flatnonzero(maska) + start)
+                odleglosci.append(d2[maska])
+                continue
+            stos.append(self._prawy[wezel])
+            stos.append(lewy)
+
+        if not pozycje:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        return self._kolejnosc[np.concatenate(pozycje)], np.concatenate(odleglosci)
+
+# Podzbiór GPZ z mocą w danej kolumnie (dostepna_moc lub moc_RRRR) nie mniejszą
+# niż próg, opcjonalnie tylko spośród podanych pozycji (GPZ jednego dystrybutora),
+# z własnymi tablicami współrzędnych.
+# Moc pochodzi z gotowych tablic zrzutu: bieżąca z indeksu tabeli, prognozy
+# z kolumny macierzy float32 (porównania z min_moc też w float32).
+# Drzewo k-d dla podzbioru budowane jest dopiero, gdy podzbiór jest za duży
+# na wektorowy skan.
+class GpzCapacityIndex:
+    def __init__(self, snapshot, kolumna, prog, pozycje=None):
+        if kolumna == 'dostepna_moc':
+            moc = snapshot.tabela().moc
+        else:
+            moc = snapshot.prognoza().macierz[:, KOLUMNY_MOCY.index(kolumna)]
+        if pozycje is None:
+            self.pozycje = np.flatnonzero(moc >= prog)
+        else:
+            self.pozycje = np.sort(pozycje[moc[pozycje] >= prog])
+        self.moc = moc[self.pozycje]
+        self.lat = snapshot.lat[self.pozycje]
+        self.lon = snapshot.lon[self.pozycje]
+        self.lat_rad = snapshot.lat_rad[self.pozycje]
+        self.lon_rad = snapshot.lon_rad[self.pozycje]
+        self.cos_lat = snapshot.cos_lat[self.pozycje]
+        self._drzewo = None
+
+    def __len__(self):
+        return len(self.pozycje)
+
+    def drzewo(self):
+        if self._drzewo is None:
+            self._drzewo = GpzSpatialIndex(self.lat, self.lon)
+        return self._drzewo
+
+# Prognoza dostępnej mocy wszystkich GPZ jako jedna macierz float32 (GPZ x rok).
+# Moc w dowolnym roku (także ułamkowym, np. 2027.5) to interpolacja liniowa
+# sąsiednich kolumn; poza zakresem prognozy obowiązuje pierwszy/ostatni rok.
+# Sumy i mediany według dystrybutora i miasta liczone są raz dla wszystkich
+# lat prognozy - raport to operacja na macierzy, a nie przegląd słowników.
+class GpzForecast:
+    GRUPOWANIA = ('dystrybutor', 'miasto')
+
+    def __init__(self, gpz):
+        self.roki = np.array(ROKI_PROGNOZY, dtype=np.float64)
+        macierz = getattr(gpz, 'macierz_mocy', None)
+        if macierz is not None:
+            macierz = macierz.astype(np.float32)
+        else:
+            macierz = np.fromiter(
+                (g.get(kolumna) or 0.0 for g in gpz for kolumna in KOLUMNY_MOCY), dtype=np.float32,
+                count=len(gpz) * len(KOLUMNY_MOCY)
+            ).reshape(len(gpz), len(KOLUMNY_MOCY))
+        self.macierz = np.nan_to_num(macierz, nan=0.0)
+        self._grupy = {}
+        for kolumna in self.GRUPOWANIA:
+            etykiety = [g.get(kolumna) if isinstance(g.get(kolumna), str) else 'Nieznany' for g in gpz]
+            nazwy, kody = np.unique(np.array(etykiety, dtype=object), return_inverse=True)
+            self._grupy[kolumna] = (nazwy.tolist(), kody.reshape(-1))
+        self._agregaty = {}
+
+    def __len__(self):
+        return len(self.macierz)
+
+    # Wagi interpolacji liniowej: (indeks kolumny, indeks następnej, udział następnej)
+    def _wagi(self, rok):
+        rok = min(max(float(rok), self.roki[0]), self.roki[-1])
+        i = min(int(np.searchsorted(self.roki, rok, side='right')) - 1, len(self.roki) - 1)
+        j = min(i + 1, len(self.roki) - 1)
+        udzial = 0.0 if i == j else (rok - self.roki[i]) / (self.roki[j] - self.roki[i])
+        return i, j, np.float32(udzial)
+
+    # Moc wszystkich GPZ w danym roku (wektor float32)
+    def dla_roku(self, rok):
+        i, j, udzial = self._wagi(rok)
+        if udzial == 0:
+            return self.macierz[:, i]
+        return self.macierz[:, i] * (1 - udzial) + self.macierz[:, j] * udzial
+
+    @staticmethod
+    def _mediany(wartosci, kody, liczba_grup):
+        # Sortowanie po (grupa, wartość) w każdej kolumnie; mediana to środek bloku grupy
+        porzadek = np.lexsort((wartosci, np.broadcast_to(kody[:, None], wartosci.shape)), axis=0)
+        posortowane = np.take_along_axis(wartosci, porzadek, axis=0)
+        liczby = np.bincount(kody, minlength=liczba_grup)
+        poczatki = np.concatenate(([0], np.cumsum(liczby)[:-1]))
+        dolne = poczatki + (liczby - 1) // 2
+        gorne = poczatki + liczby // 2
+        return (posortowane[dolne] + posortowane[gorne]) / 2
+
+    # Liczba GPZ oraz suma i mediana mocy każdej grupy dla wszystkich lat prognozy
+    def agregaty(self, grupuj):
+        wynik = self._agregaty.get(grupuj)
+        if wynik is None:
+            nazwy, kody = self._grupy[grupuj]
+            liczby = np.bincount(kody, minlength=len(nazwy))
+            sumy = np.zeros((len(nazwy), len(self.roki)), dtype=np.float64)
+            np.add.at(sumy, kody, self.macierz)
+            mediany = self._mediany(self.macierz, kody, len(nazwy)) if len(self) else sumy
+            wynik = self._agregaty[grupuj] = {'grupy': nazwy, 'liczba': liczby, 'suma': sumy, 'mediana': mediany}
+        return wynik
+
+    # Agregaty grup w dowolnym roku: suma jest liniowa, więc interpolowana
+    # z gotowych sum; mediana liczona z interpolowanego wektora mocy
+    def agregaty_dla_roku(self, grupuj, rok):
+        agregaty = self.agregaty(grupuj)
+        i, j, udzial = self._wagi(rok)
+        if udzial == 0:
+            return agregaty['grupy'], agregaty['liczba'], agregaty['suma'][:, i], agregaty['mediana'][:, i]
+        nazwy, kody = self._grupy[grupuj]
+        sumy = agregaty['suma'][:, i] * (1 - udzial) + agregaty['suma'][:, j] * udzial
+        mediany = self._mediany(self.dla_roku(rok)[:, None], kody, len(nazwy))[:, 0]
+        return nazwy, agregaty['liczba'], sumy, mediany
+
+# Niezmienny zrzut danych GPZ - żądania dostają zawsze kompletną listę
+# razem z ciągłymi tablicami współrzędnych i indeksem przestrzennym
+# zbudowanymi dokładnie dla tej listy
+class GpzSnapshot:
+    __slots__ = ('gpz', 'sygnatura', 'wersja', 'lat', 'lon', 'lat_rad', 'lon_rad', 'cos_lat', 'indeks', '_tabela',
+                 '_indeksy_mocy', '_indeksy_mocy_lock', '_prognoza')
+
+    def __init__(self, gpz, sygnatura, wersja):
+        self.gpz = gpz
+        self.sygnatura = sygnatura
+        self.wersja = wersja
+        wspolrzedne = getattr(gpz, 'wspolrzedne', None)
+        if wspolrzedne is not None:
+            self.lat, self.lon = wspolrzedne
+        else:
+            self.lat = np.fromiter((g['latitude'] for g in gpz), dtype=np.float64, count=len(gpz))
+            self.lon = np.fromiter((g['longitude'] for g in gpz), dtype=np.float64, count=len(gpz))
+        self.lat_rad = np.radians(self.lat)
+        self.lon_rad = np.radians(self.lon)
+        self.cos_lat = np.cos(self.lat_rad)
+        self.indeks = GpzSpatialIndex(self.lat, self.lon)
+        self._tabela = None
+        self._indeksy_mocy = OrderedDict()
+        self._indeksy_mocy_lock = threading.Lock()
+        self._prognoza = None
+
+    # Indeks tabeli panelu administracyjnego budowany przy pierwszym użyciu
+    def tabela(self):
+        if self._tabela is None:
+            self._tabela = GpzTableIndex(self.gpz)
+        return self._tabela
+
+    # Macierz prognoz mocy (GPZ x rok) budowana przy pierwszym użyciu
+    def prognoza(self):
+        if self._prognoza is None:
+            self._prognoza = GpzForecast(self.gpz)
+        return self._prognoza
+
+    # Indeks GPZ z mocą w kolumnie co najmniej równą najbliższemu progowi poniżej
+    # min_moc (i danego dystrybutora). Budowany przy pierwszym użyciu; zapamiętane
+    # są tylko indeksy dystrybutorów obecnych w danych (LRU, GPZ_INDEKSY_MOCY_MAX),
+    # nieznany dystrybutor daje pusty indeks bez przeglądania wszystkich GPZ.
+    def indeks_mocy(self, kolumna, min_moc, dystrybutor=None):
+        progi = [p for p in app.config['GPZ_PROGI_MOCY'] if p <= min_moc]
+        prog = max(progi) if progi else -math.inf
+        dystrybutor = klucz_tabeli(dystrybutor)
+        pozycje = self.tabela().pozycje_grupy('dystrybutor', dystrybutor) if dystrybutor else None
+        if pozycje is not None and not len(pozycje):
+            return GpzCapacityIndex(self, kolumna, prog, pozycje)
+
+        klucz = (kolumna, prog, dystrybutor)
+        with self._indeksy_mocy_lock:
+            indeks = self._indeksy_mocy.get(klucz)
+            if indeks is not None:
+                self._indeksy_mocy.move_to_end(klucz)
+                return indeks
+        indeks = GpzCapacityIndex(self, kolumna, prog, pozycje)
+        with self._indeksy_mocy_lock:
+            self._indeksy_mocy[klucz] = indeks
+            while len(self._indeksy_mocy) > app.config['GPZ_INDEKSY_MOCY_MAX']:
+                self._indeksy_mocy.popitem(last=False)
+        return indeks
+
+    # Odległości sferyczne do wszystkich GPZ; brak współrzędnych = nieskończoność
+    def odleglosci_sferyczne(self, lat, lon):
+        odleglosci = haversine_km(lat, lon, self.lat_rad, self.lon_rad, self.cos_lat)
+        odleglosci[np.isnan(odleglosci)] = np.inf
+        return odleglosci
+
+# Kolumny tabeli GPZ w panelu administracyjnym, po których można sortować
+KOLUMNY_TABELI_GPZ = ('nazwa', 'adres', 'miasto', 'kod_pocztowy', 'dostepna_moc', 'dystrybutor')
+
+def klucz_tabeli(wartosc):
+    return wartosc.strip().casefold() if isinstance(wartosc, str) else ''
+
+# Indeks tabeli GPZ: pozycje pogrupowane według dystrybutora, miasta i kodu
+# pocztowego (posortowane klucze - wyszukiwanie prefiksu przez bisect), moc
+# posortowana do progu minimalnej mocy oraz kolejności sortowania kolumn.
+# Strona tabeli kosztuje O(liczba pasujących), a bez filtrów O(rozmiar strony).
+class GpzTableIndex:
+    def __init__(self, gpz):
+        self.gpz = gpz
+        self.moc = np.fromiter((float(g.get('dostepna_moc') or 0) for g in gpz), dtype=np.float64, count=len(gpz))
+        self.po_mocy = np.argsort(self.moc, kind='stable')
+        self.moc_rosnaco = self.moc[self.po_mocy]
+        self._grupy = {}
+        for kolumna in ('dystrybutor', 'miasto', 'kod_pocztowy'):
+            grupy = {}
+            for i, g in enumerate(gpz):
+                grupy.setdefault(klucz_tabeli(g.get(kolumna)), []).append(i)
+            klucze = sorted(grupy)
+            self._grupy[kolumna] = (klucze, [np.array(grupy[k], dtype=np.int64) for k in klucze])
+        self._kolejnosci = {}
+
+    # Kolejność pozycji i ranga każdej pozycji dla sortowania po kolumnie
+    def _kolejnosc(self, kolumna):
+        wynik = self._kolejnosci.get(kolumna)
+        if wynik is None:
+            if kolumna == 'dostepna_moc':
+                kolejnosc = self.po_mocy
+            elif kolumna in KOLUMNY_TABELI_GPZ:
+                kolejnosc = np.array(sorted(range(len(self.gpz)), key=lambda i: klucz_tabeli(self.gpz[i].get(kolumna))),
+                                     dtype=np.int64)
+            else:
+                kolejnosc = np.arange(len(self.gpz))
+            rangi = np.empty(len(self.gpz), dtype=np.int64)
+            rangi[kolejnosc] = np.arange(len(self.gpz))
+            wynik = self._kolejnosci[kolumna] = (kolejnosc, rangi)
+        return wynik
+
+    def _pasujace(self, kolumna, wartosc, prefiks):
+        klucze, pozycje = self._grupy[kolumna]
+        wartosc = klucz_tabeli(wartosc)
+        od = bisect.bisect_left(klucze, wartosc)
+        do = bisect.bisect_left(klucze, wartosc + '\uffff') if prefiks else od + 1
+        if od >= len(klucze) or not klucze[od].startswith(wartosc) or (not prefiks and klucze[od] != wartosc):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(pozycje[od:do])
+
+    # Pozycje GPZ o dokładnie tej wartości kolumny grupującej (pusta tablica, gdy jej brak)
+    def pozycje_grupy(self, kolumna, wartosc):
+        return self._pasujace(kolumna, wartosc, False)
+
+    # Pozycje GPZ spełniających filtry; None oznacza brak filtrów (wszystkie)
+    def filtruj(self, dystrybutor=None, miasto=None, kod_pocztowy=None, min_moc=None):
+        wynik = None
+        for kolumna, wartosc, prefiks in (('dystrybutor', dystrybutor, False), ('miasto', miasto, True),
+                                          ('kod_pocztowy', kod_pocztowy, True)):
+            if wartosc:
+                pasujace = self._pasujace(kolumna, wartosc, prefiks)
+                wynik = pasujace if wynik is None else np.intersect1d(wynik, pasujace, assume_unique=True)
+        if min_moc is not None:
+            if wynik is None:
+                wynik = self.po_mocy[np.searchsorted(self.moc_rosnaco, min_moc, side='left'):]
+            else:
+                wynik = wynik[self.moc[wynik] >= min_moc]
+        return wynik
+
+    # Pozycje GPZ na danej stronie (numeracja od 1) oraz liczba wszystkich pasujących
+    def strona(self, filtry, sortuj=None, malejaco=False, strona=1, na_strone=50):
+        pozycje = self.filtruj(**filtry)
+        kolejnosc, rangi = self._kolejnosc(sortuj)
+        if pozycje is not None:
+            kolejnosc = pozycje[np.argsort(rangi[pozycje], kind='stable')]
+        if malejaco:
+            kolejnosc = kolejnosc[::-1]
+        poczatek = (strona - 1) * na_strone
+        return kolejnosc[poczatek:poczatek + na_strone], len(kolejnosc)
+
+# Rejestr GPZ współdzielony przez wszystkie żądania procesu. Plik CSV jest
+# parsowany tylko przy pierwszym użyciu, po zmianie jego mtime/rozmiaru
+# albo po jawnym unieważnieniu (np. zapis z panelu administracyjnego).
+class GpzRegistry:
+    def __init__(self):
+        self._snapshot = None
+        self._wersja = 0
+        self._lock = threading.Lock()
+        # Ostatnio odczytana wersja GPZ z bazy i czas odczytu (GPZ_DB_VERSION_CHECK)
+        self._wersja_bazy = None
+        self._odczyt_wersji_bazy = 0.0
+
+    def _sygnatura(self):
+        if app.config['GPZ_STORAGE'] == 'db':
+            teraz = time.monotonic()
+            if self._wersja_bazy is None or teraz - self._odczyt_wersji_bazy >= app.config['GPZ_DB_VERSION_CHECK']:
+                with app.app_context():
+                    self._wersja_bazy = db.session.execute(
+                        db.select(GpzMeta.wersja).where(GpzMeta.id == 1)
+                    ).scalar() or 0
+                self._odczyt_wersji_bazy = teraz
+            return ('db', self._wersja_bazy)
+        sciezka = app.config['GPZ_CSV_PATH']
+        try:
+            stat = os.stat(sciezka)
+        except OSError:
+            return (sciezka, None, None, None)
+        return (sciezka, stat.st_mtime_ns, stat.st_size, gpz_csv_writer.wersja())
+
+    def snapshot(self):
+        sygnatura = self._sygnatura()
+        snap = self._snapshot
+        if snap is not None and snap.sygnatura == sygnatura:
+            return snap
+
+        # Przeładowanie tylko w jednym wątku, pozostałe czekają na gotowy zrzut
+        with self._lock:
+            snap = self._snapshot
+            if snap is not None and snap.sygnatura == self._sygnatura():
+                return snap
+            return self._przeladuj()
+
+    def _przeladuj(self):
+        # Sygnatura pobrana przed odczytem - zmiana w trakcie wczytywania
+        # wymusi kolejne przeładowanie przy następnym żądaniu
+        sygnatura = self._sygnatura()
+        gpz_data = None
+        if app.config['GPZ_STORAGE'] != 'db' and app.config['GPZ_BINARY_SNAPSHOT']:
+            gpz_data = wczytaj_gpz_binarnie(sygnatura)
+        if gpz_data is None:
+            gpz_data = tuple(wczytaj_gpz())
+        if sygnatura[1] is None:
+            sygnatura = self._sygnatura()
+
+        self._wersja += 1
+        with metrics.etap('budowa_indeksu'):
+            snap = GpzSnapshot(gpz_data, sygnatura, self._wersja)
+        # Podmiana referencji jest atomowa - czytelnicy widzą stary albo nowy zrzut
+        self._snapshot = snap
+        return snap
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._wersja_bazy = None
+
+gpz_registry = GpzRegistry()
     
 # Inicjalizacja bazy danych i tworzenie konta administratora
 with app.app_context():
     db.create_all()
+    uzupelnij_schemat()
+    przygotuj_rtree_gpz()
     
     # Sprawdź czy istnieje konto administratora, jeśli nie - utwórz je
     admin_user = User.query.filter_by(username='GPZadmin').first()
@@ -168,6 +1373,299 @@ with app.app_context():
             db.session.rollback()
             print(f'Błąd podczas tworzenia konta administratora: {e}')
 
+# Normalizacja adresu używana jako klucz pamięci podręcznej geokodowania
+def normalizuj_adres(adres):
+    adres = unicodedata.normalize('NFC', adres).lower()
+    adres = re.sub(r'\s*,\s*', ', ', adres)
+    adres = re.sub(r'\s+', ' ', adres).strip(' ,')
+    return re.sub(r', polska$', '', adres)
+
+# Pamięć podręczna geokodowania: LRU w pamięci procesu przed tabelą w bazie
+class GeocodingCache:
+    BRAK = object()  # Znacznik braku wpisu (None oznacza zapamiętane "nie znaleziono")
+
+    def __init__(self):
+        self._wpisy = OrderedDict()
+        self._lock = threading.Lock()
+        self.trafienia = 0
+        self.trafienia_baza = 0
+        self.chybienia = 0
+
+    def _aktualny(self, wspolrzedne, zapisano):
+        ttl = app.config['GEOCODE_CACHE_TTL'] if wspolrzedne else app.config['GEOCODE_CACHE_NEGATIVE_TTL']
+        return time.time() - zapisano < ttl.total_seconds()
+
+    def _zapamietaj(self, klucz, wspolrzedne, zapisano):
+        with self._lock:
+            self._wpisy[klucz] = (wspolrzedne, zapisano)
+            self._wpisy.move_to_end(klucz)
+            while len(self._wpisy) > app.config['GEOCODE_CACHE_SIZE']:
+                self._wpisy.popitem(last=False)
+
+    def get(self, klucz):
+        with self._lock:
+            wpis = self._wpisy.get(klucz)
+            if wpis is not None and self._aktualny(*wpis):
+                self._wpisy.move_to_end(klucz)
+                self.trafienia += 1
+                return wpis[0]
+
+        wpis = None
+        try:
+            with app.app_context():
+                rekord = GeocodeCacheEntry.query.filter_by(address_key=klucz).first()
+                if rekord is not None:
+                    wspolrzedne = (rekord.latitude, rekord.longitude) if rekord.latitude is not None else None
+                    wpis = (wspolrzedne, (rekord.created_at - datetime(1970, 1, 1)).total_seconds())
+        except Exception as e:
+            print(f"Błąd odczytu pamięci podręcznej geokodowania: {e}")
+
+        if wpis is not None:
+            wspolrzedne, zapisano = wpis
+            if self._aktualny(wspolrzedne, zapisano):
+                self._zapamietaj(klucz, wspolrzedne, zapisano)
+                with self._lock:
+                    self.trafienia_baza += 1
+                return wspolrzedne
+
+        with self._lock:
+            self.chybienia += 1
+        return self.BRAK
+
+    def set(self, klucz, wspolrzedne):
+        teraz = datetime.utcnow()
+        self._zapamietaj(klucz, wspolrzedne, (teraz - datetime(1970, 1, 1)).total_seconds())
+        lat, lon = wspolrzedne if wspolrzedne else (None, None)
+        try:
+            with app.app_context():
+                wpis = GeocodeCacheEntry.query.filter_by(address_key=klucz).first()
+                if wpis is None:
+                    wpis = GeocodeCacheEntry(address_key=klucz)
+                    db.session.add(wpis)
+                wpis.latitude = lat
+                wpis.longitude = lon
+                wpis.created_at = teraz
+                db.session.commit()
+        except Exception as e:
+            print(f"Błąd zapisu pamięci podręcznej geokodowania: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._wpisy.clear()
+            self.trafienia = self.trafienia_baza = self.chybienia = 0
+        address_index.invalidate()
+        try:
+            with app.app_context():
+                GeocodeCacheEntry.query.delete()
+                db.session.commit()
+        except Exception as e:
+            print(f"Błąd czyszczenia pamięci podręcznej geokodowania: {e}")
+
+    def statystyki(self):
+        with self._lock:
+            return {
+                'rozmiar': len(self._wpisy),
+                'trafienia': self.trafienia,
+                'trafienia_baza': self.trafienia_baza,
+                'chybienia': self.chybienia,
+            }
+
+geocoding_cache = GeocodingCache()
+
+# Ogranicznik liczby zapytań (token bucket) wspólny dla wszystkich wątków.
+# Żetony mogą spaść poniżej zera - każdy wątek rezerwuje swoją kolejkę i śpi
+# dokładnie tyle, ile potrzeba, bez aktywnego czekania.
+class TokenBucket:
+    def __init__(self, rate, pojemnosc):
+        self.rate = rate
+        self.pojemnosc = pojemnosc
+        self._zetony = pojemnosc
+        self._ostatnio = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_czekanie=None):
+        with self._lock:
+            teraz = time.monotonic()
+            self._zetony = min(self.pojemnosc, self._zetony + (teraz - self._ostatnio) * self.rate)
+            self._ostatnio = teraz
+            czekanie = 0.0 if self._zetony >= 1 else (1 - self._zetony) / self.rate
+            if max_czekanie is not None and czekanie > max_czekanie:
+                return False
+            self._zetony -= 1
+        if czekanie > 0:
+            time.sleep(czekanie)
+        return True
+
+# Zapytanie w toku - pozostałe wątki pytające o ten sam adres czekają na jego wynik
+class _ZapytanieWToku:
+    __slots__ = ('gotowe', 'wynik', 'wyjatek')
+
+    def __init__(self):
+        self.gotowe = threading.Event()
+        self.wynik = None
+        self.wyjatek = None
+
+# Geokoder korzystający z usługi Nominatim (OpenStreetMap). Jeden klient na
+# proces: wspólna pula połączeń HTTP, limit zapytań, limity czasu, ponowienia
+# z wykładniczym opóźnieniem i łączenie identycznych zapytań w toku.
+class NominatimGeocoder:
+    BLEDY_PRZEJSCIOWE = (GeocoderTimedOut, GeocoderUnavailable, GeocoderRateLimited)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._konfiguracja = None
+        self._geolocator = None
+        self._limiter = None
+        self._w_toku = {}
+
+    def _klient(self):
+        konfiguracja = tuple(app.config[k] for k in (
+            'NOMINATIM_DOMAIN', 'NOMINATIM_SCHEME', 'NOMINATIM_USER_AGENT', 'NOMINATIM_TIMEOUT',
+            'NOMINATIM_POOL_SIZE', 'NOMINATIM_RATE', 'NOMINATIM_BURST'))
+        with self._lock:
+            if konfiguracja != self._konfiguracja:
+                domena, schemat, user_agent, timeout, pula, rate, burst = konfiguracja
+                opcje = {}
+                if requests_available:
+                    # Ponowienia obsługuje geocode() - adapter ich nie powtarza
+                    opcje['adapter_factory'] = partial(RequestsAdapter, pool_connections=1, pool_maxsize=pula, max_retries=0)
+                self._geolocator = Nominatim(user_agent=user_agent, domain=domena, scheme=schemat,
+                                             timeout=timeout, **opcje)
+                self._limiter = TokenBucket(rate, burst)
+                self._konfiguracja = konfiguracja
+            return self._geolocator, self._limiter
+
+    def _zapytaj(self, zapytanie):
+        geolocator, limiter = self._klient()
+        opoznienie = app.config['NOMINATIM_BACKOFF']
+        proby = app.config['NOMINATIM_RETRIES'] + 1
+        for proba in range(proby):
+            if not limiter.acquire(app.config['NOMINATIM_QUEUE_TIMEOUT']):
+                raise GeocoderTimedOut('Przekroczono czas oczekiwania na limit zapytań Nominatim')
+            try:
+                return geolocator.geocode(zapytanie)
+            except self.BLEDY_PRZEJSCIOWE as e:
+                if proba == proby - 1:
+                    raise
+                retry_after = getattr(e, 'retry_after', None)
+                time.sleep(retry_after if retry_after else opoznienie)
+                opoznienie *= 2
+
+    def geocode(self, adres):
+        zapytanie = adres + ", Polska"
+        klucz = normalizuj_adres(zapytanie)
+        with self._lock:
+            w_toku = self._w_toku.get(klucz)
+            wykonawca = w_toku is None
+            if wykonawca:
+                w_toku = self._w_toku[klucz] = _ZapytanieWToku()
+
+        if not wykonawca:
+            w_toku.gotowe.wait()
+        else:
+            try:
+                location = self._zapytaj(zapytanie)
+                w_toku.wynik = (location.latitude, location.longitude) if location else None
+            except Exception as e:
+                w_toku.wyjatek = e
+            finally:
+                with self._lock:
+                    del self._w_toku[klucz]
+                w_toku.gotowe.set()
+
+        if w_toku.wyjatek is not None:
+            raise w_toku.wyjatek
+        return w_toku.wynik
+
+    # Wymusza utworzenie nowego klienta przy następnym zapytaniu
+    def reset(self):
+        with self._lock:
+            self._konfiguracja = None
+            self._geolocator = None
+
+# Zbiór słów adresu bez przedrostków typu "ul." - kolejność części adresu nie ma znaczenia
+def tokeny_adresu(adres):
+    tokeny = re.split(r'[\s,]+', normalizuj_adres(adres))
+    return frozenset(t for t in tokeny if t and t not in ('ul.', 'ul', 'al.', 'al', 'pl.', 'pl', 'os.', 'os'))
+
+# Geokoder lokalny - adresy rozwiązywane z pliku punktów adresowych (np. eksport
+# TERYT/PRG) bez ruchu sieciowego. Plik jest wczytywany przy pierwszym użyciu
+# i ponownie po zmianie jego mtime.
+class LocalGazetteerGeocoder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sygnatura = None
+        self._dokladne = {}
+        self._adresy = []
+
+    def _wczytaj(self):
+        sciezka = app.config['GAZETTEER_CSV_PATH']
+        try:
+            stat = os.stat(sciezka)
+            sygnatura = (sciezka, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            sygnatura = (sciezka, None, None)
+        if sygnatura == self._sygnatura:
+            return
+
+        with self._lock:
+            if sygnatura == self._sygnatura:
+                return
+            dokladne = {}
+            adresy = []
+            if sygnatura[1] is not None:
+                try:
+                    with open(sciezka, newline='', encoding='utf-8') as plik:
+                        for wiersz in csv.DictReader(plik):
+                            wspolrzedne = (float(wiersz['latitude']), float(wiersz['longitude']))
+                            ulica = f"{wiersz.get('ulica') or ''} {wiersz.get('numer') or ''}".strip()
+                            miasto = wiersz.get('miasto') or ''
+                            kod = wiersz.get('kod_pocztowy') or ''
+                            # Adres rozpoznawany zarówno z kodem pocztowym, jak i bez niego
+                            dokladne.setdefault(tokeny_adresu(f"{ulica}, {miasto}"), wspolrzedne)
+                            if kod:
+                                dokladne.setdefault(tokeny_adresu(f"{ulica}, {kod} {miasto}"), wspolrzedne)
+                            adresy.append((ulica, miasto, kod, wspolrzedne))
+                except Exception as e:
+                    print(f"Błąd wczytywania pliku adresów: {e}")
+            self._dokladne = dokladne
+            self._adresy = adresy
+            self._sygnatura = sygnatura
+
+    def geocode(self, adres):
+        self._wczytaj()
+        return self._dokladne.get(tokeny_adresu(adres))
+
+    # Punkty adresowe (ulica z numerem, miasto, kod, współrzędne) - źródło podpowiedzi adresów
+    def punkty_adresowe(self):
+        self._wczytaj()
+        return self._sygnatura, self._adresy
+
+GEOKODERY = {
+    'nominatim': NominatimGeocoder(),
+    'local': LocalGazetteerGeocoder(),
+}
+
+# Geokodery wybrane w konfiguracji, w kolejności odpytywania. Nieznane nazwy
+# są pomijane z ostrzeżeniem (raz na nazwę) - literówka w GEOCODER_BACKEND nie
+# może wyglądać jak "nie znaleziono adresu".
+_nieznane_geokodery = set()
+
+def wybrane_geokodery():
+    geokodery = []
+    for nazwa in (n.strip() for n in app.config['GEOCODER_BACKEND'].split(',')):
+        if nazwa in GEOKODERY:
+            geokodery.append(GEOKODERY[nazwa])
+        elif nazwa and nazwa not in _nieznane_geokodery:
+            _nieznane_geokodery.add(nazwa)
+            print(f"Nieznany geokoder w GEOCODER_BACKEND: {nazwa!r} (dostępne: {', '.join(GEOKODERY)})")
+    if not geokodery:
+        print("Brak poprawnego geokodera w GEOCODER_BACKEND - adresy nie będą geokodowane")
+    return geokodery
+
+# Sprawdzenie konfiguracji przy starcie aplikacji
+wybrane_geokodery()
+
 # Funkcja do geokodowania adresu (zamiana adresu na współrzędne)
 def geokoduj_adres(adres):
     # Walidacja danych wejściowych
@@ -176,30 +1674,628 @@ def geokoduj_adres(adres):
         
     # Usunięcie potencjalnie niebezpiecznych znaków
     adres = re.sub(r'[<>\'";]', '', adres)
-    
-    geolocator = Nominatim(user_agent="gpz-finder")
+
+    # Powtórzone zapytania o ten sam adres obsługuje pamięć podręczna
+    klucz = normalizuj_adres(adres)
+    wspolrzedne = geocoding_cache.get(klucz)
+    if wspolrzedne is not GeocodingCache.BRAK:
+        return wspolrzedne
+
+    # Adres wybrany z podpowiedzi ma już współrzędne
+    wspolrzedne = address_index.wspolrzedne(adres)
+    if wspolrzedne:
+        geocoding_cache.set(klucz, wspolrzedne)
+        return wspolrzedne
+
     try:
-        location = geolocator.geocode(adres + ", Polska")
-        if location:
-            return (location.latitude, location.longitude)
-        return None
+        with metrics.etap('geokodowanie'):
+            for geokoder in wybrane_geokodery():
+                wspolrzedne = geokoder.geocode(adres)
+                if wspolrzedne:
+                    break
     except Exception as e:
+        # Błędy sieci nie trafiają do pamięci podręcznej - następne zapytanie spróbuje ponownie
         print(f"Błąd geokodowania: {e}")
         return None
+
+    geocoding_cache.set(klucz, wspolrzedne)
+    if wspolrzedne:
+        address_index.dodaj(adres, wspolrzedne)
+    return wspolrzedne
+
+# Klucze, pod którymi adres jest dostępny w podpowiedziach: pełny adres, adres
+# bez przedrostka ulicy oraz (dla GPZ) adres zaczynający się od miasta lub kodu
+def klucze_podpowiedzi(adres, miasto='', kod=''):
+    ulica = normalizuj_adres(adres)
+    warianty = [ulica]
+    if miasto or kod:
+        miejscowosc = normalizuj_adres(f"{kod} {miasto}")
+        warianty = [f"{ulica}, {miejscowosc}", f"{miejscowosc}, {ulica}"]
+        if kod and miasto:
+            warianty.append(f"{normalizuj_adres(miasto)}, {ulica}")
+    klucze = set()
+    for tekst in warianty:
+        klucze.add(tekst)
+        klucze.add(re.sub(r'^(ul|al|pl|os)\.? ', '', tekst))
+    return klucze
+
+# Indeks podpowiedzi adresów: posortowane klucze (znormalizowane adresy), prefiks
+# wyszukiwany przez bisect. Źródła: adresy GPZ z bieżącego zrzutu, punkty
+# adresowe geokodera lokalnego (jeśli jest wybrany w GEOCODER_BACKEND) i adresy
+# wcześniej geokodowane (pamięć podręczna w bazie oraz nowe wyniki geokodowania).
+# Każda podpowiedź ma współrzędne, więc wybrany adres nie wymaga geokodowania.
+class AddressPrefixIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._zrodla = None
+        self._klucze = []
+        self._pozycje = []
+        self._etykiety = []
+        self._wspolrzedne = []
+        self._dokladne = {}
+
+    def _dodaj(self, etykieta, wspolrzedne, klucze):
+        klucz_etykiety = normalizuj_adres(etykieta)
+        if klucz_etykiety in self._dokladne:
+            return
+        pozycja = len(self._etykiety)
+        self._etykiety.append(etykieta)
+        self._wspolrzedne.append(wspolrzedne)
+        self._dokladne[klucz_etykiety] = pozycja
+        for klucz in klucze:
+            i = bisect.bisect_left(self._klucze, klucz)
+            self._klucze.insert(i, klucz)
+            self._pozycje.insert(i, pozycja)
+
+    def _zbuduj(self, snapshot, punkty_adresowe):
+        wpisy = {}
+        for ulica, miasto, kod, wspolrzedne in punkty_adresowe:
+            etykieta = f"{ulica}, {kod} {miasto}" if kod else f"{ulica}, {miasto}"
+            wpisy.setdefault(normalizuj_adres(etykieta), (etykieta, wspolrzedne, klucze_podpowiedzi(ulica, miasto, kod)))
+        for g in snapshot.gpz:
+            adres, miasto, kod = g.get('adres') or '', g.get('miasto') or '', g.get('kod_pocztowy') or ''
+            lat, lon = g.get('latitude'), g.get('longitude')
+            if not adres or lat is None or lon is None or not (math.isfinite(lat) and math.isfinite(lon)):
+                continue
+            etykieta = f"{adres}, {kod} {miasto}" if kod else f"{adres}, {miasto}"
+            wpisy.setdefault(normalizuj_adres(etykieta), (etykieta, (lat, lon), klucze_podpowiedzi(adres, miasto, kod)))
+        try:
+            with app.app_context():
+                geokodowane = db.session.execute(
+                    db.select(GeocodeCacheEntry.address_key, GeocodeCacheEntry.latitude, GeocodeCacheEntry.longitude)
+                    .where(GeocodeCacheEntry.latitude.is_not(None))
+                    .order_by(GeocodeCacheEntry.created_at.desc())
+                    .limit(app.config['AUTOCOMPLETE_MAX_GEOCODED'])).all()
+        except Exception as e:
+            print(f"Błąd wczytywania adresów do podpowiedzi: {e}")
+            geokodowane = []
+        for klucz, lat, lon in geokodowane:
+            wpisy.setdefault(klucz, (klucz, (lat, lon), klucze_podpowiedzi(klucz)))
+
+        etykiety, wspolrzedne, pary, dokladne = [], [], [], {}
+        for klucz_etykiety, (etykieta, punkt, klucze) in wpisy.items():
+            dokladne[klucz_etykiety] = len(etykiety)
+            pary.extend((k, len(etykiety)) for k in klucze)
+            etykiety.append(etykieta)
+            wspolrzedne.append(punkt)
+        pary.sort()
+        self._klucze = [k for k, _ in pary]
+        self._pozycje = [p for _, p in pary]
+        self._etykiety, self._wspolrzedne, self._dokladne = etykiety, wspolrzedne, dokladne
+
+    # Przebudowa po zmianie danych GPZ (nowy zrzut rejestru) lub pliku punktów adresowych
+    def _aktualny(self):
+        snapshot = gpz_registry.snapshot()
+        sygnatura, punkty_adresowe = None, []
+        if GEOKODERY['local'] in wybrane_geokodery():
+            sygnatura, punkty_adresowe = GEOKODERY['local'].punkty_adresowe()
+        with self._lock:
+            if self._zrodla is None or self._zrodla[0] is not snapshot or self._zrodla[1] != sygnatura:
+                self._zbuduj(snapshot, punkty_adresowe)
+                self._zrodla = (snapshot, sygnatura)
+
+    # Nowo geokodowane adresy trafiają do już zbudowanego indeksu
+    def dodaj(self, adres, wspolrzedne):
+        with self._lock:
+            if self._zrodla is not None:
+                self._dodaj(normalizuj_adres(adres), wspolrzedne, klucze_podpowiedzi(adres))
+
+    # Podpowiedzi [(adres, (lat, lon))] dla adresów zaczynających się od tekstu
+    def podpowiedzi(self, tekst, limit=10):
+        self._aktualny()
+        prefiks = normalizuj_adres(tekst)
+        wyniki = []
+        widziane = set()
+        with self._lock:
+            i = bisect.bisect_left(self._klucze, prefiks)
+            while i < len(self._klucze) and len(wyniki) < limit and self._klucze[i].startswith(prefiks):
+                pozycja = self._pozycje[i]
+                if pozycja not in widziane:
+                    widziane.add(pozycja)
+                    wyniki.append((self._etykiety[pozycja], self._wspolrzedne[pozycja]))
+                i += 1
+        return wyniki
+
+    # Współrzędne adresu wybranego z podpowiedzi - tylko z już zbudowanego indeksu,
+    # geokodowanie nie wczytuje przy tym danych GPZ
+    def wspolrzedne(self, adres):
+        with self._lock:
+            pozycja = self._dokladne.get(normalizuj_adres(adres))
+            return self._wspolrzedne[pozycja] if pozycja is not None else None
+
+    def invalidate(self):
+        with self._lock:
+            self._zrodla = None
+            self._klucze, self._pozycje, self._etykiety, self._wspolrzedne, self._dokladne = [], [], [], [], {}
+
+address_index = AddressPrefixIndex()
     
+# Prostokąt współrzędnych zawierający okrąg o promieniu km (z zapasem na elipsoidę)
+def prostokat_wokol(lat, lon, km):
+    kat = min(km / (1 - BLAD_SFERY) / PROMIEN_ZIEMI_KM, math.pi)
+    dlat = math.degrees(kat)
+    if lat + dlat >= 90 or lat - dlat <= -90:
+        return max(lat - dlat, -90.0), min(lat + dlat, 90.0), -180.0, 180.0
+    dlon = math.degrees(math.asin(min(1.0, math.sin(kat) / math.cos(math.radians(lat)))))
+    if lon - dlon < -180 or lon + dlon > 180:
+        return lat - dlat, lat + dlat, -180.0, 180.0
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+# Identyfikatory i współrzędne GPZ z bazy leżących w prostokącie (R*Tree przechowuje
+# float32 zaokrąglone na zewnątrz, więc warunek nakładania daje nadzbiór)
+def gpz_w_prostokacie(min_lat, max_lat, min_lon, max_lon, filtry=None):
+    parametry = {'min_lat': min_lat, 'max_lat': max_lat, 'min_lon': min_lon, 'max_lon': max_lon}
+    if RTREE_GPZ['dostepny']:
+        sql = ('SELECT g.id, g.latitude, g.longitude FROM gpz_rtree r JOIN gpz g ON g.id = r.id'
+               ' WHERE r.max_lat >= :min_lat AND r.min_lat <= :max_lat'
+               ' AND r.max_lon >= :min_lon AND r.min_lon <= :max_lon')
+    else:
+        sql = ('SELECT g.id, g.latitude, g.longitude FROM gpz g'
+               ' WHERE g.latitude BETWEEN :min_lat AND :max_lat AND g.longitude BETWEEN :min_lon AND :max_lon')
+
+    # Warunki wyszukiwania z mocą: próg mocy (bieżącej lub prognozy na rok) i dystrybutor
+    filtry = filtry or {}
+    if filtry.get('min_moc') is not None:
+        if filtry.get('rok'):
+            sql += (' AND COALESCE((SELECT m.moc FROM gpz_moc m WHERE m.gpz_id = g.id AND m.rok = :rok), 0)'
+                    ' >= :min_moc')
+            parametry['rok'] = filtry['rok']
+        else:
+            sql += ' AND g.dostepna_moc >= :min_moc'
+        parametry['min_moc'] = filtry['min_moc']
+    if filtry.get('dystrybutor'):
+        sql += ' AND lower(trim(g.dystrybutor)) = :dystrybutor'
+        parametry['dystrybutor'] = filtry['dystrybutor'].strip().lower()
+
+    with app.app_context():
+        return db.session.execute(text(sql), parametry).all()
+
+# Najbliższe GPZ bezpośrednio z bazy danych: prostokąt wyszukiwania rośnie, aż
+# zawiera co najmniej limit GPZ; dokładny ranking tylko dla tych kandydatów
+def znajdz_najblizsze_gpz_db(lat, lon, limit=3, filtry=None):
+    if limit <= 0:
+        return []
+    promien = app.config['GPZ_BBOX_START_KM']
+    maks_promien = math.pi * PROMIEN_ZIEMI_KM
+    odleglosci = {}
+
+    while True:
+        for gpz_id, gpz_lat, gpz_lon in gpz_w_prostokacie(*prostokat_wokol(lat, lon, promien), filtry=filtry):
+            if gpz_id not in odleglosci:
+                odleglosci[gpz_id] = geodesic((lat, lon), (gpz_lat, gpz_lon)).kilometers
+        if promien >= maks_promien:
+            break
+        if len(odleglosci) >= limit:
+            # Prostokąt gwarantuje komplet GPZ tylko do odległości promien
+            granica = sorted(odleglosci.values())[limit - 1]
+            if granica <= promien:
+                break
+            promien = min(granica, maks_promien)
+        else:
+            promien = min(promien * 2, maks_promien)
+
+    najblizsze = sorted(odleglosci.items(), key=lambda x: (x[1], x[0]))[:limit]
+    gpz_wg_id = {gpz['id']: gpz for gpz in load_gpz_data_db([gpz_id for gpz_id, _ in najblizsze])}
+    return [(gpz_wg_id[gpz_id], odleglosc) for gpz_id, odleglosc in najblizsze if gpz_id in gpz_wg_id]
+
 # Funkcja znajdująca najbliższe GPZ
 def znajdz_najblizsze_gpz(lat, lon, limit=3):
-    wszystkie_gpz = load_gpz_data()
-    
-    # Oblicz odległość dla każdego GPZ
-    gpz_z_odlegloscia = []
-    for gpz in wszystkie_gpz:
-        odleglosc = geodesic((lat, lon), (gpz['latitude'], gpz['longitude'])).kilometers
-        gpz_z_odlegloscia.append((gpz, odleglosc))
-    
-    # Posortuj po odległości i zwróć 3 najbliższe
-    gpz_z_odlegloscia.sort(key=lambda x: x[1])
-    return gpz_z_odlegloscia[:limit]
+    if app.config['GPZ_STORAGE'] == 'db':
+        return znajdz_najblizsze_gpz_db(lat, lon, limit)
+
+    snapshot = gpz_registry.snapshot()
+    wszystkie_gpz = snapshot.gpz
+    if limit <= 0 or not len(snapshot.indeks):
+        return []
+    if app.config['SEARCH_CACHE_SIZE'] > 0:
+        return search_cache.najblizsze(snapshot, lat, lon, limit)
+
+    # Wybór kandydatów po odległości na sferze: dla mniejszych rejestrów jeden
+    # wektorowy przebieg haversine, dla większych zapytanie do drzewa k-d
+    liczba_kandydatow = limit + ZAPAS_KANDYDATOW
+    if len(wszystkie_gpz) <= app.config['GPZ_PELNY_SKAN_MAX']:
+        sferyczne = snapshot.odleglosci_sferyczne(lat, lon)
+        kandydaci = najmniejsze_indeksy(sferyczne, liczba_kandydatow)
+        kandydaci = kandydaci[np.isfinite(sferyczne[kandydaci])]
+        w_promieniu = lambda km: np.flatnonzero(sferyczne <= km)
+    else:
+        kandydaci, _ = snapshot.indeks.najblizsze(lat, lon, liczba_kandydatow)
+        w_promieniu = lambda km: snapshot.indeks.w_promieniu(lat, lon, km_na_cieciwe(km))[0]
+
+    return dokladne_najblizsze(snapshot, lat, lon, kandydaci, w_promieniu, limit)
+
+# Dokładna odległość geodezyjna liczona tylko dla kandydatów wybranych na sferze
+def dokladne_najblizsze(snapshot, lat, lon, kandydaci, w_promieniu, limit):
+    wszystkie_gpz = snapshot.gpz
+    odleglosci = {}
+    def policz(indeksy):
+        for i in indeksy:
+            i = int(i)
+            if i not in odleglosci:
+                gpz = wszystkie_gpz[i]
+                odleglosci[i] = geodesic((lat, lon), (gpz['latitude'], gpz['longitude'])).kilometers
+
+    policz(kandydaci)
+
+    # Dołącz każdy GPZ, który po przeliczeniu na elipsoidzie mógłby
+    # wyprzedzić ostatni zwracany wynik
+    if odleglosci and len(odleglosci) < len(snapshot.indeks):
+        granica = sorted(odleglosci.values())[min(limit, len(odleglosci)) - 1]
+        policz(w_promieniu(granica / (1 - BLAD_SFERY)))
+
+    # Posortuj po odległości i zwróć najbliższe (remisy w kolejności z pliku)
+    gpz_z_odlegloscia = sorted(odleglosci.items(), key=lambda x: (x[1], x[0]))
+    return [(wszystkie_gpz[i], odleglosc) for i, odleglosc in gpz_z_odlegloscia[:limit]]
+
+# Najbliższe GPZ dla wielu punktów naraz. Przy pełnym skanie odległości
+# sferyczne do wszystkich GPZ liczone są jedną macierzą (punkty x GPZ)
+# w blokach ograniczających pamięć, a kandydaci wybierani argpartition
+# wzdłuż wierszy. Wynik dla każdego punktu jest taki sam jak z
+# znajdz_najblizsze_gpz.
+@metrics.mierz('wyszukiwanie_wiele')
+def znajdz_najblizsze_gpz_wiele(punkty, limit=3):
+    if app.config['GPZ_STORAGE'] == 'db' or not len(punkty):
+        return [znajdz_najblizsze_gpz(lat, lon, limit) for lat, lon in punkty]
+
+    snapshot = gpz_registry.snapshot()
+    liczba_gpz = len(snapshot.gpz)
+    if limit <= 0 or not len(snapshot.indeks):
+        return [[] for _ in punkty]
+    if liczba_gpz > app.config['GPZ_PELNY_SKAN_MAX']:
+        return [znajdz_najblizsze_gpz(lat, lon, limit) for lat, lon in punkty]
+
+    wspolrzedne = np.asarray(punkty, dtype=np.float64).reshape(-1, 2)
+    liczba_kandydatow = min(limit + ZAPAS_KANDYDATOW, liczba_gpz)
+    blok = max(1, app.config['API_BATCH_MATRIX_MAX'] // liczba_gpz)
+    wyniki = []
+    for poczatek in range(0, len(wspolrzedne), blok):
+        lat = wspolrzedne[poczatek:poczatek + blok, 0:1]
+        lon = wspolrzedne[poczatek:poczatek + blok, 1:2]
+        sferyczne = haversine_km(lat, lon, snapshot.lat_rad, snapshot.lon_rad, snapshot.cos_lat)
+        sferyczne[np.isnan(sferyczne)] = np.inf
+        if liczba_kandydatow < liczba_gpz:
+            kandydaci = np.argpartition(sferyczne, liczba_kandydatow - 1, axis=1)[:, :liczba_kandydatow]
+        else:
+            kandydaci = np.broadcast_to(np.arange(liczba_gpz), sferyczne.shape)
+        for j, (wiersz, wybrani) in enumerate(zip(sferyczne, kandydaci)):
+            wybrani = wybrani[np.isfinite(wiersz[wybrani])]
+            w_promieniu = lambda km, wiersz=wiersz: np.flatnonzero(wiersz <= km)
+            wyniki.append(dokladne_najblizsze(snapshot, float(lat[j, 0]), float(lon[j, 0]), wybrani, w_promieniu, limit))
+    return wyniki
+
+# Pozycje punktów w promieniu (kolejność rosnącej odległości geodezyjnej) wraz
+# z odległością. Kandydaci przeglądani są w kolejności odległości na sferze;
+# wynik jest wydawany, gdy żaden dalszy kandydat (geodezyjnie nie bliżej niż
+# sferycznie * (1 - BLAD_SFERY)) nie może go już wyprzedzić.
+def posortowane_w_promieniu(lat, lon, promien_km, kandydaci_lat, kandydaci_lon):
+    lat_rad = np.radians(kandydaci_lat)
+    sferyczne = haversine_km(lat, lon, lat_rad, np.radians(kandydaci_lon), np.cos(lat_rad))
+    granica = promien_km / (1 - BLAD_SFERY)
+    kopiec = []
+    for pozycja in np.argsort(sferyczne, kind='stable').tolist():
+        odleglosc_sferyczna = sferyczne[pozycja]
+        if not odleglosc_sferyczna <= granica:
+            break
+        while kopiec and kopiec[0][0] <= odleglosc_sferyczna * (1 - BLAD_SFERY):
+            yield heapq.heappop(kopiec)[::-1]
+        odleglosc = geodesic((lat, lon), (kandydaci_lat[pozycja], kandydaci_lon[pozycja])).kilometers
+        if odleglosc <= promien_km:
+            heapq.heappush(kopiec, (odleglosc, pozycja))
+    while kopiec:
+        yield heapq.heappop(kopiec)[::-1]
+
+# Wszystkie GPZ w promieniu promien_km, posortowane po odległości - generator
+# (gpz, odleglosc). Kandydaci pochodzą z indeksu przestrzennego (lub z bazy
+# przez prostokąt), a pełne wpisy GPZ nie są kopiowane do listy wyników.
+def znajdz_gpz_w_promieniu(lat, lon, promien_km):
+    if app.config['GPZ_STORAGE'] == 'db':
+        yield from znajdz_gpz_w_promieniu_db(lat, lon, promien_km)
+        return
+
+    snapshot = gpz_registry.snapshot()
+    granica = promien_km / (1 - BLAD_SFERY)
+    if len(snapshot.gpz) <= app.config['GPZ_PELNY_SKAN_MAX']:
+        pozycje = np.flatnonzero(snapshot.odleglosci_sferyczne(lat, lon) <= granica)
+    else:
+        # Posortowane pozycje - remisy odległości w kolejności z pliku
+        pozycje = np.sort(snapshot.indeks.w_promieniu(lat, lon, km_na_cieciwe(granica))[0])
+    for pozycja, odleglosc in posortowane_w_promieniu(lat, lon, promien_km, snapshot.lat[pozycje], snapshot.lon[pozycje]):
+        yield snapshot.gpz[pozycje[pozycja]], odleglosc
+
+def znajdz_gpz_w_promieniu_db(lat, lon, promien_km, porcja=500):
+    wiersze = sorted(gpz_w_prostokacie(*prostokat_wokol(lat, lon, promien_km)))
+    if not wiersze:
+        return
+    identyfikatory, kandydaci_lat, kandydaci_lon = (np.array(kolumna) for kolumna in zip(*wiersze))
+
+    # Pełne wpisy GPZ pobierane z bazy porcjami, w miarę wydawania wyników
+    bufor = []
+    def wydaj():
+        gpz_wg_id = {gpz['id']: gpz for gpz in load_gpz_data_db([gpz_id for gpz_id, _ in bufor])}
+        for gpz_id, odleglosc in bufor:
+            if gpz_id in gpz_wg_id:
+                yield gpz_wg_id[gpz_id], odleglosc
+        bufor.clear()
+
+    for pozycja, odleglosc in posortowane_w_promieniu(lat, lon, promien_km, kandydaci_lat, kandydaci_lon):
+        bufor.append((int(identyfikatory[pozycja]), odleglosc))
+        if len(bufor) >= porcja:
+            yield from wydaj()
+    yield from wydaj()
+
+# Najbliższe GPZ, które mają co najmniej min_moc MW dostępnej mocy (bieżącej
+# albo w prognozie na rok) i opcjonalnie należą do danego dystrybutora.
+# Kandydaci pochodzą z indeksu podzbioru GPZ powyżej progu mocy, więc filtr
+# nie przegląda całego rejestru.
+def znajdz_najblizsze_gpz_z_moca(lat, lon, min_moc=0.0, rok=None, dystrybutor=None, limit=3):
+    if rok is not None and rok not in ROKI_PROGNOZY:
+        raise ValueError(f'Brak prognozy mocy na rok {rok}')
+    if app.config['GPZ_STORAGE'] == 'db':
+        return znajdz_najblizsze_gpz_db(lat, lon, limit, {'min_moc': min_moc, 'rok': rok, 'dystrybutor': dystrybutor})
+
+    snapshot = gpz_registry.snapshot()
+    podzbior = snapshot.indeks_mocy(f'moc_{rok}' if rok else 'dostepna_moc', min_moc, dystrybutor)
+    pasuje = podzbior.moc >= podzbior.moc.dtype.type(min_moc)
+    if limit <= 0 or not pasuje.any():
+        return []
+    if app.config['SEARCH_CACHE_SIZE'] > 0:
+        return search_cache.najblizsze(snapshot, lat, lon, limit, (min_moc, rok, klucz_tabeli(dystrybutor)),
+                                       podzbior, pasuje)
+
+    liczba_kandydatow = limit + ZAPAS_KANDYDATOW
+    if len(podzbior) <= app.config['GPZ_PELNY_SKAN_MAX']:
+        sferyczne = haversine_km(lat, lon, podzbior.lat_rad, podzbior.lon_rad, podzbior.cos_lat)
+        sferyczne[~pasuje | np.isnan(sferyczne)] = np.inf
+        kandydaci = najmniejsze_indeksy(sferyczne, liczba_kandydatow)
+        kandydaci = kandydaci[np.isfinite(sferyczne[kandydaci])]
+        w_promieniu = lambda km: podzbior.pozycje[np.flatnonzero(sferyczne <= km)]
+    else:
+        # Podzbiór zawiera też GPZ między progiem a min_moc - pobieraj coraz
+        # więcej sąsiadów, aż wystarczy pasujących
+        drzewo = podzbior.drzewo()
+        k = liczba_kandydatow
+        while True:
+            kandydaci, _ = drzewo.najblizsze(lat, lon, k)
+            kandydaci = kandydaci[pasuje[kandydaci]]
+            if len(kandydaci) >= liczba_kandydatow or k >= len(drzewo):
+                break
+            k = min(k * 2, len(drzewo))
+        kandydaci = kandydaci[:liczba_kandydatow]
+
+        def w_promieniu(km):
+            lokalne = drzewo.w_promieniu(lat, lon, km_na_cieciwe(km))[0]
+            return podzbior.pozycje[lokalne[pasuje[lokalne]]]
+
+    return dokladne_najblizsze(snapshot, lat, lon, podzbior.pozycje[kandydaci], w_promieniu, limit)
+
+# Pamięć podręczna wyników wyszukiwania najbliższych GPZ. Kluczem jest komórka
+# siatki współrzędnych (SEARCH_CACHE_GRID_DEG), limit i warunki wyszukiwania.
+# Komórka przechowuje kandydatów: wszystkie GPZ, które mogą należeć do wyniku
+# dla dowolnego punktu komórki (odległość od środka komórki do k-tego GPZ plus
+# promień komórki, z zapasem na różnicę sfera/elipsoida). Dla konkretnego
+# punktu liczona jest już tylko odległość geodezyjna do kandydatów, więc wynik
+# jest taki sam jak bez pamięci podręcznej. Zmiana danych GPZ (nowa wersja
+# zrzutu rejestru) czyści całą pamięć.
+class SearchResultCache:
+    def __init__(self):
+        self._wpisy = OrderedDict()
+        self._wersja = None
+        self._lock = threading.Lock()
+        self.trafienia = 0
+        self.trafienia_punktu = 0
+        self.chybienia = 0
+
+    @staticmethod
+    def _komorka(lat, lon):
+        siatka = app.config['SEARCH_CACHE_GRID_DEG']
+        return math.floor(lat / siatka), math.floor(lon / siatka)
+
+    # Środek komórki i promień (km) koła zawierającego całą komórkę
+    @staticmethod
+    def _srodek_i_promien(komorka):
+        siatka = app.config['SEARCH_CACHE_GRID_DEG']
+        dol, lewo = komorka[0] * siatka, komorka[1] * siatka
+        lat, lon = dol + siatka / 2, lewo + siatka / 2
+        narozniki_lat = np.radians([dol, dol + siatka])
+        narozniki_lon = np.radians([lewo, lewo])
+        promien = haversine_km(lat, lon, narozniki_lat, narozniki_lon, np.cos(narozniki_lat)).max()
+        return lat, lon, float(promien) * 1.001
+
+    # Pozycje GPZ (globalne) mogących trafić do wyniku dla punktu w komórce
+    @staticmethod
+    def _kandydaci(snapshot, komorka, limit, podzbior, pasuje):
+        lat, lon, promien = SearchResultCache._srodek_i_promien(komorka)
+        if podzbior is None:
+            pozycje, zrodlo = None, snapshot
+        else:
+            pozycje, zrodlo = podzbior.pozycje, podzbior
+        liczba = len(pozycje) if pozycje is not None else len(snapshot.gpz)
+
+        if liczba <= app.config['GPZ_PELNY_SKAN_MAX']:
+            sferyczne = haversine_km(lat, lon, zrodlo.lat_rad, zrodlo.lon_rad, zrodlo.cos_lat)
+            sferyczne[np.isnan(sferyczne)] = np.inf
+            if pasuje is not None:
+                sferyczne[~pasuje] = np.inf
+            najblizsze = najmniejsze_indeksy(sferyczne, limit)
+            k_ta = sferyczne[najblizsze[-1]] if len(najblizsze) == limit else np.inf
+            granica = (k_ta + promien) / (1 - BLAD_SFERY) ** 2 + promien
+            lokalne = np.flatnonzero((sferyczne <= granica) & np.isfinite(sferyczne))
+        else:
+            drzewo = snapshot.indeks if podzbior is None else podzbior.drzewo()
+            k = limit
+            while True:
+                najblizsze, _ = drzewo.najblizsze(lat, lon, k)
+                if pasuje is not None:
+                    najblizsze = najblizsze[pasuje[najblizsze]]
+                if len(najblizsze) >= limit or k >= len(drzewo):
+                    break
+                k = min(k * 2, len(drzewo))
+            if len(najblizsze) >= limit:
+                i = najblizsze[limit - 1]
+                k_ta = float(haversine_km(lat, lon, zrodlo.lat_rad[i], zrodlo.lon_rad[i], zrodlo.cos_lat[i]))
+                granica = (k_ta + promien) / (1 - BLAD_SFERY) ** 2 + promien
+                lokalne = drzewo.w_promieniu(lat, lon, km_na_cieciwe(granica))[0]
+            else:
+                lokalne = np.arange(liczba)
+                lokalne = lokalne[np.isfinite(zrodlo.lat[lokalne]) & np.isfinite(zrodlo.lon[lokalne])]
+            if pasuje is not None:
+                lokalne = lokalne[pasuje[lokalne]]
+        return lokalne if pozycje is None else pozycje[lokalne]
+
+    def najblizsze(self, snapshot, lat, lon, limit, filtry=None, podzbior=None, pasuje=None):
+        komorka = self._komorka(lat, lon)
+        klucz = (komorka, limit, filtry)
+        with self._lock:
+            if self._wersja != snapshot.wersja:
+                self._wpisy.clear()
+                self._wersja = snapshot.wersja
+            wpis = self._wpisy.get(klucz)
+            if wpis is not None:
+                self._wpisy.move_to_end(klucz)
+                wynik = wpis[1].get((lat, lon))
+                if wynik is not None:
+                    self.trafienia_punktu += 1
+                    return list(wynik)
+                self.trafienia += 1
+            else:
+                self.chybienia += 1
+
+        if wpis is None:
+            wpis = (self._kandydaci(snapshot, komorka, limit, podzbior, pasuje), OrderedDict())
+        wynik = dokladne_najblizsze(snapshot, lat, lon, wpis[0], lambda km: (), limit)
+
+        with self._lock:
+            if self._wersja == snapshot.wersja:
+                self._wpisy[klucz] = wpis
+                self._wpisy.move_to_end(klucz)
+                while len(self._wpisy) > app.config['SEARCH_CACHE_SIZE']:
+                    self._wpisy.popitem(last=False)
+                wpis[1][(lat, lon)] = tuple(wynik)
+                while len(wpis[1]) > app.config['SEARCH_CACHE_POINTS']:
+                    wpis[1].popitem(last=False)
+        return wynik
+
+    def clear(self):
+        with self._lock:
+            self._wpisy.clear()
+            self._wersja = None
+            self.trafienia = self.trafienia_punktu = self.chybienia = 0
+
+    def statystyki(self):
+        with self._lock:
+            zapytania = self.trafienia + self.trafienia_punktu + self.chybienia
+            return {
+                'rozmiar': len(self._wpisy),
+                'trafienia': self.trafienia,
+                'trafienia_punktu': self.trafienia_punktu,
+                'chybienia': self.chybienia,
+                'wspolczynnik_trafien': (self.trafienia + self.trafienia_punktu) / zapytania if zapytania else 0.0,
+            }
+
+search_cache = SearchResultCache()
+
+# Miesięczny limit zapytań. Obciążenie to jedno warunkowe UPDATE w bazie
+# (query_count + n <= limit), więc równoległe żądania nie przekroczą limitu.
+# Odczyt do wyświetlenia na stronie korzysta z licznika w pamięci procesu
+# i nie otwiera transakcji zapisu.
+class QuotaService:
+    def __init__(self):
+        self._liczniki = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def biezacy_miesiac():
+        return datetime.now().strftime('%Y-%m')
+
+    def _zapamietaj(self, user_id, miesiac, liczba):
+        with self._lock:
+            self._liczniki[(user_id, miesiac)] = (liczba, time.monotonic())
+
+    def wykorzystane(self, user_id, miesiac=None):
+        miesiac = miesiac or self.biezacy_miesiac()
+        with self._lock:
+            wpis = self._liczniki.get((user_id, miesiac))
+        if wpis is not None and time.monotonic() - wpis[1] < app.config['QUOTA_CACHE_TTL'].total_seconds():
+            return wpis[0]
+
+        with app.app_context():
+            liczba = db.session.execute(
+                db.select(UserQueries.query_count).filter_by(user_id=user_id, month=miesiac)
+            ).scalar() or 0
+        self._zapamietaj(user_id, miesiac, liczba)
+        return liczba
+
+    def pozostale(self, user_id):
+        return max(app.config['QUERY_LIMIT'] - self.wykorzystane(user_id), 0)
+
+    # Zwiększa licznik o liczba, jeśli nie przekroczy to limitu; zwraca True przy powodzeniu
+    @metrics.mierz('limit_zapytan')
+    def obciaz(self, user_id, liczba=1):
+        miesiac = self.biezacy_miesiac()
+        limit = app.config['QUERY_LIMIT']
+        if liczba > limit:
+            return False
+
+        with app.app_context():
+            for _ in range(2):
+                wynik = db.session.execute(
+                    db.update(UserQueries)
+                    .where(UserQueries.user_id == user_id, UserQueries.month == miesiac,
+                           UserQueries.query_count + liczba <= limit)
+                    .values(query_count=UserQueries.query_count + liczba)
+                )
+                if wynik.rowcount:
+                    break
+                # Brak wiersza na ten miesiąc albo wyczerpany limit
+                istnieje = db.session.execute(
+                    db.select(UserQueries.id).filter_by(user_id=user_id, month=miesiac)
+                ).first()
+                if istnieje:
+                    db.session.rollback()
+                    self._zapamietaj(user_id, miesiac, limit)
+                    return False
+                try:
+                    db.session.add(UserQueries(user_id=user_id, month=miesiac, query_count=liczba))
+                    db.session.flush()
+                    break
+                except IntegrityError:
+                    # Wiersz utworzył w międzyczasie inny proces - ponów UPDATE
+                    db.session.rollback()
+            else:
+                return False
+
+            wykorzystane = db.session.execute(
+                db.select(UserQueries.query_count).filter_by(user_id=user_id, month=miesiac)
+            ).scalar()
+            db.session.commit()
+        self._zapamietaj(user_id, miesiac, wykorzystane)
+        return True
+
+    def reset(self):
+        with self._lock:
+            self._liczniki.clear()
+
+quota_service = QuotaService()
 
 # Dekorator do sprawdzania uprawnień administratora
 def admin_required(f):
@@ -351,38 +2447,96 @@ def change_password():
             
     return render_template('change_password.html')
 
+# Generowanie wielu kluczy rejestracyjnych jednym INSERT (executemany). Kolizje
+# (przy 36^16 możliwych kluczach praktycznie niemożliwe) wykrywa ograniczenie
+# unikalności - tylko wtedy sprawdzane są istniejące klucze i losowane ponownie.
+def generuj_klucze(liczba):
+    alfabet = string.ascii_uppercase + string.digits
+    losuj = lambda: ''.join(secrets.choice(alfabet) for _ in range(16))
+    partia = uuid.uuid4().hex
+    utworzono = datetime.utcnow()
+    klucze = set()
+    while len(klucze) < liczba:
+        klucze.add(losuj())
+    klucze = list(klucze)
+
+    # Zwykła transakcja: przy kolizji cały INSERT jest wycofywany i ponawiany
+    while True:
+        try:
+            db.session.execute(
+                db.insert(RegistrationKey),
+                [{'key': klucz, 'created_at': utworzono, 'used': False, 'partia': partia} for klucz in klucze]
+            )
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            istniejace = set()
+            for i in range(0, len(klucze), 500):
+                fragment = klucze[i:i + 500]
+                istniejace.update(db.session.execute(
+                    db.select(RegistrationKey.key).where(RegistrationKey.key.in_(fragment))
+                ).scalars())
+            unikalne = set(klucze) - istniejace
+            while len(unikalne) < liczba:
+                klucz = losuj()
+                if klucz not in istniejace:
+                    unikalne.add(klucz)
+            klucze = list(unikalne)
+
+    return klucze, partia
+
 # Dodaj trasę do zarządzania kluczami rejestracyjnymi
 @app.route('/admin/keys', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def admin_keys():
     # Można dodać sprawdzenie, czy użytkownik jest administratorem
+    partia = None
     
     if request.method == 'POST' and 'generate_keys' in request.form:
         try:
             key_count = int(request.form.get('key_count', 10))
-            key_count = min(max(1, key_count), 100)  # Ograniczenie do 1-100 kluczy
+            key_count = min(max(1, key_count), app.config['REGISTRATION_KEYS_MAX_BATCH'])
             
-            for _ in range(key_count):
-                # Generuj unikalny 16-znakowy klucz
-                while True:
-                    key = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(16))
-                    if not RegistrationKey.query.filter_by(key=key).first():
-                        break
-                
-                new_key = RegistrationKey(key=key)
-                db.session.add(new_key)
-                
-            db.session.commit()
+            _, partia = generuj_klucze(key_count)
             flash(f'Wygenerowano {key_count} nowych kluczy rejestracyjnych.')
         except Exception as e:
             db.session.rollback()
             flash(f'Wystąpił błąd podczas generowania kluczy: {str(e)}')
     
-    # Pobierz wszystkie klucze
-    keys = RegistrationKey.query.order_by(RegistrationKey.created_at.desc()).all()
+    # Pobierz klucze strona po stronie
+    keys = db.paginate(
+        db.select(RegistrationKey).order_by(RegistrationKey.created_at.desc(), RegistrationKey.id.desc()),
+        per_page=app.config['REGISTRATION_KEYS_PER_PAGE'],
+        max_per_page=app.config['REGISTRATION_KEYS_PER_PAGE'],
+        error_out=False
+    )
     
-    return render_template('admin_keys.html', keys=keys)
+    return render_template('admin_keys.html', keys=keys, partia=partia,
+                           max_keys=app.config['REGISTRATION_KEYS_MAX_BATCH'])
+
+# Eksport partii kluczy rejestracyjnych (wygenerowanych jednym żądaniem) do pliku CSV
+@app.route('/admin/keys/export.csv')
+@login_required
+@admin_required
+def admin_keys_export():
+    partia = request.args.get('partia', '')
+    if not re.fullmatch(r'[0-9a-f]{32}', partia):
+        flash('Nieprawidłowy identyfikator partii kluczy.')
+        return redirect(url_for('admin_keys'))
+
+    bufor = io.StringIO()
+    writer = csv.writer(bufor)
+    writer.writerow(['klucz', 'data_utworzenia', 'wykorzystany'])
+    for klucz in db.session.execute(
+        db.select(RegistrationKey).filter_by(partia=partia).order_by(RegistrationKey.id)
+    ).scalars():
+        writer.writerow([klucz.key, klucz.created_at.strftime('%Y-%m-%d %H:%M:%S'), 'tak' if klucz.used else 'nie'])
+
+    nazwa_pliku = f"klucze_{partia}.csv"
+    return Response(bufor.getvalue(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={nazwa_pliku}'})
 
 # Wylogowanie
 @app.route('/logout')
@@ -399,31 +2553,49 @@ def wyszukaj_gpz():
     user_lat = None
     user_lng = None
     user_address = None
+    znalezione_adresy = []
     
-    # Sprawdź czy użytkownik ma dostępne zapytania
-    current_month = datetime.now().strftime('%Y-%m')
-    
+    # Sprawdź czy użytkownik ma dostępne zapytania (odczyt bez transakcji zapisu)
     try:
-        user_queries = UserQueries.query.filter_by(user_id=current_user.id, month=current_month).first()
-        if not user_queries:
-            user_queries = UserQueries(user_id=current_user.id, month=current_month, query_count=0)
-            db.session.add(user_queries)
-            db.session.commit()
-            
-        pozostale_zapytania = 100 - user_queries.query_count
+        pozostale_zapytania = quota_service.pozostale(current_user.id)
     except Exception as e:
-        db.session.rollback()
         flash(f'Wystąpił błąd podczas sprawdzania limitów zapytań: {str(e)}')
         pozostale_zapytania = 0
     
+    # Opcjonalne warunki: wymagana moc (bieżąca lub prognoza na rok) i dystrybutor
+    filtry = {'min_moc': '', 'rok': '', 'dystrybutor': ''}
+    
+    # Wynik wyszukiwania asynchronicznego (strona przechodzi tu po jego zakończeniu)
+    if request.method == 'GET' and request.args.get('wynik'):
+        zadanie = zadanie_wyszukiwania(request.args['wynik'], current_user.id)
+        if zadanie is None:
+            flash('Nie znaleziono wyniku wyszukiwania.')
+        elif zadanie.status == 'gotowe':
+            wyniki = wyniki_do_szablonu(zadanie.najblizsze)
+            user_lat, user_lng, user_address = zadanie.lat, zadanie.lon, zadanie.adres
+            filtry = zadanie.filtry
+        elif zadanie.status == 'blad':
+            flash(zadanie.komunikat)
+            filtry = zadanie.filtry
+            znalezione_adresy = zadanie.znalezione_adresy
+    
     if request.method == 'POST':
         adres = request.form.get('adres')
+        try:
+            filtry, min_moc, rok = parsuj_filtry_wyszukiwania(request.form)
+        except ValueError:
+            filtry = {pole: request.form.get(pole, '').strip() for pole in filtry}
+            flash('Nieprawidłowa wymagana moc lub rok prognozy.')
+            return render_template('wyszukaj.html', wyniki=wyniki, user_lat=user_lat, user_lng=user_lng,
+                                  user_address=user_address, pozostale_zapytania=pozostale_zapytania,
+                                  filtry=filtry, roki=ROKI_PROGNOZY)
         
         # Walidacja danych wejściowych
         if not adres:
             flash('Proszę wprowadzić adres.')
             return render_template('wyszukaj.html', wyniki=wyniki, user_lat=user_lat, user_lng=user_lng,
-                                  user_address=user_address, pozostale_zapytania=pozostale_zapytania)
+                                  user_address=user_address, pozostale_zapytania=pozostale_zapytania,
+                                  filtry=filtry, roki=ROKI_PROGNOZY)
                                   
         # Usunięcie potencjalnie niebezpiecznych znaków
         adres = re.sub(r'[<>\'";]', '', adres)
@@ -433,7 +2605,8 @@ def wyszukaj_gpz():
             if pozostale_zapytania <= 0:
                 flash('Wykorzystałeś limit zapytań na ten miesiąc. Limit zostanie odnowiony na początku następnego miesiąca.')
                 return render_template('wyszukaj.html', wyniki=wyniki, user_lat=user_lat, user_lng=user_lng,
-                                      user_address=user_address, pozostale_zapytania=pozostale_zapytania)
+                                      user_address=user_address, pozostale_zapytania=pozostale_zapytania,
+                                      filtry=filtry, roki=ROKI_PROGNOZY)
             
             wspolrzedne = geokoduj_adres(adres)
             if wspolrzedne:
@@ -443,42 +2616,480 @@ def wyszukaj_gpz():
                 user_address = adres
                 
                 try:
-                    najblizsze_gpz = znajdz_najblizsze_gpz(lat, lon)
-                    wyniki = []
+                    wyniki = wyniki_do_szablonu(wyszukaj_dla_punktu(lat, lon, min_moc, rok, filtry['dystrybutor']))
                     
-                    for gpz, odleglosc in najblizsze_gpz:
-                        pelny_adres = f"{gpz['adres']}, {gpz['miasto']}"
-                        if gpz['kod_pocztowy']:
-                            pelny_adres += f", {gpz['kod_pocztowy']}"
-                            
-                        wyniki.append({
-                            'nazwa': gpz['nazwa'],
-                            'adres': pelny_adres,
-                            'odleglosc': f"{odleglosc:.2f} km",
-                            'dostepna_moc': f"{gpz['dostepna_moc']} MW",
-                            'latitude': gpz['latitude'],
-                            'longitude': gpz['longitude'],
-                            'dystrybutor': gpz['dystrybutor'],
-                            'moc_2025': gpz['moc_2025'],
-                            'moc_2026': gpz['moc_2026'],
-                            'moc_2027': gpz['moc_2027'],
-                            'moc_2028': gpz['moc_2028'],
-                            'moc_2029': gpz['moc_2029'],
-                            'moc_2030': gpz['moc_2030']
-                        })
-                    
-                    # Zwiększ licznik zapytań
-                    user_queries.query_count += 1
-                    db.session.commit()
-                    pozostale_zapytania = 100 - user_queries.query_count
+                    # Zwiększ licznik zapytań - jedno atomowe UPDATE z warunkiem limitu
+                    if quota_service.obciaz(current_user.id):
+                        pozostale_zapytania = quota_service.pozostale(current_user.id)
+                    else:
+                        wyniki = []
+                        pozostale_zapytania = 0
+                        flash('Wykorzystałeś limit zapytań na ten miesiąc. Limit zostanie odnowiony na początku następnego miesiąca.')
                 except Exception as e:
                     db.session.rollback()
                     flash(f'Wystąpił błąd podczas wyszukiwania: {str(e)}')
             else:
                 flash('Nie udało się odnaleźć podanego adresu.')
+                znalezione_adresy = podobne_adresy(adres)
     
     return render_template('wyszukaj.html', wyniki=wyniki, user_lat=user_lat, user_lng=user_lng,
-                          user_address=user_address, pozostale_zapytania=pozostale_zapytania)
+                          user_address=user_address, pozostale_zapytania=pozostale_zapytania,
+                          filtry=filtry, roki=ROKI_PROGNOZY, znalezione_adresy=znalezione_adresy)
+
+# Znane adresy podobne do nieodnalezionego: podpowiedzi dla coraz krótszego
+# początku adresu (bez kolejnych słów od końca)
+def podobne_adresy(adres):
+    tekst = normalizuj_adres(adres)
+    while len(re.sub(r'^(ul|al|pl|os)\.? ?', '', tekst)) >= app.config['AUTOCOMPLETE_MIN_CHARS']:
+        podpowiedzi = address_index.podpowiedzi(tekst, app.config['AUTOCOMPLETE_LIMIT'])
+        if podpowiedzi:
+            return [etykieta for etykieta, _ in podpowiedzi]
+        tekst = re.sub(r'[\s,]*[^\s,]+$', '', tekst)
+    return []
+
+# Warunki wyszukiwania z formularza lub JSON: (napisy do formularza, min_moc, rok);
+# ValueError przy nieprawidłowej mocy lub roku
+def parsuj_filtry_wyszukiwania(dane):
+    filtry = {pole: str(dane.get(pole) or '').strip() for pole in ('min_moc', 'rok', 'dystrybutor')}
+    min_moc = float(filtry['min_moc'].replace(',', '.')) if filtry['min_moc'] else None
+    rok = int(filtry['rok']) if filtry['rok'] else None
+    if rok is not None and rok not in ROKI_PROGNOZY:
+        raise ValueError(f'Brak prognozy mocy na rok {rok}')
+    return filtry, min_moc, rok
+
+# Najbliższe GPZ dla punktu - z warunkami mocy/dystrybutora, jeśli podano
+@metrics.mierz('wyszukiwanie')
+def wyszukaj_dla_punktu(lat, lon, min_moc=None, rok=None, dystrybutor=None):
+    if min_moc is not None or rok is not None or dystrybutor:
+        return znajdz_najblizsze_gpz_z_moca(lat, lon, min_moc or 0.0, rok, dystrybutor or None)
+    return znajdz_najblizsze_gpz(lat, lon)
+
+# Wyniki wyszukiwania w postaci używanej przez szablon wyszukaj.html
+def wyniki_do_szablonu(najblizsze_gpz):
+    wyniki = []
+    for gpz, odleglosc in najblizsze_gpz:
+        wyniki.append({
+            'nazwa': gpz['nazwa'],
+            'adres': gpz['pelny_adres'],
+            'odleglosc': f"{odleglosc:.2f} km",
+            'dostepna_moc': f"{gpz['dostepna_moc']} MW",
+            'latitude': gpz['latitude'],
+            'longitude': gpz['longitude'],
+            'dystrybutor': gpz['dystrybutor'],
+            **{kolumna: gpz[kolumna] for kolumna in KOLUMNY_MOCY}
+        })
+    return wyniki
+
+# Wyszukiwanie asynchroniczne: żądanie od razu dostaje identyfikator, a
+# geokodowanie i wyszukiwanie wykonuje ograniczona pula wątków. Proces
+# serwera nie czeka na odpowiedź Nominatim, strona odpytuje o stan zadania.
+search_executor = ThreadPoolExecutor(max_workers=app.config['ASYNC_SEARCH_WORKERS'], thread_name_prefix='wyszukiwanie')
+# Liczba wyszukiwań w toku w puli wątków tego procesu
+search_jobs_licznik = {'w_toku': 0}
+search_jobs_lock = threading.Lock()
+
+def zadanie_wyszukiwania(identyfikator, user_id):
+    zadanie = db.session.get(SearchJob, identyfikator)
+    if zadanie is None or zadanie.user_id != user_id:
+        return None
+    return zadanie
+
+# Wykonanie zadania w puli wątków; limit zapytań obciążany dopiero po
+# znalezieniu wyników (nieudane geokodowanie nie zużywa zapytania)
+def wykonaj_wyszukiwanie(identyfikator, user_id, adres, filtry, min_moc, rok):
+    wynik = {'status': 'blad'}
+    try:
+        wspolrzedne = geokoduj_adres(adres)
+        if not wspolrzedne:
+            wynik['znalezione_adresy'] = podobne_adresy(adres)
+            wynik['komunikat'] = 'Nie udało się odnaleźć podanego adresu.'
+        else:
+            lat, lon = wspolrzedne
+            najblizsze = wyszukaj_dla_punktu(lat, lon, min_moc, rok, filtry['dystrybutor'])
+            if not quota_service.obciaz(user_id):
+                wynik['komunikat'] = 'Wykorzystałeś limit zapytań na ten miesiąc. Limit zostanie odnowiony na początku następnego miesiąca.'
+            else:
+                wynik.update(status='gotowe', lat=lat, lon=lon, wyniki=[
+                    {'gpz': {pole: gpz.get(pole) for pole in KOLUMNY_GPZ + ['pelny_adres']}, 'odleglosc': float(odleglosc)}
+                    for gpz, odleglosc in najblizsze
+                ])
+    except Exception as e:
+        print(f"Błąd wyszukiwania asynchronicznego: {e}")
+        wynik['komunikat'] = f'Wystąpił błąd podczas wyszukiwania: {str(e)}'
+
+    try:
+        with app.app_context():
+            db.session.execute(db.update(SearchJob).where(SearchJob.id == identyfikator).values(**wynik))
+            db.session.commit()
+    except Exception as e:
+        print(f"Błąd zapisu wyniku wyszukiwania asynchronicznego: {e}")
+    finally:
+        with search_jobs_lock:
+            search_jobs_licznik['w_toku'] -= 1
+
+# Rozpoczęcie wyszukiwania asynchronicznego (formularz lub JSON)
+@app.route('/api/wyszukaj/async', methods=['POST'])
+@login_required
+def api_wyszukaj_async():
+    dane = request.get_json(silent=True) or request.form
+    adres = re.sub(r'[<>\'";]', '', str(dane.get('adres') or '')).strip()
+    if not adres:
+        return jsonify({'blad': 'Proszę wprowadzić adres.'}), 400
+    try:
+        filtry, min_moc, rok = parsuj_filtry_wyszukiwania(dane)
+    except ValueError:
+        return jsonify({'blad': 'Nieprawidłowa wymagana moc lub rok prognozy.'}), 400
+    if quota_service.pozostale(current_user.id) <= 0:
+        return jsonify({'blad': 'Wykorzystałeś limit zapytań na ten miesiąc.', 'pozostale_zapytania': 0}), 429
+
+    with search_jobs_lock:
+        if search_jobs_licznik['w_toku'] >= app.config['ASYNC_SEARCH_MAX_PENDING']:
+            return jsonify({'blad': 'Zbyt wiele wyszukiwań w toku. Spróbuj ponownie za chwilę.'}), 503
+        search_jobs_licznik['w_toku'] += 1
+
+    identyfikator = uuid.uuid4().hex
+    try:
+        db.session.add(SearchJob(id=identyfikator, user_id=current_user.id, adres=adres, filtry=filtry, status='w_toku'))
+        # Wyszukiwania starsze niż ASYNC_SEARCH_TTL są usuwane
+        db.session.execute(db.delete(SearchJob).where(
+            SearchJob.created_at < datetime.utcnow() - timedelta(seconds=app.config['ASYNC_SEARCH_TTL'])
+        ))
+        db.session.commit()
+        search_executor.submit(wykonaj_wyszukiwanie, identyfikator, current_user.id, adres, filtry, min_moc, rok)
+    except Exception:
+        db.session.rollback()
+        with search_jobs_lock:
+            search_jobs_licznik['w_toku'] -= 1
+        raise
+
+    return jsonify({
+        'id': identyfikator,
+        'status': 'w_toku',
+        'status_url': url_for('api_wyszukaj_async_status', search_id=identyfikator),
+        'wynik_url': url_for('wyszukaj_gpz', wynik=identyfikator),
+    }), 202
+
+# Stan wyszukiwania asynchronicznego (JSON) - widoczny tylko dla jego autora
+@app.route('/api/wyszukaj/async/<search_id>')
+@login_required
+def api_wyszukaj_async_status(search_id):
+    zadanie = zadanie_wyszukiwania(search_id, current_user.id)
+    if zadanie is None:
+        return jsonify({'blad': 'Nie znaleziono wyszukiwania'}), 404
+    return jsonify(zadanie.jako_slownik())
+
+# Wynik wyszukiwania w postaci gotowej do serializacji JSON
+def gpz_do_json(gpz, odleglosc):
+    wynik = {kolumna: gpz.get(kolumna) for kolumna in KOLUMNY_GPZ}
+    wynik['odleglosc_km'] = round(odleglosc, 3)
+    return wynik
+
+# API wyszukiwania: lista adresów lub punktów {lat, lon}, dla każdego najbliższe GPZ.
+# Adresy geokodowane są równolegle, najbliższe GPZ wyznaczane jednym przebiegiem
+# dla wszystkich punktów, a limit zapytań obciążany jedną transakcją
+# (po jednym zapytaniu za każdy punkt ze znanymi współrzędnymi).
+@app.route('/api/wyszukaj', methods=['POST'])
+@login_required
+def api_wyszukaj():
+    dane = request.get_json(silent=True)
+    if isinstance(dane, list):
+        dane = {'punkty': dane}
+    if not isinstance(dane, dict) or not isinstance(dane.get('punkty'), list) or not dane['punkty']:
+        return jsonify({'blad': 'Oczekiwano listy "punkty" z adresami lub współrzędnymi.'}), 400
+    punkty = dane['punkty']
+    if len(punkty) > app.config['API_BATCH_MAX_POINTS']:
+        return jsonify({'blad': f"Maksymalna liczba punktów w zapytaniu to {app.config['API_BATCH_MAX_POINTS']}."}), 400
+    try:
+        limit = int(dane.get('limit', 3))
+    except (TypeError, ValueError):
+        limit = 0
+    if not 1 <= limit <= 50:
+        return jsonify({'blad': 'Parametr "limit" musi być liczbą od 1 do 50.'}), 400
+    try:
+        min_moc = float(dane['min_moc']) if dane.get('min_moc') is not None else None
+        rok = int(dane['rok']) if dane.get('rok') is not None else None
+    except (TypeError, ValueError):
+        min_moc = rok = -1
+    if (min_moc is not None and min_moc < 0) or (rok is not None and rok not in ROKI_PROGNOZY):
+        return jsonify({'blad': f'Parametr "min_moc" musi być nieujemną liczbą, a "rok" jednym z {ROKI_PROGNOZY}.'}), 400
+    dystrybutor = dane.get('dystrybutor') if isinstance(dane.get('dystrybutor'), str) else None
+
+    # Rozpoznanie punktów: adresy do geokodowania albo gotowe współrzędne
+    wyniki = []
+    adresy = {}
+    for punkt in punkty:
+        if isinstance(punkt, str):
+            punkt = {'adres': punkt}
+        wynik = {'zapytanie': punkt}
+        if isinstance(punkt, dict) and 'lat' in punkt and 'lon' in punkt:
+            try:
+                lat, lon = float(punkt['lat']), float(punkt['lon'])
+            except (TypeError, ValueError):
+                lat = lon = float('nan')
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                wynik['lat'], wynik['lon'] = lat, lon
+            else:
+                wynik['blad'] = 'Nieprawidłowe współrzędne.'
+        elif isinstance(punkt, dict) and isinstance(punkt.get('adres'), str) and punkt['adres'].strip():
+            adresy.setdefault(punkt['adres'].strip(), []).append(wynik)
+        else:
+            wynik['blad'] = 'Punkt musi zawierać adres albo lat i lon.'
+        wyniki.append(wynik)
+
+    if sum(1 for w in wyniki if 'blad' not in w) > quota_service.pozostale(current_user.id):
+        return jsonify({'blad': 'Niewystarczający limit zapytań na ten miesiąc.',
+                        'pozostale_zapytania': quota_service.pozostale(current_user.id)}), 429
+
+    # Równoległe geokodowanie (każdy unikalny adres tylko raz)
+    if adresy:
+        with ThreadPoolExecutor(max_workers=app.config['API_GEOCODE_WORKERS']) as pula:
+            for adres, wspolrzedne in zip(adresy, pula.map(geokoduj_adres, adresy)):
+                for wynik in adresy[adres]:
+                    if wspolrzedne:
+                        wynik['lat'], wynik['lon'] = wspolrzedne
+                    else:
+                        wynik['blad'] = 'Nie udało się odnaleźć podanego adresu.'
+
+    znalezione = [w for w in wyniki if 'lat' in w]
+    if min_moc is not None or rok is not None or dystrybutor:
+        najblizsze = [znajdz_najblizsze_gpz_z_moca(w['lat'], w['lon'], min_moc or 0.0, rok, dystrybutor, limit)
+                      for w in znalezione]
+    else:
+        najblizsze = znajdz_najblizsze_gpz_wiele([(w['lat'], w['lon']) for w in znalezione], limit)
+    for wynik, gpz_lista in zip(znalezione, najblizsze):
+        wynik['gpz'] = [gpz_do_json(gpz, odleglosc) for gpz, odleglosc in gpz_lista]
+
+    if znalezione and not quota_service.obciaz(current_user.id, len(znalezione)):
+        return jsonify({'blad': 'Niewystarczający limit zapytań na ten miesiąc.',
+                        'pozostale_zapytania': quota_service.pozostale(current_user.id)}), 429
+
+    return jsonify({'wyniki': wyniki, 'pozostale_zapytania': quota_service.pozostale(current_user.id)})
+
+# Podpowiedzi adresów dla pola wyszukiwania (bez geokodowania i bez zużycia limitu)
+@app.route('/api/adresy')
+@login_required
+def api_adresy():
+    tekst = re.sub(r'[<>\'";]', '', request.args.get('q', ''))
+    if len(tekst.strip()) < app.config['AUTOCOMPLETE_MIN_CHARS']:
+        return jsonify({'podpowiedzi': []})
+    return jsonify({'podpowiedzi': [{'adres': adres, 'lat': lat, 'lon': lon}
+                                    for adres, (lat, lon) in address_index.podpowiedzi(tekst, app.config['AUTOCOMPLETE_LIMIT'])]})
+
+# Wszystkie GPZ w promieniu od adresu lub punktu, strumieniowo jako JSON
+# (odpowiedź wysyłana w kawałkach, bez budowania pełnej listy wyników)
+@app.route('/api/promien')
+@login_required
+def api_promien():
+    try:
+        promien = float(request.args.get('promien', 25))
+    except ValueError:
+        promien = -1.0
+    if not 0 < promien <= app.config['GPZ_PROMIEN_MAX_KM']:
+        return jsonify({'blad': f"Promień musi być liczbą od 0 do {app.config['GPZ_PROMIEN_MAX_KM']} km."}), 400
+
+    # Bez dostępnych zapytań adres nie jest geokodowany
+    if quota_service.pozostale(current_user.id) <= 0:
+        return jsonify({'blad': 'Wykorzystałeś limit zapytań na ten miesiąc.', 'pozostale_zapytania': 0}), 429
+
+    if request.args.get('adres'):
+        wspolrzedne = geokoduj_adres(request.args['adres'])
+        if not wspolrzedne:
+            return jsonify({'blad': 'Nie udało się odnaleźć podanego adresu.'}), 404
+        lat, lon = wspolrzedne
+    else:
+        try:
+            lat, lon = float(request.args['lat']), float(request.args['lon'])
+        except (KeyError, ValueError):
+            return jsonify({'blad': 'Podaj adres albo współrzędne lat i lon.'}), 400
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return jsonify({'blad': 'Nieprawidłowe współrzędne.'}), 400
+
+    if not quota_service.obciaz(current_user.id):
+        return jsonify({'blad': 'Wykorzystałeś limit zapytań na ten miesiąc.', 'pozostale_zapytania': 0}), 429
+
+    def generuj():
+        yield json.dumps({'lat': lat, 'lon': lon, 'promien_km': promien}, ensure_ascii=False)[:-1] + ', "gpz": ['
+        liczba = 0
+        for gpz, odleglosc in znajdz_gpz_w_promieniu(lat, lon, promien):
+            yield (', ' if liczba else '') + json.dumps(gpz_do_json(gpz, odleglosc), ensure_ascii=False)
+            liczba += 1
+        yield f'], "liczba": {liczba}}}'
+
+    return Response(stream_with_context(generuj()), mimetype='application/json')
+
+# Walidacja jednego wiersza importu GPZ - zwraca (wiersz, None) albo (None, opis błędu)
+def waliduj_wiersz_gpz(rekord):
+    rekord = {str(k).strip().lower(): ('' if v is None or pd.isna(v) else str(v).strip()) for k, v in rekord.items()}
+    for pole in ('nazwa', 'adres', 'miasto', 'dostepna_moc'):
+        if not rekord.get(pole):
+            return None, f'Brak wartości w kolumnie {pole}'
+
+    wiersz = {
+        'nazwa': rekord['nazwa'],
+        'adres': rekord['adres'],
+        'miasto': rekord['miasto'],
+        'kod_pocztowy': rekord.get('kod_pocztowy', ''),
+        'dystrybutor': rekord.get('dystrybutor') or 'Nieznany',
+        'latitude': None,
+        'longitude': None,
+    }
+    try:
+        wiersz['dostepna_moc'] = float(rekord['dostepna_moc'].replace(',', '.'))
+        for kolumna in KOLUMNY_MOCY:
+            wartosc = rekord.get(kolumna, '')
+            wiersz[kolumna] = float(wartosc.replace(',', '.')) if wartosc else 0.0
+    except ValueError:
+        return None, 'Nieprawidłowa wartość mocy'
+
+    if rekord.get('latitude') or rekord.get('longitude'):
+        try:
+            lat = float(rekord.get('latitude', '').replace(',', '.'))
+            lon = float(rekord.get('longitude', '').replace(',', '.'))
+        except ValueError:
+            return None, 'Nieprawidłowe współrzędne'
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return None, 'Współrzędne poza zakresem'
+        wiersz['latitude'], wiersz['longitude'] = lat, lon
+
+    return wiersz, None
+
+# Postęp importu zbierany w wątku importu i zapisywany do wiersza ImportJob
+# nie częściej niż co GPZ_IMPORT_PROGRESS_INTERVAL s (oraz na końcu importu)
+class PostepImportu:
+    def __init__(self, identyfikator):
+        self.id = identyfikator
+        self.wszystkie = 0
+        self.przetworzone = 0
+        self.bledy = []
+        self._zapisano = 0.0
+
+    def postep(self, liczba=1):
+        self.przetworzone += liczba
+        self.zapisz()
+
+    def blad(self, wiersz, opis):
+        self.bledy.append({'wiersz': wiersz, 'blad': opis})
+        self.przetworzone += 1
+        self.zapisz()
+
+    def zapisz(self, wymus=False, **pola):
+        teraz = time.monotonic()
+        if not wymus and teraz - self._zapisano < app.config['GPZ_IMPORT_PROGRESS_INTERVAL']:
+            return
+        self._zapisano = teraz
+        db.session.execute(db.update(ImportJob).where(ImportJob.id == self.id).values(
+            wszystkie=self.wszystkie, przetworzone=self.przetworzone, bledy=list(self.bledy),
+            updated_at=datetime.utcnow(), **pola
+        ))
+        db.session.commit()
+
+MAKS_ZADAN_IMPORTU = 20
+
+# Import wielu GPZ: walidacja, równoległe geokodowanie wierszy bez współrzędnych
+# (przez wspólną pamięć podręczną i limit zapytań) i jeden zapis całej partii
+def importuj_gpz(identyfikator, df):
+    with app.app_context():
+        zadanie = PostepImportu(identyfikator)
+        try:
+            rekordy = df.to_dict('records')
+            zadanie.wszystkie = len(rekordy)
+            zadanie.zapisz(wymus=True)
+            wiersze = []
+            for numer, rekord in enumerate(rekordy, start=2):  # Numer wiersza w arkuszu (1 = nagłówek)
+                wiersz, blad = waliduj_wiersz_gpz(rekord)
+                if blad:
+                    zadanie.blad(numer, blad)
+                else:
+                    wiersze.append((numer, wiersz))
+
+            do_geokodowania = [(numer, w) for numer, w in wiersze if w['latitude'] is None]
+            zadanie.postep(len(wiersze) - len(do_geokodowania))
+
+            with ThreadPoolExecutor(max_workers=app.config['GPZ_IMPORT_WORKERS']) as pula:
+                zadania = {
+                    pula.submit(geokoduj_adres, f"{w['adres']}, {w['miasto']}, {w['kod_pocztowy']}"): (numer, w)
+                    for numer, w in do_geokodowania
+                }
+                for future in as_completed(zadania):
+                    numer, wiersz = zadania[future]
+                    wspolrzedne = future.result()
+                    if wspolrzedne:
+                        wiersz['latitude'], wiersz['longitude'] = wspolrzedne
+                        zadanie.postep()
+                    else:
+                        zadanie.blad(numer, 'Nie udało się geokodować adresu')
+
+            poprawne = [w for _, w in wiersze if w['latitude'] is not None]
+            if app.config['GPZ_STORAGE'] == 'db':
+                dodaj_gpz_do_bazy(poprawne)
+            else:
+                gpz_registry.snapshot()  # Utworzenie pliku CSV, jeśli jeszcze nie istnieje
+                gpz_csv_writer.dopisz(poprawne)
+            gpz_registry.invalidate()
+
+            zadanie.bledy.sort(key=lambda b: b['wiersz'])
+            zadanie.zapisz(wymus=True, dodane=len(poprawne), status='zakonczony')
+        except Exception as e:
+            print(f"Błąd importu GPZ: {e}")
+            db.session.rollback()
+            zadanie.bledy.append({'wiersz': None, 'blad': str(e)})
+            try:
+                zadanie.zapisz(wymus=True, status='blad')
+            except Exception as e:
+                db.session.rollback()
+                print(f"Błąd zapisu stanu importu GPZ: {e}")
+
+# Import pliku CSV/XLSX z listą GPZ - przetwarzanie w tle, postęp pod adresem zadania
+@app.route('/admin/gpz/import', methods=['POST'])
+@login_required
+@admin_required
+def admin_gpz_import():
+    plik = request.files.get('plik')
+    if not plik or not plik.filename:
+        flash('Wybierz plik CSV lub XLSX do importu.')
+        return redirect(url_for('admin_gpz'))
+
+    # Stary format .xls wymagałby dodatkowej biblioteki (xlrd) - obsługiwane są tylko CSV i XLSX
+    if not plik.filename.lower().endswith(('.csv', '.xlsx')):
+        flash('Obsługiwane są tylko pliki CSV i XLSX.')
+        return redirect(url_for('admin_gpz'))
+
+    try:
+        if plik.filename.lower().endswith('.xlsx'):
+            df = pd.read_excel(plik, dtype=str)
+        else:
+            df = pd.read_csv(plik, dtype=str, keep_default_na=False, sep=None, engine='python')
+    except Exception as e:
+        flash(f'Nie udało się odczytać pliku: {str(e)}')
+        return redirect(url_for('admin_gpz'))
+
+    identyfikator = uuid.uuid4().hex
+    db.session.add(ImportJob(id=identyfikator, nazwa_pliku=plik.filename, status='w_toku', bledy=[]))
+    # Przechowywanych jest MAKS_ZADAN_IMPORTU najnowszych zadań
+    starsze = db.select(ImportJob.id).order_by(ImportJob.created_at.desc()).offset(MAKS_ZADAN_IMPORTU).subquery()
+    db.session.execute(db.delete(ImportJob).where(ImportJob.id.in_(db.select(starsze.c.id)),
+                                                  ImportJob.status != 'w_toku'))
+    db.session.commit()
+    threading.Thread(target=importuj_gpz, args=(identyfikator, df), daemon=True).start()
+
+    flash(f'Rozpoczęto import pliku {plik.filename}.')
+    return redirect(url_for('admin_gpz', import_id=identyfikator))
+
+# Postęp zadania importu GPZ (JSON)
+@app.route('/admin/gpz/import/<import_id>')
+@login_required
+@admin_required
+def admin_gpz_import_status(import_id):
+    zadanie = db.session.get(ImportJob, import_id)
+    if zadanie is None:
+        return jsonify({'blad': 'Nie znaleziono zadania importu'}), 404
+    # Import bez zapisu postępu przez GPZ_IMPORT_STALE s (np. po restarcie procesu serwera) jest przerwany
+    if zadanie.status == 'w_toku' and \
+            zadanie.updated_at < datetime.utcnow() - timedelta(seconds=app.config['GPZ_IMPORT_STALE']):
+        zadanie.status = 'blad'
+        zadanie.bledy = (zadanie.bledy or []) + [{'wiersz': None, 'blad': 'Import został przerwany. Spróbuj ponownie.'}]
+        db.session.commit()
+    return jsonify(zadanie.jako_slownik())
 
 # Panel administracyjny do zarządzania danymi GPZ
 @app.route('/admin/gpz', methods=['GET', 'POST'])
@@ -501,44 +3112,297 @@ def admin_gpz():
             
             if wspolrzedne:
                 lat, lon = wspolrzedne
-                dostepna_moc = float(request.form.get('dostepna_moc', 0))
-                moc_2025 = float(request.form.get('moc_2025', 0))
-                moc_2026 = float(request.form.get('moc_2026', 0))
-                moc_2027 = float(request.form.get('moc_2027', 0))
-                moc_2028 = float(request.form.get('moc_2028', 0))
-                moc_2029 = float(request.form.get('moc_2029', 0))
-                moc_2030 = float(request.form.get('moc_2030', 0))
-                
-                # Dodanie nowego GPZ do pliku CSV
-                df = pd.read_csv(app.config['GPZ_CSV_PATH'])
-                nowy_wpis = pd.DataFrame([{
+                nowy_wpis = {
                     'nazwa': nazwa,
                     'adres': adres,
                     'miasto': miasto,
                     'kod_pocztowy': kod_pocztowy,
                     'latitude': lat,
                     'longitude': lon,
-                    'dostepna_moc': dostepna_moc,
+                    'dostepna_moc': float(request.form.get('dostepna_moc', 0)),
                     'dystrybutor': dystrybutor,
-                    'moc_2025': moc_2025,
-                    'moc_2026': moc_2026,
-                    'moc_2027': moc_2027,
-                    'moc_2028': moc_2028,
-                    'moc_2029': moc_2029,
-                    'moc_2030': moc_2030
-                }])
-                
-                df = pd.concat([df, nowy_wpis], ignore_index=True)
-                df.to_csv(app.config['GPZ_CSV_PATH'], index=False)
+                }
+                for kolumna in KOLUMNY_MOCY:
+                    nowy_wpis[kolumna] = float(request.form.get(kolumna, 0))
+
+                if app.config['GPZ_STORAGE'] == 'db':
+                    # Dodanie nowego GPZ do bazy danych
+                    dodaj_gpz_do_bazy([nowy_wpis])
+                else:
+                    # Dopisanie nowego GPZ na końcu pliku CSV
+                    gpz_registry.snapshot()  # Utworzenie pliku CSV, jeśli jeszcze nie istnieje
+                    gpz_csv_writer.dopisz([nowy_wpis])
+                gpz_registry.invalidate()
                 
                 flash('Nowy GPZ został dodany pomyślnie.')
             else:
                 flash('Nie udało się geokodować podanego adresu.')
+
+        elif 'usun_gpz' in request.form:
+            nazwa = request.form.get('nazwa', '')
+            try:
+                identyfikator = int(request.form.get('gpz_id', ''))
+            except ValueError:
+                identyfikator = None
+
+            usunieto = False
+            if identyfikator is not None:
+                if app.config['GPZ_STORAGE'] == 'db':
+                    gpz = db.session.get(Gpz, identyfikator)
+                    if gpz is not None and gpz.nazwa == nazwa:
+                        db.session.delete(gpz)
+                        db.session.commit()
+                        usunieto = True
+                else:
+                    usunieto = gpz_csv_writer.usun(identyfikator, nazwa)
+
+            if usunieto:
+                gpz_registry.invalidate()
+                flash(f'GPZ {nazwa} został usunięty.')
+            else:
+                flash('Nie udało się usunąć GPZ - lista mogła zostać zmieniona. Spróbuj ponownie.')
     
-    # Wczytaj aktualną listę GPZ
-    gpz_data = load_gpz_data()
+    # Pobierz stronę listy GPZ z rejestru (filtrowanie i sortowanie po stronie serwera)
+    tabela = strona_tabeli_gpz(request.args)
     
-    return render_template('admin_gpz.html', gpz_data=gpz_data)
+    return render_template('admin_gpz.html', tabela=tabela, import_id=request.args.get('import_id'))
+
+# Strona tabeli GPZ według parametrów zapytania (filtry, sortowanie, stronicowanie)
+def strona_tabeli_gpz(parametry):
+    try:
+        min_moc = float(parametry['min_moc']) if parametry.get('min_moc') else None
+    except ValueError:
+        min_moc = None
+    filtry = {
+        'dystrybutor': parametry.get('dystrybutor', '').strip(),
+        'miasto': parametry.get('miasto', '').strip(),
+        'kod_pocztowy': parametry.get('kod_pocztowy', '').strip(),
+        'min_moc': min_moc,
+    }
+    sortuj = parametry.get('sortuj', '')
+    if sortuj not in KOLUMNY_TABELI_GPZ:
+        sortuj = ''
+    malejaco = parametry.get('kierunek') == 'desc'
+    na_strone = min(max(1, parametry.get('na_strone', app.config['GPZ_ADMIN_PER_PAGE'], type=int)),
+                    app.config['GPZ_ADMIN_MAX_PER_PAGE'])
+    strona = max(1, parametry.get('strona', 1, type=int))
+
+    snap = gpz_registry.snapshot()
+    pozycje, wszystkie = snap.tabela().strona(filtry, sortuj or None, malejaco, strona, na_strone)
+
+    wiersze = []
+    for pozycja in pozycje.tolist():
+        gpz = snap.gpz[pozycja]
+        wiersz = {kolumna: gpz.get(kolumna) for kolumna in KOLUMNY_TABELI_GPZ}
+        wiersz['latitude'] = gpz.get('latitude')
+        wiersz['longitude'] = gpz.get('longitude')
+        # W trybie bazy danych GPZ usuwany jest po id, w trybie CSV po numerze wiersza pliku
+        wiersz['id'] = gpz['id'] if 'id' in gpz else pozycja
+        wiersze.append(wiersz)
+
+    return {
+        'gpz': wiersze,
+        'strona': strona,
+        'na_strone': na_strone,
+        'wszystkie': wszystkie,
+        'strony': max(1, math.ceil(wszystkie / na_strone)),
+        'sortuj': sortuj,
+        'kierunek': 'desc' if malejaco else 'asc',
+        'filtry': {k: ('' if v is None else v) for k, v in filtry.items()},
+    }
+
+# Strona tabeli GPZ w formacie JSON (doładowywanie kolejnych stron w panelu)
+@app.route('/admin/gpz/dane')
+@login_required
+@admin_required
+def admin_gpz_dane():
+    return jsonify(strona_tabeli_gpz(request.args))
+
+# Raport dostępnej mocy według dystrybutora lub miasta (JSON): dla podanego
+# roku (także ułamkowego) albo dla wszystkich lat prognozy
+@app.route('/admin/gpz/raport')
+@login_required
+@admin_required
+def admin_gpz_raport():
+    grupuj = request.args.get('grupuj', 'dystrybutor')
+    if grupuj not in GpzForecast.GRUPOWANIA:
+        return jsonify({'blad': f'Parametr "grupuj" musi być jednym z {list(GpzForecast.GRUPOWANIA)}.'}), 400
+    prognoza = gpz_registry.snapshot().prognoza()
+
+    if request.args.get('rok'):
+        try:
+            rok = float(request.args['rok'])
+            if not math.isfinite(rok):
+                raise ValueError(rok)
+        except ValueError:
+            return jsonify({'blad': 'Nieprawidłowy rok.'}), 400
+        nazwy, liczby, sumy, mediany = prognoza.agregaty_dla_roku(grupuj, rok)
+        calosc = prognoza.dla_roku(rok)
+        return jsonify({
+            'grupuj': grupuj,
+            'rok': rok,
+            'grupy': [{'nazwa': nazwa, 'liczba': int(liczba), 'suma': round(float(suma), 3), 'mediana': round(float(mediana), 3)}
+                      for nazwa, liczba, suma, mediana in zip(nazwy, liczby, sumy, mediany)],
+            'razem': {'liczba': len(prognoza), 'suma': round(float(calosc.sum(dtype=np.float64)), 3),
+                      'mediana': round(float(np.median(calosc)), 3) if len(prognoza) else 0.0},
+        })
+
+    agregaty = prognoza.agregaty(grupuj)
+    return jsonify({
+        'grupuj': grupuj,
+        'roki': ROKI_PROGNOZY,
+        'grupy': [{'nazwa': nazwa, 'liczba': int(liczba), 'suma': np.round(suma, 3).tolist(),
+                   'mediana': np.round(mediana, 3).tolist()}
+                  for nazwa, liczba, suma, mediana in zip(agregaty['grupy'], agregaty['liczba'],
+                                                          agregaty['suma'], agregaty['mediana'])],
+        'razem': {'liczba': len(prognoza), 'suma': np.round(prognoza.macierz.sum(axis=0, dtype=np.float64), 3).tolist()},
+    })
+
+# Statystyki pamięci podręcznych (geokodowanie, wyniki wyszukiwania) w formacie JSON
+@app.route('/admin/statystyki')
+@login_required
+@admin_required
+def admin_statystyki():
+    return jsonify({'geokodowanie': geocoding_cache.statystyki(), 'wyszukiwanie': search_cache.statystyki()})
+
+# Profilowanie żądań administratora (cProfile) - jedno naraz, bo profiler
+# jest wspólny dla procesu; zapamiętane profile są dostępne w /admin/profilowanie
+profile_zadan = deque(maxlen=app.config['PROFILING_KEEP'])
+profilowanie_lock = threading.Lock()
+
+@app.before_request
+def rozpocznij_pomiar():
+    g.poczatek = time.perf_counter()
+    g.etapy = []
+    if (request.args.get('profil') == '1' or session.get('profilowanie')) and \
+            current_user.is_authenticated and current_user.is_admin and profilowanie_lock.acquire(blocking=False):
+        g.profil = cProfile.Profile()
+        g.profil.enable()
+
+@app.after_request
+def zakoncz_pomiar(response):
+    if 'poczatek' not in g:
+        return response
+    czas = time.perf_counter() - g.poczatek
+    metrics.obserwuj('gpz_zadanie_sekundy', request.endpoint or 'brak', czas)
+    profil = g.pop('profil', None)
+    if profil is not None:
+        profil.disable()
+        profilowanie_lock.release()
+        wynik = io.StringIO()
+        pstats.Stats(profil, stream=wynik).sort_stats('cumulative').print_stats(30)
+        profile_zadan.append({
+            'czas': datetime.utcnow().isoformat(timespec='seconds'),
+            'sciezka': request.full_path.rstrip('?'),
+            'metoda': request.method,
+            'czas_ms': round(czas * 1000, 3),
+            'etapy': [{'etap': nazwa, 'czas_ms': round(t * 1000, 3)} for nazwa, t in g.etapy],
+            'profil': wynik.getvalue(),
+        })
+        response.headers['Server-Timing'] = ', '.join(
+            [f'{nazwa};dur={t * 1000:.3f}' for nazwa, t in g.etapy] + [f'razem;dur={czas * 1000:.3f}'])
+    return response
+
+# Profiler nie może zostać włączony po żądaniu zakończonym wyjątkiem
+@app.teardown_request
+def zwolnij_profiler(wyjatek=None):
+    profil = g.pop('profil', None)
+    if profil is not None:
+        profil.disable()
+        profilowanie_lock.release()
+
+# Czas renderowania szablonów jako osobny etap
+def _przed_renderowaniem(sender, template, context, **extra):
+    g.renderowanie = time.perf_counter()
+
+def _po_renderowaniu(sender, template, context, **extra):
+    poczatek = g.pop('renderowanie', None)
+    if poczatek is not None:
+        metrics.zapisz_etap('renderowanie', time.perf_counter() - poczatek)
+
+before_render_template.connect(_przed_renderowaniem, app)
+template_rendered.connect(_po_renderowaniu, app)
+
+# Metryki w formacie Prometheus: dla administratorów albo z adresu lokalnego,
+# jeśli pozwala na to METRICS_LOCALHOST
+@app.route('/metrics')
+def metryki():
+    lokalny = app.config['METRICS_LOCALHOST'] and request.remote_addr in ('127.0.0.1', '::1')
+    if not lokalny and not (current_user.is_authenticated and current_user.is_admin):
+        return Response('Brak dostępu.\n', status=403, mimetype='text/plain')
+
+    linie = metrics.prometheus()
+    geokodowanie = geocoding_cache.statystyki()
+    wyszukiwanie = search_cache.statystyki()
+    trafienia = {
+        'geokodowanie': geokodowanie['trafienia'],
+        'geokodowanie_baza': geokodowanie['trafienia_baza'],
+        'wyszukiwanie': wyszukiwanie['trafienia'],
+        'wyszukiwanie_punkt': wyszukiwanie['trafienia_punktu'],
+    }
+    linie += ['# HELP gpz_cache_trafienia_total Trafienia w pamięci podręcznej', '# TYPE gpz_cache_trafienia_total counter']
+    linie += [f'gpz_cache_trafienia_total{{cache="{nazwa}"}} {liczba}' for nazwa, liczba in trafienia.items()]
+    linie += ['# HELP gpz_cache_chybienia_total Chybienia w pamięci podręcznej', '# TYPE gpz_cache_chybienia_total counter',
+              f'gpz_cache_chybienia_total{{cache="geokodowanie"}} {geokodowanie["chybienia"]}',
+              f'gpz_cache_chybienia_total{{cache="wyszukiwanie"}} {wyszukiwanie["chybienia"]}']
+    linie += ['# HELP gpz_cache_wpisy Liczba wpisów w pamięci podręcznej procesu', '# TYPE gpz_cache_wpisy gauge',
+              f'gpz_cache_wpisy{{cache="geokodowanie"}} {geokodowanie["rozmiar"]}',
+              f'gpz_cache_wpisy{{cache="wyszukiwanie"}} {wyszukiwanie["rozmiar"]}']
+    return Response('\n'.join(linie) + '\n', mimetype='text/plain; version=0.0.4')
+
+# Włączenie/wyłączenie profilowania żądań w sesji administratora i lista ostatnich profili
+@app.route('/admin/profilowanie', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def admin_profilowanie():
+    if request.method == 'POST':
+        session['profilowanie'] = request.form.get('wlacz') == '1'
+    return jsonify({'wlaczone': bool(session.get('profilowanie')), 'profile': list(profile_zadan)})
+
+# Eksport aktualnych danych GPZ do pliku CSV (format zgodny z gpz_database.csv)
+@app.route('/admin/gpz/export.csv')
+@login_required
+@admin_required
+def admin_gpz_export():
+    bufor = io.StringIO()
+    writer = csv.DictWriter(bufor, fieldnames=KOLUMNY_GPZ, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(gpz_registry.snapshot().gpz)
+    return Response(bufor.getvalue(), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=gpz_database.csv'})
+
+# Jednorazowe przeniesienie danych GPZ z pliku CSV do bazy danych: flask --app app gpz-migrate
+@app.cli.command('gpz-migrate')
+@click.option('--force', is_flag=True, help='Usuń GPZ zapisane wcześniej w bazie danych.')
+def gpz_migrate(force):
+    with app.app_context():
+        liczba = db.session.execute(db.select(db.func.count(Gpz.id))).scalar()
+        if liczba and not force:
+            click.echo(f'Baza zawiera już {liczba} GPZ - użyj --force, aby je zastąpić.')
+            return
+        if liczba:
+            db.session.execute(db.delete(GpzMoc))
+            db.session.execute(db.delete(Gpz))
+            zwieksz_wersje_gpz(db.session.connection())
+            db.session.commit()
+
+    gpz_data = load_gpz_data()
+    dodaj_gpz_do_bazy(gpz_data)
+    gpz_registry.invalidate()
+    click.echo(f'Przeniesiono {len(gpz_data)} GPZ z pliku {app.config["GPZ_CSV_PATH"]} do bazy danych.')
+
+# Zbudowanie binarnego zrzutu GPZ z pliku CSV (np. przed uruchomieniem procesów serwera)
+@app.cli.command('gpz-snapshot')
+def gpz_snapshot():
+    sygnatura = gpz_registry._sygnatura()
+    if sygnatura[1] is None:
+        load_gpz_data()
+        sygnatura = gpz_registry._sygnatura()
+    sciezka = GpzBinarySnapshot.sciezka()
+    GpzBinarySnapshot.zapisz(load_gpz_data(), sciezka, list(sygnatura[1:]))
+    click.echo(f'Zapisano binarny zrzut {len(GpzBinarySnapshot.otworz(sciezka))} GPZ do pliku {sciezka}.')
 
 if __name__ == '__main__':
+    # Wczytaj rejestr GPZ przed przyjęciem pierwszego żądania
+    gpz_registry.snapshot()
     app.run(debug=True)
\ No newline at end of file
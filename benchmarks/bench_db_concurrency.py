@@ -0,0 +1,113 @@
+"""Benchmark współbieżnych zapisów do bazy SQLite aplikacji.
+
+Uruchamia kilka procesów (jak workery gunicorna), które jednocześnie
+obciążają limit zapytań (QuotaService.obciaz) i odczytują liczniki.
+Porównuje domyślne ustawienia SQLite (journal_mode=DELETE, synchronous=FULL)
+z konfiguracją aplikacji (WAL, synchronous=NORMAL, busy_timeout).
+
+    python benchmarks/bench_db_concurrency.py --procesy 4 --zapisy 300
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+KATALOG_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TRYBY = {
+    'DELETE/FULL': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL'},
+    'WAL/NORMAL': {'SQLITE_JOURNAL_MODE': 'WAL', 'SQLITE_SYNCHRONOUS': 'NORMAL'},
+}
+
+
+def _import_app(uri, ustawienia):
+    os.environ['DATABASE_URL'] = uri
+    os.environ.update(ustawienia)
+    sys.path.insert(0, KATALOG_REPO)
+    import app as aplikacja
+    return aplikacja
+
+
+def _pisarz(uri, ustawienia, user_id, zapisy, start, wyniki):
+    aplikacja = _import_app(uri, ustawienia)
+    aplikacja.app.config['QUERY_LIMIT'] = 10 ** 9
+    start.wait()
+    bledy = 0
+    poczatek = time.perf_counter()
+    for _ in range(zapisy):
+        try:
+            aplikacja.quota_service.obciaz(user_id)
+        except Exception:
+            bledy += 1
+    wyniki.put(('zapis', zapisy - bledy, bledy, time.perf_counter() - poczatek))
+
+
+def _czytelnik(uri, ustawienia, user_id, czas, start, wyniki):
+    aplikacja = _import_app(uri, ustawienia)
+    aplikacja.app.config['QUOTA_CACHE_TTL'] = aplikacja.timedelta(0)  # Każdy odczyt trafia do bazy
+    start.wait()
+    odczyty = bledy = 0
+    koniec = time.perf_counter() + czas
+    while time.perf_counter() < koniec:
+        try:
+            aplikacja.quota_service.wykorzystane(user_id)
+            odczyty += 1
+        except Exception:
+            bledy += 1
+    wyniki.put(('odczyt', odczyty, bledy, czas))
+
+
+def _przygotuj(uri, ustawienia, liczba_uzytkownikow):
+    aplikacja = _import_app(uri, ustawienia)
+    with aplikacja.app.app_context():
+        for n in range(liczba_uzytkownikow):
+            uzytkownik = aplikacja.User(username=f'bench{n}')
+            uzytkownik.password_hash = '-'
+            aplikacja.db.session.add(uzytkownik)
+        aplikacja.db.session.commit()
+
+
+def zmierz(nazwa, ustawienia, procesy, zapisy, czytelnicy):
+    katalog = tempfile.mkdtemp(prefix='gpz-bench-')
+    uri = f"sqlite:///{os.path.join(katalog, 'baza.db')}"
+    kontekst = multiprocessing.get_context('spawn')
+
+    # Przygotowanie bazy i użytkowników w osobnym procesie z tymi samymi ustawieniami
+    przygotowanie = kontekst.Process(target=_przygotuj, args=(uri, ustawienia, procesy))
+    przygotowanie.start()
+    przygotowanie.join()
+
+    start = kontekst.Event()
+    wyniki = kontekst.Queue()
+    workery = [kontekst.Process(target=_pisarz, args=(uri, ustawienia, n + 1, zapisy, start, wyniki))
+               for n in range(procesy)]
+    workery += [kontekst.Process(target=_czytelnik, args=(uri, ustawienia, 1, 2.0, start, wyniki))
+                for _ in range(czytelnicy)]
+    for worker in workery:
+        worker.start()
+    time.sleep(2.0)  # Czas na import aplikacji we wszystkich procesach
+    start.set()
+    zebrane = [wyniki.get() for _ in workery]
+    for worker in workery:
+        worker.join()
+
+    zapisy_ok = sum(w[1] for w in zebrane if w[0] == 'zapis')
+    czas_zapisow = max(w[3] for w in zebrane if w[0] == 'zapis')
+    odczyty = sum(w[1] for w in zebrane if w[0] == 'odczyt')
+    bledy = sum(w[2] for w in zebrane)
+    print(f"{nazwa:<12} zapisy: {zapisy_ok / czas_zapisow:8.1f}/s  odczyty: {odczyty / 2.0:8.1f}/s  błędy: {bledy}")
+    return zapisy_ok / czas_zapisow
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--procesy', type=int, default=4, help='liczba procesów zapisujących')
+    parser.add_argument('--zapisy', type=int, default=300, help='liczba obciążeń limitu na proces')
+    parser.add_argument('--czytelnicy', type=int, default=2, help='liczba procesów odczytujących')
+    argumenty = parser.parse_args()
+
+    wyniki = {nazwa: zmierz(nazwa, ustawienia, argumenty.procesy, argumenty.zapisy, argumenty.czytelnicy)
+              for nazwa, ustawienia in TRYBY.items()}
+    print(f"Przyspieszenie zapisów WAL/NORMAL: {wyniki['WAL/NORMAL'] / wyniki['DELETE/FULL']:.1f}x")
@@ -0,0 +1,229 @@
+"""Benchmark wczytywania rejestru GPZ, wyszukiwania i zapisów panelu administracyjnego.
+
+Dla syntetycznych rejestrów GPZ (domyślnie 1k, 10k, 100k i 1M wierszy) mierzy:
+load_gpz_data, znajdz_najblizsze_gpz, dodawanie GPZ przez /admin/gpz oraz
+żądanie /wyszukaj od początku do końca. Geokoder jest zastąpiony lokalną
+atrapą, więc benchmark działa bez dostępu do sieci. Raportuje percentyle
+p50/p95/p99, przepustowość i szczytowe zużycie pamięci (tracemalloc).
+
+Wyniki można zapisać jako bazę odniesienia (JSON) i porównywać z nią
+kolejne uruchomienia - regresje ponad tolerancję kończą skrypt kodem 1.
+
+    python benchmarks/bench_gpz.py --rozmiary 1000,10000 --zapisz benchmarks/baza.json
+    python benchmarks/bench_gpz.py --rozmiary 1000,10000 --porownaj benchmarks/baza.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+KATALOG_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MIASTA = ['Warszawa', 'Kraków', 'Łódź', 'Wrocław', 'Poznań', 'Gdańsk', 'Szczecin', 'Lublin', 'Białystok', 'Katowice']
+DYSTRYBUTORZY = ['Tauron', 'Enea', 'Energa', 'PGE', 'E.ON']
+# Prostokąt obejmujący Polskę - współrzędne syntetycznych GPZ i punktów wyszukiwania
+SZEROKOSC = (49.0, 54.8)
+DLUGOSC = (14.1, 24.1)
+
+
+def _import_app(katalog):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(katalog, 'baza.db')}"
+    sys.path.insert(0, KATALOG_REPO)
+    import app as aplikacja
+    return aplikacja
+
+
+# Atrapa geokodera: współrzędne wyznaczone deterministycznie z tekstu adresu
+class AtrapaGeokodera:
+    def geocode(self, adres):
+        skrot = zlib.crc32(adres.encode('utf-8'))
+        return (SZEROKOSC[0] + (skrot % 10000) / 10000 * (SZEROKOSC[1] - SZEROKOSC[0]),
+                DLUGOSC[0] + (skrot // 10000 % 10000) / 10000 * (DLUGOSC[1] - DLUGOSC[0]))
+
+
+def generuj_rejestr(aplikacja, sciezka, liczba, ziarno=0):
+    los = np.random.default_rng(ziarno)
+    moc = np.round(los.uniform(0, 60, liczba), 2)
+    dane = {
+        'nazwa': [f'GPZ {i}' for i in range(liczba)],
+        'adres': [f'ul. Syntetyczna {i}' for i in range(liczba)],
+        'miasto': np.array(MIASTA)[los.integers(0, len(MIASTA), liczba)],
+        'kod_pocztowy': [f'{k // 1000:02d}-{k % 1000:03d}' for k in los.integers(0, 100000, liczba)],
+        'latitude': np.round(los.uniform(*SZEROKOSC, liczba), 6),
+        'longitude': np.round(los.uniform(*DLUGOSC, liczba), 6),
+        'dostepna_moc': moc,
+        'dystrybutor': np.array(DYSTRYBUTORZY)[los.integers(0, len(DYSTRYBUTORZY), liczba)],
+    }
+    for n, kolumna in enumerate(aplikacja.KOLUMNY_MOCY):
+        dane[kolumna] = np.round(moc * (1 + 0.03 * n), 2)
+    pd.DataFrame(dane, columns=aplikacja.KOLUMNY_GPZ).to_csv(sciezka, index=False)
+
+
+def punkty(liczba, ziarno=1):
+    los = np.random.default_rng(ziarno)
+    return list(zip(los.uniform(*SZEROKOSC, liczba).tolist(), los.uniform(*DLUGOSC, liczba).tolist()))
+
+
+def statystyki(czasy, pamiec):
+    czasy = np.asarray(czasy)
+    p50, p95, p99 = np.percentile(czasy, [50, 95, 99]) * 1000
+    return {
+        'n': len(czasy),
+        'p50_ms': round(float(p50), 4),
+        'p95_ms': round(float(p95), 4),
+        'p99_ms': round(float(p99), 4),
+        'przepustowosc_s': round(len(czasy) / float(czasy.sum()), 2),
+        'pamiec_szczyt_mb': round(pamiec / 2 ** 20, 2),
+    }
+
+
+# Czasy kolejnych wywołań krok(i) oraz szczyt pamięci z osobnego, krótszego
+# przebiegu pod tracemalloc (śledzenie alokacji spowalnia pomiar czasu)
+def zmierz(krok, powtorzenia, przebiegi_pamieci=3):
+    czasy = []
+    for i in range(powtorzenia):
+        poczatek = time.perf_counter()
+        krok(i)
+        czasy.append(time.perf_counter() - poczatek)
+    tracemalloc.start()
+    for i in range(min(przebiegi_pamieci, powtorzenia)):
+        krok(powtorzenia + i)
+    pamiec = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statystyki(czasy, pamiec)
+
+
+def zaloguj(klient, nazwa):
+    odpowiedz = klient.post('/login', data={'username': nazwa, 'password': 'bench'})
+    assert odpowiedz.status_code == 302, f'Nie udało się zalogować jako {nazwa}'
+
+
+# Nieudane żądanie (przekierowanie do logowania, błąd) nie może trafić do wyników jako zwykły pomiar
+def sprawdz_odpowiedz(odpowiedz, oczekiwane):
+    assert odpowiedz.status_code in oczekiwane, \
+        f'{odpowiedz.request.method} {odpowiedz.request.path}: HTTP {odpowiedz.status_code}, oczekiwano {oczekiwane}'
+    return odpowiedz
+
+
+def benchmark_rozmiaru(aplikacja, katalog, rozmiar, zapytania):
+    app = aplikacja.app
+    sciezka = os.path.join(katalog, f'gpz_{rozmiar}.csv')
+    app.config['GPZ_CSV_PATH'] = sciezka
+    generuj_rejestr(aplikacja, sciezka, rozmiar)
+    aplikacja.gpz_registry.invalidate()
+    wyniki = {}
+
+    wyniki['load_gpz_data'] = zmierz(lambda i: aplikacja.load_gpz_data(),
+                                     max(3, min(20, 2_000_000 // rozmiar)), 1)
+
+    snapshot = aplikacja.gpz_registry.snapshot()
+    assert len(snapshot.gpz) == rozmiar
+    wspolrzedne = punkty(zapytania + 3)
+    wyniki['znajdz_najblizsze_gpz'] = zmierz(lambda i: aplikacja.znajdz_najblizsze_gpz(*wspolrzedne[i]), zapytania)
+
+    with app.test_client() as klient:
+        zaloguj(klient, 'bench')
+        liczba = max(10, zapytania // 5)
+        wyniki['/wyszukaj'] = zmierz(
+            lambda i: sprawdz_odpowiedz(klient.post('/wyszukaj', data={'adres': f'Benchmarkowa {rozmiar}-{i}, Warszawa'}),
+                                        (200,)), liczba)
+
+    # Każdy dopisany GPZ unieważnia zrzut - kolejna strona panelu wczytuje rejestr od nowa
+    with app.test_client() as klient:
+        zaloguj(klient, 'bench_admin')
+        formularz = {'dodaj_gpz': '1', 'nazwa': 'GPZ Nowy', 'miasto': 'Warszawa', 'kod_pocztowy': '00-001',
+                     'dostepna_moc': '5', 'dystrybutor': 'PGE'}
+        wyniki['admin_gpz_dodaj'] = zmierz(
+            lambda i: sprawdz_odpowiedz(klient.post('/admin/gpz', data=dict(formularz, adres=f'ul. Nowa {rozmiar}-{i}')),
+                                        (200, 302)),
+            max(3, min(50, 200_000 // rozmiar)), 1)
+    return wyniki
+
+
+def przygotuj_aplikacje(katalog):
+    aplikacja = _import_app(katalog)
+    app = aplikacja.app
+    app.config['QUERY_LIMIT'] = 10 ** 9
+    # Pomiar algorytmu wyszukiwania, nie pamięci podręcznej wyników
+    app.config['SEARCH_CACHE_SIZE'] = 0
+    aplikacja.GEOKODERY['atrapa'] = AtrapaGeokodera()
+    app.config['GEOCODER_BACKEND'] = 'atrapa'
+    with app.app_context():
+        for nazwa, administrator in (('bench', False), ('bench_admin', True)):
+            uzytkownik = aplikacja.User(username=nazwa, is_admin=administrator)
+            uzytkownik.set_password('bench')
+            aplikacja.db.session.add(uzytkownik)
+        aplikacja.db.session.commit()
+    return aplikacja
+
+
+def porownaj(wyniki, baza, tolerancja):
+    regresje = []
+    for rozmiar, scenariusze in wyniki['wyniki'].items():
+        for scenariusz, pomiar in scenariusze.items():
+            odniesienie = baza.get('wyniki', {}).get(rozmiar, {}).get(scenariusz)
+            if not odniesienie:
+                continue
+            zmiany = {miara: pomiar[miara] / odniesienie[miara] - 1
+                      for miara in ('p50_ms', 'p95_ms', 'pamiec_szczyt_mb') if odniesienie[miara] > 0}
+            print(f"{rozmiar:>8} {scenariusz:<22} " +
+                  '  '.join(f"{miara}: {zmiana:+7.1%}" for miara, zmiana in zmiany.items()))
+            # p95 bywa zaszumiony - regresję wyznacza mediana i pamięć
+            if zmiany.get('p50_ms', 0) > tolerancja or zmiany.get('pamiec_szczyt_mb', 0) > tolerancja:
+                regresje.append((rozmiar, scenariusz))
+    return regresje
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rozmiary', default='1000,10000,100000,1000000',
+                        help='liczby GPZ w syntetycznych rejestrach, rozdzielone przecinkami')
+    parser.add_argument('--zapytania', type=int, default=1000, help='liczba wyszukiwań na rozmiar rejestru')
+    parser.add_argument('--zapisz', help='zapis wyników do pliku JSON (baza odniesienia)')
+    parser.add_argument('--porownaj', help='porównanie z bazą odniesienia w pliku JSON')
+    parser.add_argument('--tolerancja', type=float, default=0.2, help='dopuszczalny wzrost p50 i pamięci (0.2 = 20%%)')
+    argumenty = parser.parse_args()
+
+    katalog = tempfile.mkdtemp(prefix='gpz-bench-')
+    aplikacja = przygotuj_aplikacje(katalog)
+    wyniki = {
+        'meta': {
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platforma': platform.platform(),
+            'numpy': np.__version__,
+            'zapytania': argumenty.zapytania,
+        },
+        'wyniki': {},
+    }
+    for rozmiar in (int(r) for r in argumenty.rozmiary.split(',')):
+        wyniki['wyniki'][str(rozmiar)] = scenariusze = benchmark_rozmiaru(aplikacja, katalog, rozmiar, argumenty.zapytania)
+        for scenariusz, pomiar in scenariusze.items():
+            print(f"{rozmiar:>8} {scenariusz:<22} p50: {pomiar['p50_ms']:9.3f} ms  p95: {pomiar['p95_ms']:9.3f} ms  "
+                  f"p99: {pomiar['p99_ms']:9.3f} ms  {pomiar['przepustowosc_s']:10.1f}/s  "
+                  f"pamięć: {pomiar['pamiec_szczyt_mb']:8.2f} MB")
+
+    if argumenty.zapisz:
+        with open(argumenty.zapisz, 'w', encoding='utf-8') as plik:
+            json.dump(wyniki, plik, indent=2, ensure_ascii=False)
+    if argumenty.porownaj:
+        with open(argumenty.porownaj, encoding='utf-8') as plik:
+            baza = json.load(plik)
+        print(f"\nPorównanie z {argumenty.porownaj} ({baza['meta']['data']}):")
+        regresje = porownaj(wyniki, baza, argumenty.tolerancja)
+        if regresje:
+            print('Regresje: ' + ', '.join(f'{scenariusz} ({rozmiar})' for rozmiar, scenariusz in regresje))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Testy korzystają z tymczasowej bazy danych i pliku GPZ - aplikacja tworzy
+# bazę i konto administratora już przy imporcie modułu app
+_katalog = tempfile.mkdtemp(prefix='gpz-testy-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_katalog, 'baza.db')}"
+os.environ['GPZ_CSV_PATH'] = os.path.join(_katalog, 'gpz_database.csv')
@@ -1,8 +1,17 @@
 from flask.testing import FlaskClient
 import pytest
 from flask import url_for, flash
-from app import app, db, User, RegistrationKey, UserQueries, login_manager
+from app import app, db, User, RegistrationKey, UserQueries, login_manager, gpz_registry, Gpz, GpzMoc
+from app import znajdz_najblizsze_gpz, RTREE_GPZ, quota_service, generuj_klucze, znajdz_najblizsze_gpz_z_moca
+from app import znajdz_gpz_w_promieniu, search_cache, address_index, GEOKODERY, metrics, geocoding_cache, SearchJob
+from app import ImportJob
 from datetime import datetime, timezone
+from unittest.mock import patch
+import io
+import json
+import random
+import threading
+import time
 
 @pytest.fixture
 def test_client():
@@ -10,6 +19,9 @@ def test_client():
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for testing
+    quota_service.reset()
+    search_cache.clear()
+    address_index.invalidate()
     with app.test_client() as client:
         with app.app_context():
             db.create_all()
@@ -122,6 +134,542 @@ def test_registration_key_usage(test_client: FlaskClient, create_registration_ke
         assert key.used is True
         assert key.used_by is not None, "Pole 'used_by' nie zostało ustawione"
 
+@pytest.fixture
+def gpz_csv(tmp_path, monkeypatch):
+    """Point the app at a temporary GPZ CSV file with the default sample rows."""
+    path = tmp_path / 'gpz.csv'
+    monkeypatch.setitem(app.config, 'GPZ_CSV_PATH', str(path))
+    gpz_registry.invalidate()
+    gpz_registry.snapshot()
+    yield path
+    gpz_registry.invalidate()
+
+def login_admin(client):
+    return client.post('/login', data={'username': 'admin', 'password': 'adminpass'}, follow_redirects=True)
+
+def wait_for_import(client, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(f'/admin/gpz/import/{job_id}').get_json()
+        if status['status'] != 'w_toku':
+            return status
+        time.sleep(0.05)
+    raise AssertionError('Import did not finish in time')
+
+def test_admin_bulk_import(test_client: FlaskClient, create_admin_user: None, gpz_csv):
+    """Test bulk GPZ import with geocoding, validation errors and a single write."""
+    login_admin(test_client)
+    upload = (
+        'nazwa;adres;miasto;kod_pocztowy;latitude;longitude;dostepna_moc;dystrybutor;moc_2025;moc_2030\n'
+        'GPZ Import A;ul. Polna 1;Kraków;30-001;50.06;19.94;5,5;Tauron;5;6\n'
+        'GPZ Import B;ul. Leśna 2;Gdańsk;80-001;;;7;Energa;7;8\n'
+        'GPZ Import C;ul. Krótka 3;Łódź;90-001;;;;PGE;1;1\n'
+    )
+
+    with patch('app.geokoduj_adres', return_value=(54.35, 18.65)) as mock_geocode:
+        response = test_client.post('/admin/gpz/import', data={
+            'plik': (io.BytesIO(upload.encode('utf-8')), 'gpz.csv')
+        }, content_type='multipart/form-data')
+        assert response.status_code == 302
+        job_id = response.headers['Location'].split('import_id=')[1]
+        status = wait_for_import(test_client, job_id)
+
+    assert status['status'] == 'zakonczony'
+    assert status['wszystkie'] == 3
+    assert status['przetworzone'] == 3
+    assert status['dodane'] == 2
+    assert status['bledy'] == [{'wiersz': 4, 'blad': 'Brak wartości w kolumnie dostepna_moc'}]
+    mock_geocode.assert_called_once_with('ul. Leśna 2, Gdańsk, 80-001')
+
+    # Progress and errors are stored in the database, so any worker process can report them
+    with app.app_context():
+        zapisane = db.session.get(ImportJob, job_id)
+        assert (zapisane.status, zapisane.przetworzone, zapisane.dodane) == ('zakonczony', 3, 2)
+        assert zapisane.bledy == status['bledy']
+
+        # An import that stopped writing progress (e.g. its worker restarted) is reported as interrupted
+        db.session.add(ImportJob(id='przerwany', nazwa_pliku='gpz.csv', status='w_toku', bledy=[],
+                                 updated_at=datetime(2000, 1, 1)))
+        db.session.commit()
+    przerwany = test_client.get('/admin/gpz/import/przerwany').get_json()
+    assert przerwany['status'] == 'blad'
+    assert przerwany['bledy'] == [{'wiersz': None, 'blad': 'Import został przerwany. Spróbuj ponownie.'}]
+    assert test_client.get('/admin/gpz/import/nieznany').status_code == 404
+
+    nazwy = [gpz['nazwa'] for gpz in gpz_registry.snapshot().gpz]
+    assert nazwy[-2:] == ['GPZ Import A', 'GPZ Import B']
+    assert gpz_registry.snapshot().gpz[-1]['latitude'] == 54.35
+
+    response = test_client.post('/admin/gpz/import', data={'plik': (io.BytesIO(b'x'), 'gpz.xls')},
+                                content_type='multipart/form-data', follow_redirects=True)
+    assert 'Obsługiwane są tylko pliki CSV i XLSX.' in response.get_data(as_text=True)
+
+def test_gpz_migrate_to_database_and_export(test_client: FlaskClient, create_admin_user: None, gpz_csv, monkeypatch):
+    """Test CSV-to-DB migration, inserts in DB storage mode and CSV export."""
+    csv_gpz = gpz_registry.snapshot().gpz
+
+    result = app.test_cli_runner().invoke(args=['gpz-migrate'])
+    assert 'Przeniesiono 3 GPZ' in result.output
+
+    monkeypatch.setitem(app.config, 'GPZ_STORAGE', 'db')
+    gpz_registry.invalidate()
+    db_gpz = gpz_registry.snapshot().gpz
+    assert [g['nazwa'] for g in db_gpz] == [g['nazwa'] for g in csv_gpz]
+    assert db_gpz[0]['moc_2030'] == csv_gpz[0]['moc_2030']
+    assert db_gpz[0]['pelny_adres'] == csv_gpz[0]['pelny_adres']
+
+    login_admin(test_client)
+    form = {'dodaj_gpz': '1', 'nazwa': 'GPZ Baza', 'adres': 'ul. Nowa 1', 'miasto': 'Poznań',
+            'kod_pocztowy': '60-001', 'dostepna_moc': '3.5', 'dystrybutor': 'Enea'}
+    form.update({f'moc_{rok}': str(rok - 2020) for rok in range(2025, 2031)})
+    with patch('app.geokoduj_adres', return_value=(52.40, 16.92)):
+        response = test_client.post('/admin/gpz', data=form, follow_redirects=True)
+    assert 'Nowy GPZ został dodany pomyślnie' in response.get_data(as_text=True)
+
+    with app.app_context():
+        gpz = Gpz.query.filter_by(nazwa='GPZ Baza').one()
+        assert [(m.rok, m.moc) for m in gpz.prognozy] == [(rok, float(rok - 2020)) for rok in range(2025, 2031)]
+
+    export = test_client.get('/admin/gpz/export.csv').get_data(as_text=True).splitlines()
+    assert export[0].startswith('nazwa,adres,miasto')
+    assert len(export) == 5
+    assert export[-1].startswith('GPZ Baza,ul. Nowa 1,Poznań,60-001,52.4,16.92,3.5,Enea,5.0')
+
+    # Ponowna migracja bez --force nie nadpisuje danych
+    result = app.test_cli_runner().invoke(args=['gpz-migrate'])
+    assert 'użyj --force' in result.output
+
+def test_gpz_database_version_detects_in_place_edits(test_client: FlaskClient, gpz_csv, monkeypatch):
+    """Test that DB-mode snapshots follow in-place edits and that the version check is throttled."""
+    app.test_cli_runner().invoke(args=['gpz-migrate', '--force'])
+    monkeypatch.setitem(app.config, 'GPZ_STORAGE', 'db')
+    monkeypatch.setitem(app.config, 'GPZ_DB_VERSION_CHECK', 0)
+    gpz_registry.invalidate()
+    snapshot = gpz_registry.snapshot()
+
+    # Same row count and max id - only the version marker reveals the change
+    with app.app_context():
+        gpz = Gpz.query.order_by(Gpz.id).first()
+        gpz.nazwa = 'GPZ Zmieniony'
+        gpz.prognozy[0].moc = 99.0
+        db.session.commit()
+    odswiezony = gpz_registry.snapshot()
+    assert odswiezony is not snapshot
+    assert odswiezony.gpz[0]['nazwa'] == 'GPZ Zmieniony' and odswiezony.gpz[0]['moc_2025'] == 99.0
+
+    monkeypatch.setitem(app.config, 'GPZ_DB_VERSION_CHECK', 3600)
+    with app.app_context():
+        Gpz.query.order_by(Gpz.id).first().nazwa = 'GPZ Później'
+        db.session.commit()
+    assert gpz_registry.snapshot() is odswiezony
+    gpz_registry.invalidate()
+    assert gpz_registry.snapshot().gpz[0]['nazwa'] == 'GPZ Później'
+
+@pytest.mark.parametrize('rtree', [True, False])
+def test_nearest_gpz_database_bbox_search(test_client: FlaskClient, gpz_csv, monkeypatch, rtree):
+    """Test that the growing bounding-box DB search matches the in-memory search."""
+    generator = random.Random(5)
+    wiersze = [{
+        'nazwa': f'GPZ {i}', 'adres': f'ul. Testowa {i}', 'miasto': 'Miasto', 'kod_pocztowy': '',
+        'latitude': generator.uniform(49.0, 54.8), 'longitude': generator.uniform(14.1, 24.1),
+        'dostepna_moc': 1.0, 'dystrybutor': 'PGE',
+    } for i in range(300)]
+    with open(gpz_csv, 'a', encoding='utf-8') as plik:
+        for w in wiersze:
+            plik.write(f"{w['nazwa']},{w['adres']},{w['miasto']},,{w['latitude']},{w['longitude']},1.0,PGE,0,0,0,0,0,0\n")
+    gpz_registry.invalidate()
+    app.test_cli_runner().invoke(args=['gpz-migrate', '--force'])
+    monkeypatch.setitem(RTREE_GPZ, 'dostepny', rtree and RTREE_GPZ['dostepny'])
+
+    for lat, lon in [(52.23, 21.01), (50.06, 19.94), (54.9, 14.0), (60.0, 30.0)]:
+        monkeypatch.setitem(app.config, 'GPZ_STORAGE', 'csv')
+        w_pamieci = znajdz_najblizsze_gpz(lat, lon, limit=4)
+        monkeypatch.setitem(app.config, 'GPZ_STORAGE', 'db')
+        z_bazy = znajdz_najblizsze_gpz(lat, lon, limit=4)
+
+        assert [g['nazwa'] for g, _ in z_bazy] == [g['nazwa'] for g, _ in w_pamieci]
+        assert [d for _, d in z_bazy] == [d for _, d in w_pamieci]
+
+def test_capacity_search_database_matches_memory(test_client: FlaskClient, gpz_csv, monkeypatch):
+    """Test that the capacity-constrained DB search matches the in-memory search."""
+    generator = random.Random(8)
+    with open(gpz_csv, 'a', encoding='utf-8') as plik:
+        for i in range(200):
+            moce = ','.join(f'{generator.uniform(0, 20):.1f}' for _ in range(6))
+            plik.write(f"GPZ {i},ul. Testowa {i},Miasto,,{generator.uniform(49.0, 54.8)},{generator.uniform(14.1, 24.1)},"
+                       f"{generator.uniform(0, 20):.1f},{generator.choice(['PGE', 'Enea'])},{moce}\n")
+        # Distributor stored with surrounding spaces, near the search point
+        for i in range(3):
+            plik.write(f"GPZ Spacja {i},ul. Testowa {i},Miasto,,{52.0 + i / 100},19.0,25.0, Tauron ,25,25,25,25,25,25\n")
+    gpz_registry.invalidate()
+    app.test_cli_runner().invoke(args=['gpz-migrate', '--force'])
+
+    for min_moc, rok, dystrybutor in [(10.0, None, None), (15.0, 2027, None), (5.0, 2030, 'PGE'), (20.0, None, 'tauron')]:
+        monkeypatch.setitem(app.config, 'GPZ_STORAGE', 'csv')
+        w_pamieci = znajdz_najblizsze_gpz_z_moca(52.0, 19.0, min_moc, rok, dystrybutor, limit=3)
+        monkeypatch.setitem(app.config, 'GPZ_STORAGE', 'db')
+        z_bazy = znajdz_najblizsze_gpz_z_moca(52.0, 19.0, min_moc, rok, dystrybutor, limit=3)
+
+        assert len(w_pamieci) == 3
+        assert [g['nazwa'] for g, _ in z_bazy] == [g['nazwa'] for g, _ in w_pamieci]
+
+def test_search_form_with_required_capacity(test_client: FlaskClient, create_admin_user: None, gpz_csv):
+    """Test that the search form skips GPZ without the required capacity in the chosen year."""
+    login_admin(test_client)
+    with patch('app.geokoduj_adres', return_value=(52.23, 21.0)):
+        response = test_client.post('/wyszukaj', data={'adres': 'Warszawa', 'min_moc': '14', 'rok': '2030'})
+
+    html = response.get_data(as_text=True)
+    assert 'data-name="GPZ Centrum"' in html and 'data-name="GPZ Zachód"' in html
+    assert 'data-name="GPZ Wschód"' not in html
+
+def test_radius_search_database_matches_memory(test_client: FlaskClient, gpz_csv, monkeypatch):
+    """Test that the radius search streams the same GPZ from the DB and from memory."""
+    generator = random.Random(9)
+    with open(gpz_csv, 'a', encoding='utf-8') as plik:
+        for i in range(1200):
+            plik.write(f"GPZ {i},ul. Testowa {i},Miasto,,{generator.uniform(51.5, 53.0)},{generator.uniform(20.0, 22.0)},"
+                       f"1.0,PGE,0,0,0,0,0,0\n")
+    gpz_registry.invalidate()
+    app.test_cli_runner().invoke(args=['gpz-migrate', '--force'])
+
+    monkeypatch.setitem(app.config, 'GPZ_STORAGE', 'csv')
+    w_pamieci = list(znajdz_gpz_w_promieniu(52.23, 21.0, 60.0))
+    monkeypatch.setitem(app.config, 'GPZ_STORAGE', 'db')
+    z_bazy = list(znajdz_gpz_w_promieniu(52.23, 21.0, 60.0))
+
+    assert len(w_pamieci) > 500
+    assert [(g['nazwa'], d) for g, d in z_bazy] == [(g['nazwa'], d) for g, d in w_pamieci]
+
+def test_api_radius_streaming(test_client: FlaskClient, create_admin_user: None, gpz_csv):
+    """Test the streamed JSON radius endpoint and its single quota charge."""
+    login_admin(test_client)
+    response = test_client.get('/api/promien', query_string={'lat': 52.2297, 'lon': 21.0122, 'promien': 1.0})
+
+    assert response.is_streamed
+    dane = json.loads(response.get_data(as_text=True))
+    assert [g['nazwa'] for g in dane['gpz']] == ['GPZ Centrum', 'GPZ Wschód']
+    assert dane['liczba'] == 2 and dane['gpz'][0]['odleglosc_km'] == 0.0
+    with app.app_context():
+        assert UserQueries.query.one().query_count == 1
+
+    assert test_client.get('/api/promien', query_string={'lat': 52.2, 'lon': 21.0, 'promien': 5000}).status_code == 400
+
+    # Without remaining queries the address is not geocoded at all
+    with patch.dict(app.config, {'QUERY_LIMIT': 1}), patch('app.geokoduj_adres') as geokoduj:
+        response = test_client.get('/api/promien', query_string={'adres': 'Warszawa', 'promien': 1.0})
+    assert response.status_code == 429
+    geokoduj.assert_not_called()
+
+def test_admin_add_and_delete_gpz_csv(test_client: FlaskClient, create_admin_user: None, gpz_csv):
+    """Test adding a GPZ by appending to the CSV and deleting it by an atomic rewrite."""
+    login_admin(test_client)
+    form = {'dodaj_gpz': '1', 'nazwa': 'GPZ Dopisany', 'adres': 'ul. Nowa 2', 'miasto': 'Lublin',
+            'kod_pocztowy': '20-001', 'dostepna_moc': '4', 'dystrybutor': 'PGE'}
+    form.update({f'moc_{rok}': '4' for rok in range(2025, 2031)})
+    with patch('app.geokoduj_adres', return_value=(51.25, 22.57)):
+        test_client.post('/admin/gpz', data=form, follow_redirects=True)
+
+    assert gpz_csv.read_text(encoding='utf-8').splitlines()[-1] == 'GPZ Dopisany,ul. Nowa 2,Lublin,20-001,51.25,22.57,4.0,PGE,4.0,4.0,4.0,4.0,4.0,4.0'
+    assert gpz_registry.snapshot().gpz[-1]['nazwa'] == 'GPZ Dopisany'
+
+    response = test_client.post('/admin/gpz', data={'usun_gpz': '1', 'gpz_id': '3', 'nazwa': 'GPZ Dopisany'},
+                                follow_redirects=True)
+    assert 'GPZ GPZ Dopisany został usunięty' in response.get_data(as_text=True)
+    assert [g['nazwa'] for g in gpz_registry.snapshot().gpz] == ['GPZ Centrum', 'GPZ Wschód', 'GPZ Zachód']
+
+def test_admin_gpz_table_pagination_and_filters(test_client: FlaskClient, create_admin_user: None, gpz_csv):
+    """Test server-side filtering, sorting and paging of the admin GPZ table."""
+    login_admin(test_client)
+    dane = test_client.get('/admin/gpz/dane', query_string={'sortuj': 'dostepna_moc', 'kierunek': 'desc',
+                                                            'na_strone': 2}).get_json()
+    assert dane['wszystkie'] == 3 and dane['strony'] == 2
+    assert [g['nazwa'] for g in dane['gpz']] == ['GPZ Zachód', 'GPZ Centrum']
+    assert [g['id'] for g in dane['gpz']] == [2, 0]
+
+    dane = test_client.get('/admin/gpz/dane', query_string={'min_moc': '9', 'dystrybutor': 'PGE'}).get_json()
+    assert [g['nazwa'] for g in dane['gpz']] == ['GPZ Centrum']
+
+    html = test_client.get('/admin/gpz?kod_pocztowy=00-4').get_data(as_text=True)
+    assert 'GPZ Zachód' in html and 'GPZ Wschód' not in html
+    assert 'Znaleziono GPZ: <strong>1</strong>' in html
+
+    # Usunięcie z drugiej strony tabeli posługuje się numerem wiersza w całym pliku
+    response = test_client.post('/admin/gpz', data={'usun_gpz': '1', 'gpz_id': '1', 'nazwa': 'GPZ Wschód'},
+                                follow_redirects=True)
+    assert 'GPZ GPZ Wschód został usunięty' in response.get_data(as_text=True)
+
+def test_api_batch_search(test_client: FlaskClient, create_admin_user: None, gpz_csv):
+    """Test the JSON batch search: addresses and points, one geocode per address, one quota charge."""
+    login_admin(test_client)
+    adresy = {'Warszawa, Marszałkowska 1': (52.23, 21.0), 'Nieistniejąca 1': None}
+    with patch('app.geokoduj_adres', side_effect=lambda adres: adresy[adres]) as geokoduj, \
+            patch('app.quota_service.obciaz', wraps=quota_service.obciaz) as obciaz:
+        response = test_client.post('/api/wyszukaj', json={'limit': 2, 'punkty': [
+            {'adres': 'Warszawa, Marszałkowska 1'},
+            {'lat': 52.2299, 'lon': 20.9762},
+            'Warszawa, Marszałkowska 1',
+            {'adres': 'Nieistniejąca 1'},
+            {'lat': 123, 'lon': 0},
+        ]})
+
+    dane = response.get_json()
+    assert response.status_code == 200
+    assert geokoduj.call_count == 2
+    obciaz.assert_called_once()
+    assert obciaz.call_args.args[1] == 3
+    assert dane['pozostale_zapytania'] == 97
+    wyniki = dane['wyniki']
+    assert [g['nazwa'] for g in wyniki[0]['gpz']] == ['GPZ Centrum', 'GPZ Wschód']
+    assert wyniki[1]['gpz'][0]['nazwa'] == 'GPZ Zachód' and wyniki[1]['gpz'][0]['odleglosc_km'] < 0.1
+    assert wyniki[2]['gpz'] == wyniki[0]['gpz']
+    assert 'blad' in wyniki[3] and 'blad' in wyniki[4]
+
+def test_api_batch_search_over_quota(test_client: FlaskClient, create_admin_user: None, gpz_csv):
+    """Test that a batch larger than the remaining quota is rejected without charging."""
+    login_admin(test_client)
+    with app.app_context():
+        user_id = User.query.filter_by(username='admin').first().id
+        db.session.add(UserQueries(user_id=user_id, month=quota_service.biezacy_miesiac(), query_count=99))
+        db.session.commit()
+
+    response = test_client.post('/api/wyszukaj', json=[{'lat': 52.2, 'lon': 21.0}, {'lat': 52.3, 'lon': 21.1}])
+    assert response.status_code == 429
+    with app.app_context():
+        assert UserQueries.query.one().query_count == 99
+
+    assert test_client.post('/api/wyszukaj', json={'punkty': []}).status_code == 400
+
+def test_admin_capacity_report(test_client: FlaskClient, create_admin_user: None, gpz_csv):
+    """Test the capacity report grouped by distributor, for one year and for all years."""
+    login_admin(test_client)
+    dane = test_client.get('/admin/gpz/raport', query_string={'grupuj': 'miasto', 'rok': 2025.5}).get_json()
+    assert dane['grupy'] == [{'nazwa': 'Warszawa', 'liczba': 3, 'suma': 31.45, 'mediana': 10.85}]
+
+    dane = test_client.get('/admin/gpz/raport').get_json()
+    assert [g['nazwa'] for g in dane['grupy']] == ['Enea', 'PGE', 'Tauron']
+    assert dane['grupy'][1]['suma'] == [10.5, 11.2, 12.0, 12.8, 13.5, 14.2]
+    assert dane['razem']['suma'][-1] == 39.2
+
+    assert test_client.get('/admin/gpz/raport?grupuj=nazwa').status_code == 400
+    for rok in ('abc', 'nan', 'inf', '-inf'):
+        odpowiedz = test_client.get('/admin/gpz/raport', query_string={'rok': rok})
+        assert odpowiedz.status_code == 400 and odpowiedz.get_json() == {'blad': 'Nieprawidłowy rok.'}
+
+def test_search_cache_keeps_quota_accounting(test_client: FlaskClient, create_admin_user: None, gpz_csv):
+    """Test that repeated searches hit the result cache but are still charged to the quota."""
+    login_admin(test_client)
+    with patch('app.geokoduj_adres', return_value=(52.23, 21.0)):
+        for _ in range(3):
+            response = test_client.post('/wyszukaj', data={'adres': 'Warszawa'})
+            assert 'data-name="GPZ Centrum"' in response.get_data(as_text=True)
+
+    statystyki = test_client.get('/admin/statystyki').get_json()['wyszukiwanie']
+    assert statystyki['chybienia'] == 1 and statystyki['trafienia_punktu'] == 2
+    with app.app_context():
+        assert UserQueries.query.one().query_count == 3
+
+def wait_for_search(client, status_url, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(status_url).get_json()
+        if status['status'] != 'w_toku':
+            return status
+        time.sleep(0.02)
+    raise AssertionError('Search did not finish in time')
+
+def test_async_search_charges_on_completion(test_client: FlaskClient, create_admin_user: None, gpz_csv):
+    """Test the async search: immediate ID, polling, result page and quota charged only on completion."""
+    login_admin(test_client)
+    geokodowanie = threading.Event()
+    def geokoduj(adres):
+        geokodowanie.wait(5)
+        return (52.23, 21.0) if adres == 'Warszawa' else None
+
+    with patch('app.geokoduj_adres', side_effect=geokoduj):
+        response = test_client.post('/api/wyszukaj/async', data={'adres': 'Warszawa', 'min_moc': '9'})
+        assert response.status_code == 202
+        zadanie = response.get_json()
+        assert test_client.get(zadanie['status_url']).get_json()['status'] == 'w_toku'
+        with app.app_context():
+            assert UserQueries.query.count() == 0
+
+        geokodowanie.set()
+        status = wait_for_search(test_client, zadanie['status_url'])
+        nieudane = wait_for_search(test_client, test_client.post('/api/wyszukaj/async', json={'adres': 'Nigdzie'})
+                                   .get_json()['status_url'])
+
+    assert status['status'] == 'gotowe'
+    assert [g['nazwa'] for g in status['gpz']] == ['GPZ Centrum', 'GPZ Zachód']
+    assert nieudane['status'] == 'blad' and nieudane['komunikat'] == 'Nie udało się odnaleźć podanego adresu.'
+    with app.app_context():
+        assert UserQueries.query.one().query_count == 1
+
+    html = test_client.get(zadanie['wynik_url']).get_data(as_text=True)
+    assert 'data-name="GPZ Zachód"' in html and 'data-name="GPZ Wschód"' not in html
+
+    # The state lives in the database, so any worker process can answer the poll
+    with app.app_context():
+        zapisane = db.session.get(SearchJob, zadanie['id'])
+        assert zapisane.status == 'gotowe' and [g['nazwa'] for g, _ in zapisane.najblizsze] == ['GPZ Centrum', 'GPZ Zachód']
+        zapisane.created_at = datetime(2000, 1, 1)
+        db.session.commit()
+
+    # Searches older than ASYNC_SEARCH_TTL are pruned when a new one starts
+    with patch('app.geokoduj_adres', return_value=None):
+        nowe = test_client.post('/api/wyszukaj/async', json={'adres': 'Nigdzie'}).get_json()
+        wait_for_search(test_client, nowe['status_url'])
+    assert test_client.get(zadanie['status_url']).status_code == 404
+
+    # Wynik wyszukiwania jest widoczny tylko dla jego autora
+    with app.app_context():
+        inny = User(username='inny')
+        inny.set_password('haslo')
+        db.session.add(inny)
+        db.session.commit()
+    test_client.get('/logout')
+    test_client.post('/login', data={'username': 'inny', 'password': 'haslo'})
+    assert test_client.get(nowe['status_url']).status_code == 404
+
+def test_address_autocomplete(test_client: FlaskClient, create_admin_user: None, gpz_csv):
+    """Test address suggestions from GPZ fields and geocoded addresses, resolved without a geocoder call."""
+    login_admin(test_client)
+    assert test_client.get('/api/adresy?q=ul').get_json() == {'podpowiedzi': []}
+    podpowiedzi = test_client.get('/api/adresy?q=Przykład').get_json()['podpowiedzi']
+    assert podpowiedzi == [{'adres': 'ul. Przykładowa 1, 00-001 Warszawa', 'lat': 52.2297, 'lon': 21.0122}]
+    assert [p['adres'] for p in test_client.get('/api/adresy?q=warszawa, ul. wsch').get_json()['podpowiedzi']] == \
+        ['ul. Wschodnia 15, 00-123 Warszawa']
+
+    with patch.object(GEOKODERY['nominatim'], 'geocode', return_value=(52.23, 21.01)) as geocode:
+        test_client.post('/wyszukaj', data={'adres': 'Marszałkowska 100, Warszawa'})
+        assert test_client.get('/api/adresy?q=marszał').get_json()['podpowiedzi'] == \
+            [{'adres': 'marszałkowska 100, warszawa', 'lat': 52.23, 'lon': 21.01}]
+
+        # A suggested address resolves without calling the geocoder
+        geocode.reset_mock()
+        html = test_client.post('/wyszukaj', data={'adres': 'ul. Przykładowa 1, 00-001 Warszawa'}).get_data(as_text=True)
+        assert 'data-name="GPZ Centrum"' in html
+        geocode.assert_not_called()
+
+        # An unknown address lists similar known addresses
+        geocode.return_value = None
+        html = test_client.post('/wyszukaj', data={'adres': 'ul. Przykładowa 99, Kraków'}).get_data(as_text=True)
+        assert 'Znalezione adresy' in html and 'value="ul. Przykładowa 1, 00-001 Warszawa"' in html
+
+def test_metrics_and_profiling(test_client: FlaskClient, create_admin_user: None, gpz_csv, monkeypatch):
+    """Test stage histograms and cache counters in /metrics and the admin profiling toggle."""
+    metrics.clear()
+    geocoding_cache.clear()
+    assert test_client.get('/metrics').status_code == 403
+    monkeypatch.setitem(app.config, 'METRICS_LOCALHOST', True)
+    assert test_client.get('/metrics').status_code == 200
+
+    login_admin(test_client)
+    with patch.object(GEOKODERY['nominatim'], 'geocode', return_value=(52.23, 21.01)):
+        odpowiedz = test_client.post('/wyszukaj?profil=1', data={'adres': 'Marszałkowska 100, Warszawa'})
+    etapy = odpowiedz.headers['Server-Timing']
+    for etap in ('geokodowanie', 'wyszukiwanie', 'limit_zapytan', 'renderowanie', 'razem'):
+        assert f'{etap};dur=' in etapy
+
+    tekst = test_client.get('/metrics').get_data(as_text=True)
+    assert '# TYPE gpz_etap_sekundy histogram' in tekst
+    assert 'gpz_etap_sekundy_count{etap="geokodowanie"} 1' in tekst
+    assert 'gpz_etap_sekundy_bucket{etap="limit_zapytan",le="+Inf"} 1' in tekst
+    # Logging in redirects to the search page, so it counts as the first request
+    assert 'gpz_zadanie_sekundy_count{endpoint="wyszukaj_gpz"} 2' in tekst
+    assert 'gpz_cache_chybienia_total{cache="geokodowanie"} 1' in tekst
+
+    # Profiling enabled in the session covers every following request
+    assert 'Server-Timing' not in test_client.get('/wyszukaj').headers
+    test_client.post('/admin/profilowanie', data={'wlacz': '1'})
+    assert 'renderowanie;dur=' in test_client.get('/wyszukaj').headers['Server-Timing']
+    profile = test_client.get('/admin/profilowanie').get_json()
+    assert profile['wlaczone'] is True
+    assert [p['sciezka'] for p in profile['profile'][-2:]] == ['/wyszukaj?profil=1', '/wyszukaj']
+    assert 'cumulative' in profile['profile'][-1]['profil']
+
+def test_quota_page_load_does_not_write(test_client: FlaskClient, create_admin_user: None):
+    """Test that showing the search page does not create a quota row."""
+    login_admin(test_client)
+    response = test_client.get('/wyszukaj')
+
+    assert response.status_code == 200
+    with app.app_context():
+        assert quota_service.pozostale(User.query.filter_by(username='admin').first().id) == 100
+        assert UserQueries.query.count() == 0
+
+def test_quota_search_charges_once(test_client: FlaskClient, create_admin_user: None, gpz_csv):
+    """Test that a successful search charges exactly one query."""
+    login_admin(test_client)
+    with patch('app.geokoduj_adres', return_value=(52.23, 21.0)):
+        response = test_client.post('/wyszukaj', data={'adres': 'Warszawa'})
+
+    assert 'GPZ Centrum' in response.get_data(as_text=True)
+    assert 'Pozostałe zapytania w tym miesiącu: <strong>99</strong>' in response.get_data(as_text=True)
+    with app.app_context():
+        assert UserQueries.query.one().query_count == 1
+
+def test_quota_concurrent_charges_respect_limit(test_client: FlaskClient, create_admin_user: None):
+    """Test that concurrent charges never push a user over the monthly limit."""
+    with app.app_context():
+        user = User.query.filter_by(username='admin').first()
+        user_id = user.id
+        db.session.add(UserQueries(user_id=user_id, month=quota_service.biezacy_miesiac(), query_count=95))
+        db.session.commit()
+
+    wyniki = []
+    watki = [threading.Thread(target=lambda: wyniki.append(quota_service.obciaz(user_id))) for _ in range(10)]
+    for watek in watki:
+        watek.start()
+    for watek in watki:
+        watek.join()
+
+    assert wyniki.count(True) == 5
+    with app.app_context():
+        assert UserQueries.query.filter_by(user_id=user_id).one().query_count == 100
+    assert quota_service.pozostale(user_id) == 0
+
+def test_admin_bulk_key_generation_and_export(test_client: FlaskClient, create_admin_user: None):
+    """Test bulk key generation, paginated listing and CSV export of the batch."""
+    login_admin(test_client)
+    response = test_client.post('/admin/keys', data={'generate_keys': '1', 'key_count': '120'})
+    html = response.get_data(as_text=True)
+
+    assert 'Wygenerowano 120 nowych kluczy rejestracyjnych.' in html
+    assert 'Strona 1 z 3 (120 kluczy)' in html
+    with app.app_context():
+        klucze = [k.key for k in RegistrationKey.query.all()]
+        partia = RegistrationKey.query.first().partia
+    assert len(klucze) == len(set(klucze)) == 120
+
+    export = test_client.get('/admin/keys/export.csv', query_string={'partia': partia})
+    wiersze = export.get_data(as_text=True).strip().splitlines()
+    assert export.mimetype == 'text/csv'
+    assert len(wiersze) == 121
+    assert {w.split(',')[0] for w in wiersze[1:]} == set(klucze)
+
+    # A second batch generated in the same second is exported separately
+    test_client.post('/admin/keys', data={'generate_keys': '1', 'key_count': '5'})
+    export = test_client.get('/admin/keys/export.csv', query_string={'partia': partia})
+    assert len(export.get_data(as_text=True).strip().splitlines()) == 121
+
+    assert 'Strona 3 z 3' in test_client.get('/admin/keys?page=3').get_data(as_text=True)
+
+def test_bulk_key_generation_retries_collisions(test_client: FlaskClient, create_registration_key: None):
+    """Test that a key colliding with an existing one is replaced, not duplicated."""
+    with app.app_context():
+        db.session.add(RegistrationKey(key='A' * 16))
+        db.session.commit()
+
+        prawdziwy_choice = __import__('secrets').choice
+        wywolania = iter(range(10 ** 6))
+        losuj = lambda alfabet: 'A' if next(wywolania) < 16 else prawdziwy_choice(alfabet)
+        with patch('app.secrets.choice', side_effect=losuj):
+            klucze, _ = generuj_klucze(5)
+
+        assert len(klucze) == 5 and 'A' * 16 not in klucze
+        assert RegistrationKey.query.count() == 7
+
 # Update timestamp initialization
 timestamp = datetime.now(timezone.utc)
 
@@ -3,7 +3,43 @@ import pytest
 from unittest.mock import patch, MagicMock, mock_open
 import pandas as pd
 from io import StringIO # Do mockowania odczytu CSV
-from app import geokoduj_adres, znajdz_najblizsze_gpz, load_gpz_data, app
+from datetime import timedelta
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from geopy.distance import geodesic
+import numpy as np
+from app import geokoduj_adres, znajdz_najblizsze_gpz, load_gpz_data, app, gpz_registry, db
+from app import geocoding_cache, search_cache, address_index, normalizuj_adres, GEOKODERY, TokenBucket, opcje_silnika
+from sqlalchemy import text
+from app import GpzSnapshot, GpzSpatialIndex, km_na_cieciwe, wektory_jednostkowe, gpz_csv_writer
+from app import GpzBinarySnapshot, GpzRegistry, GpzForecast, GpzRecord, GpzTableIndex, znajdz_najblizsze_gpz_wiele, znajdz_najblizsze_gpz_z_moca, znajdz_gpz_w_promieniu
+
+
+@pytest.fixture(autouse=True)
+def reset_gpz_registry(monkeypatch):
+    """Czyści współdzielony rejestr GPZ, aby testy nie widziały cudzych danych."""
+    # Testy algorytmu wyszukiwania działają bez pamięci podręcznej wyników
+    # (zrzuty tworzone w testach mają tę samą wersję)
+    monkeypatch.setitem(app.config, 'SEARCH_CACHE_SIZE', 0)
+    search_cache.clear()
+    gpz_registry.invalidate()
+    yield
+    gpz_registry.invalidate()
+
+@pytest.fixture(autouse=True)
+def reset_geocoding_cache(monkeypatch):
+    """Czyści pamięć podręczną geokodowania i współdzielonego klienta Nominatim."""
+    monkeypatch.setitem(app.config, 'NOMINATIM_RATE', 1000.0)
+    monkeypatch.setitem(app.config, 'NOMINATIM_BACKOFF', 0.01)
+    with app.app_context():
+        db.create_all()
+    geocoding_cache.clear()
+    GEOKODERY['nominatim'].reset()
+    yield
+    geocoding_cache.clear()
+    GEOKODERY['nominatim'].reset()
 
 # --- Testy dla geokoduj_adres ---
 
@@ -21,7 +57,8 @@ def test_geokoduj_adres_success(MockNominatim):
     result = geokoduj_adres(adres)
 
     assert result == (52.123, 21.456)
-    MockNominatim.assert_called_once_with(user_agent="gpz-finder")
+    MockNominatim.assert_called_once()
+    assert MockNominatim.call_args.kwargs['user_agent'] == "gpz-finder"
     mock_geolocator.geocode.assert_called_once_with(adres + ", Polska")
 
 @patch('app.Nominatim')
@@ -47,6 +84,194 @@ def test_geokoduj_adres_exception(MockNominatim, capsys):
     captured = capsys.readouterr()
     assert "Błąd geokodowania: API Error" in captured.out or "Błąd geokodowania: API Error" in captured.err
 
+@patch('app.Nominatim')
+def test_geokoduj_adres_uses_cache(MockNominatim):
+    """Testuje, czy powtórzone zapytanie o ten sam adres nie odpytuje Nominatim."""
+    mock_location = MagicMock(latitude=50.06, longitude=19.94)
+    MockNominatim.return_value.geocode.return_value = mock_location
+
+    assert geokoduj_adres("Kraków, Rynek Główny 1") == (50.06, 19.94)
+    assert geokoduj_adres("  kraków ,  rynek   główny 1 ") == (50.06, 19.94)
+    assert MockNominatim.return_value.geocode.call_count == 1
+
+    # Po wyczyszczeniu pamięci procesu wynik pochodzi z tabeli w bazie
+    with geocoding_cache._lock:
+        geocoding_cache._wpisy.clear()
+    assert geokoduj_adres("Kraków, Rynek Główny 1") == (50.06, 19.94)
+    assert MockNominatim.return_value.geocode.call_count == 1
+
+    statystyki = geocoding_cache.statystyki()
+    assert statystyki['trafienia'] == 1
+    assert statystyki['trafienia_baza'] == 1
+    assert statystyki['chybienia'] == 1
+
+@patch('app.Nominatim')
+def test_geokoduj_adres_negative_cache_expires(MockNominatim, monkeypatch):
+    """Testuje zapamiętanie braku wyniku i jego wygaśnięcie po TTL."""
+    MockNominatim.return_value.geocode.return_value = None
+
+    assert geokoduj_adres("Nieistniejaca 1") is None
+    assert geokoduj_adres("Nieistniejaca 1") is None
+    assert MockNominatim.return_value.geocode.call_count == 1
+
+    monkeypatch.setitem(app.config, 'GEOCODE_CACHE_NEGATIVE_TTL', timedelta(seconds=0))
+    assert geokoduj_adres("Nieistniejaca 1") is None
+    assert MockNominatim.return_value.geocode.call_count == 2
+
+@patch('app.Nominatim')
+def test_geokoduj_adres_does_not_cache_errors(MockNominatim):
+    """Testuje, czy błąd usługi nie jest zapamiętywany jako brak adresu."""
+    MockNominatim.return_value.geocode.side_effect = [Exception("Timeout"), MagicMock(latitude=1.0, longitude=2.0)]
+
+    assert geokoduj_adres("Adres 5") is None
+    assert geokoduj_adres("Adres 5") == (1.0, 2.0)
+
+def test_normalizuj_adres():
+    """Testuje normalizację klucza pamięci podręcznej."""
+    assert normalizuj_adres("  Marszałkowska  100 ,WARSZAWA, Polska ") == "marszałkowska 100, warszawa"
+
+@pytest.fixture
+def gazetteer(tmp_path, monkeypatch):
+    """Tworzy mały plik punktów adresowych dla geokodera lokalnego."""
+    sciezka = tmp_path / 'gazetteer.csv'
+    sciezka.write_text(
+        'ulica,numer,kod_pocztowy,miasto,latitude,longitude\n'
+        'ul. Marszałkowska,100,00-026,Warszawa,52.2297,21.0122\n'
+        'ul. Marszałkowska,102,00-026,Warszawa,52.2301,21.0118\n'
+        'Rynek Główny,1,31-042,Kraków,50.0617,19.9373\n',
+        encoding='utf-8'
+    )
+    monkeypatch.setitem(app.config, 'GAZETTEER_CSV_PATH', str(sciezka))
+    return sciezka
+
+@patch('app.Nominatim')
+def test_geokoduj_adres_local_backend(MockNominatim, gazetteer, monkeypatch):
+    """Testuje rozwiązywanie adresów z lokalnego pliku bez odpytywania Nominatim."""
+    monkeypatch.setitem(app.config, 'GEOCODER_BACKEND', 'local')
+
+    assert geokoduj_adres("Marszałkowska 100, Warszawa") == (52.2297, 21.0122)
+    assert geokoduj_adres("Warszawa, ul. Marszałkowska 102") == (52.2301, 21.0118)
+    assert geokoduj_adres("Rynek Główny 1, 31-042 Kraków") == (50.0617, 19.9373)
+    assert geokoduj_adres("Długa 5, Gdańsk") is None
+    MockNominatim.assert_not_called()
+
+@patch('app.Nominatim')
+def test_geokoduj_adres_local_then_nominatim(MockNominatim, gazetteer, monkeypatch):
+    """Testuje przejście do Nominatim, gdy adresu nie ma w pliku lokalnym."""
+    monkeypatch.setitem(app.config, 'GEOCODER_BACKEND', 'local,nominatim')
+    MockNominatim.return_value.geocode.return_value = MagicMock(latitude=54.35, longitude=18.65)
+
+    assert geokoduj_adres("Marszałkowska 100, Warszawa") == (52.2297, 21.0122)
+    assert geokoduj_adres("Długa 5, Gdańsk") == (54.35, 18.65)
+    MockNominatim.return_value.geocode.assert_called_once_with("Długa 5, Gdańsk, Polska")
+
+def test_podpowiedzi_adresow_z_pliku_lokalnego(gazetteer, monkeypatch):
+    """Testuje podpowiedzi adresów z pliku punktów adresowych geokodera lokalnego."""
+    monkeypatch.setitem(app.config, 'GEOCODER_BACKEND', 'local')
+    address_index.invalidate()
+    wyniki = address_index.podpowiedzi('Marszałkowska 10')
+
+    assert [etykieta for etykieta, _ in wyniki] == [
+        'ul. Marszałkowska 100, 00-026 Warszawa',
+        'ul. Marszałkowska 102, 00-026 Warszawa',
+    ]
+    assert address_index.wspolrzedne('ul. marszałkowska 102, 00-026 warszawa') == (52.2301, 21.0118)
+
+    # Bez geokodera lokalnego jego adresy nie są podpowiadane
+    monkeypatch.setitem(app.config, 'GEOCODER_BACKEND', 'nominatim')
+    assert address_index.podpowiedzi('Marszałkowska 10') == []
+
+
+@patch('app.Nominatim')
+def test_nieznany_geokoder_pomijany(MockNominatim, gazetteer, monkeypatch, capsys):
+    """Testuje pominięcie nieznanej nazwy geokodera z ostrzeżeniem zamiast błędu geokodowania."""
+    monkeypatch.setitem(app.config, 'GEOCODER_BACKEND', 'lokal,local')
+
+    assert geokoduj_adres("Marszałkowska 100, Warszawa") == (52.2297, 21.0122)
+    assert "Nieznany geokoder w GEOCODER_BACKEND: 'lokal'" in capsys.readouterr().out
+
+
+# --- Testy klienta Nominatim z lokalnym serwerem zastępczym ---
+
+@pytest.fixture
+def nominatim_stub(monkeypatch):
+    """Uruchamia lokalny serwer HTTP udający API wyszukiwania Nominatim."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            serwer.zapytania.append(self.path)
+            serwer.porty.add(self.client_address[1])
+            time.sleep(serwer.opoznienie)
+            if serwer.bledy > 0:
+                serwer.bledy -= 1
+                status, tresc = 503, b'[]'
+            else:
+                status, tresc = 200, json.dumps([{'lat': '52.1', 'lon': '21.0', 'display_name': 'Stub'}]).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(tresc)))
+            self.end_headers()
+            self.wfile.write(tresc)
+
+        def log_message(self, *args):
+            pass
+
+    serwer = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    serwer.zapytania, serwer.porty, serwer.opoznienie, serwer.bledy = [], set(), 0.0, 0
+    watek = threading.Thread(target=serwer.serve_forever, daemon=True)
+    watek.start()
+    monkeypatch.setitem(app.config, 'NOMINATIM_DOMAIN', f'127.0.0.1:{serwer.server_port}')
+    monkeypatch.setitem(app.config, 'NOMINATIM_SCHEME', 'http')
+    yield serwer
+    serwer.shutdown()
+    serwer.server_close()
+
+def test_nominatim_client_reuses_connection(nominatim_stub):
+    """Testuje, czy kolejne zapytania korzystają z tego samego połączenia HTTP."""
+    klient = GEOKODERY['nominatim']
+
+    assert klient.geocode("Adres 1") == (52.1, 21.0)
+    assert klient.geocode("Adres 2") == (52.1, 21.0)
+    assert len(nominatim_stub.zapytania) == 2
+    assert len(nominatim_stub.porty) == 1
+
+def test_nominatim_client_retries_unavailable(nominatim_stub):
+    """Testuje ponowienie zapytania po odpowiedzi 503."""
+    nominatim_stub.bledy = 1
+
+    assert GEOKODERY['nominatim'].geocode("Adres 3") == (52.1, 21.0)
+    assert len(nominatim_stub.zapytania) == 2
+
+def test_nominatim_client_deduplicates_in_flight(nominatim_stub):
+    """Testuje, czy równoczesne zapytania o ten sam adres dają jedno zapytanie HTTP."""
+    nominatim_stub.opoznienie = 0.3
+    wyniki = []
+    watki = [threading.Thread(target=lambda: wyniki.append(GEOKODERY['nominatim'].geocode("Adres 4")))
+             for _ in range(5)]
+    for watek in watki:
+        watek.start()
+    for watek in watki:
+        watek.join()
+
+    assert wyniki == [(52.1, 21.0)] * 5
+    assert len(nominatim_stub.zapytania) == 1
+
+def test_nominatim_client_rate_limit(nominatim_stub, monkeypatch):
+    """Testuje, czy klient nie przekracza skonfigurowanej liczby zapytań na sekundę."""
+    monkeypatch.setitem(app.config, 'NOMINATIM_RATE', 10.0)
+    start = time.monotonic()
+    for i in range(4):
+        GEOKODERY['nominatim'].geocode(f"Adres {10 + i}")
+
+    assert time.monotonic() - start >= 0.3
+
+def test_token_bucket_gives_up_after_max_wait():
+    """Testuje odmowę, gdy oczekiwanie na żeton przekroczyłoby limit."""
+    limiter = TokenBucket(rate=1.0, pojemnosc=1)
+
+    assert limiter.acquire(max_czekanie=0)
+    assert not limiter.acquire(max_czekanie=0.1)
 
 # --- Testy dla load_gpz_data ---
 
@@ -85,6 +310,20 @@ def test_load_gpz_data_success(mock_exists, mock_read_csv):
         assert 'pelny_adres' in gpz_data[0]
         assert gpz_data[0]['pelny_adres'] == 'ul. CSV 1, Miasto Test, 11-111'
 
+def test_gpz_record_is_compact_and_dict_compatible():
+    """Testuje rekord GPZ: sloty, internowane napisy, leniwy pełny adres i dostęp jak do słownika."""
+    a = GpzRecord('GPZ A', 'ul. A 1', ''.join(['Wars', 'zawa']), '00-001', 52.2, 21.0, 5.0, 'PGE', [1, 2, 3, 4, 5, 6])
+    b = GpzRecord('GPZ B', 'ul. B 2', ''.join(['Warsz', 'awa']), '', 52.3, 21.1, 6.0, 'PGE', id=7)
+
+    assert not hasattr(a, '__dict__')
+    assert a.miasto is b.miasto
+    assert a['pelny_adres'] == 'ul. A 1, Warszawa, 00-001' and b.pelny_adres == 'ul. B 2, Warszawa'
+    assert a['moc_2030'] == 6 and b.get('moc_2025') == 0.0
+    assert 'id' not in a and a.get('id', 'brak') == 'brak' and b['id'] == 7
+    with pytest.raises(KeyError):
+        a['id']
+    assert dict(b)['dystrybutor'] == 'PGE' and 'pelny_adres' in dict(a)
+
 @patch('app.os.path.exists')
 @patch('builtins.open', new_callable=mock_open) # Mockuj otwieranie/pisanie pliku
 @patch('app.csv.DictWriter') # Mockuj zapis CSV
@@ -161,4 +400,354 @@ def test_znajdz_najblizsze_gpz_finds_correct_limit(mock_geodesic, mock_load_data
     assert najblizsze[2][1] == 30.0
 
     # Sprawdź, ile razy wywołano geodesic - raz dla każdego GPZ w mock_data
-    assert mock_geodesic.call_count == len(mock_data)
\ No newline at end of file
+    assert mock_geodesic.call_count == len(mock_data)
+
+
+def _losowe_gpz(n, seed=7):
+    rng = np.random.default_rng(seed)
+    return tuple(
+        {'nazwa': f'GPZ {i}', 'latitude': float(lat), 'longitude': float(lon)}
+        for i, (lat, lon) in enumerate(zip(rng.uniform(49.0, 54.8, n), rng.uniform(14.1, 24.1, n)))
+    )
+
+@pytest.mark.parametrize('pelny_skan_max', [0, 10000])  # Drzewo k-d / wektorowy haversine
+def test_znajdz_najblizsze_gpz_matches_full_scan(pelny_skan_max, monkeypatch):
+    """Testuje, czy wybór kandydatów daje te same wyniki co pełne przeszukanie geodezyjne."""
+    monkeypatch.setitem(app.config, 'GPZ_PELNY_SKAN_MAX', pelny_skan_max)
+    gpz = _losowe_gpz(400)
+    snapshot = GpzSnapshot(gpz, None, 1)
+
+    with patch.object(gpz_registry, 'snapshot', return_value=snapshot):
+        for lat, lon in [(52.23, 21.01), (50.06, 19.94), (54.35, 18.65), (49.0, 24.1)]:
+            pelne = sorted(
+                (geodesic((lat, lon), (g['latitude'], g['longitude'])).kilometers, i) for i, g in enumerate(gpz)
+            )[:5]
+            wynik = znajdz_najblizsze_gpz(lat, lon, limit=5)
+
+            assert [g['nazwa'] for g, _ in wynik] == [gpz[i]['nazwa'] for _, i in pelne]
+            assert [d for _, d in wynik] == [d for d, _ in pelne]
+
+def test_znajdz_najblizsze_gpz_wiele_matches_single(monkeypatch):
+    """Testuje, czy wyszukiwanie dla wielu punktów (w blokach macierzy) zgadza się z pojedynczym."""
+    monkeypatch.setitem(app.config, 'API_BATCH_MATRIX_MAX', 1000)  # Bloki po 2 punkty
+    snapshot = GpzSnapshot(_losowe_gpz(400), None, 1)
+    punkty = [(52.23, 21.01), (50.06, 19.94), (54.35, 18.65), (49.0, 24.1), (51.0, 17.0)]
+
+    with patch.object(gpz_registry, 'snapshot', return_value=snapshot):
+        wiele = znajdz_najblizsze_gpz_wiele(punkty, limit=4)
+        pojedyncze = [znajdz_najblizsze_gpz(lat, lon, limit=4) for lat, lon in punkty]
+
+    assert len(wiele) == len(punkty)
+    for a, b in zip(wiele, pojedyncze):
+        assert [(g['nazwa'], d) for g, d in a] == [(g['nazwa'], d) for g, d in b]
+
+@pytest.mark.parametrize('pelny_skan_max', [0, 10000])  # Drzewo k-d podzbioru / wektorowy haversine
+def test_znajdz_najblizsze_gpz_z_moca_matches_brute_force(pelny_skan_max, monkeypatch):
+    """Testuje wyszukiwanie z wymaganą mocą, rokiem i dystrybutorem względem pełnego przeszukania."""
+    monkeypatch.setitem(app.config, 'GPZ_PELNY_SKAN_MAX', pelny_skan_max)
+    rng = np.random.default_rng(11)
+    gpz = tuple(dict(g, dostepna_moc=float(rng.uniform(0, 30)), moc_2028=float(rng.uniform(0, 30)),
+                     dystrybutor=['PGE', 'Enea', 'Tauron'][i % 3]) for i, g in enumerate(_losowe_gpz(600)))
+    snapshot = GpzSnapshot(gpz, None, 1)
+
+    with patch.object(gpz_registry, 'snapshot', return_value=snapshot):
+        for min_moc, rok, dystrybutor in [(7.5, None, None), (22.0, 2028, None), (3.0, 2028, 'enea'), (31.0, None, None)]:
+            kolumna = f'moc_{rok}' if rok else 'dostepna_moc'
+            pelne = sorted(
+                (geodesic((51.1, 17.0), (g['latitude'], g['longitude'])).kilometers, i) for i, g in enumerate(gpz)
+                if g[kolumna] >= min_moc and (dystrybutor is None or g['dystrybutor'].lower() == dystrybutor)
+            )[:4]
+            wynik = znajdz_najblizsze_gpz_z_moca(51.1, 17.0, min_moc, rok, dystrybutor, limit=4)
+
+            assert [g['nazwa'] for g, _ in wynik] == [gpz[i]['nazwa'] for _, i in pelne]
+            assert [d for _, d in wynik] == [d for d, _ in pelne]
+
+        # Nieznany dystrybutor nie tworzy indeksu, liczba zapamiętanych indeksów jest ograniczona
+        liczba_indeksow = len(snapshot._indeksy_mocy)
+        assert znajdz_najblizsze_gpz_z_moca(51.1, 17.0, 1.0, None, 'nieznany-dystrybutor') == []
+        assert len(snapshot._indeksy_mocy) == liczba_indeksow
+        monkeypatch.setitem(app.config, 'GPZ_INDEKSY_MOCY_MAX', 2)
+        for dystrybutor in ('pge', 'enea', 'tauron'):
+            znajdz_najblizsze_gpz_z_moca(51.1, 17.0, 1.0, None, dystrybutor)
+        assert list(snapshot._indeksy_mocy) == [('dostepna_moc', 1, 'enea'), ('dostepna_moc', 1, 'tauron')]
+
+    with pytest.raises(ValueError):
+        znajdz_najblizsze_gpz_z_moca(51.1, 17.0, 1.0, rok=2040)
+
+@pytest.mark.parametrize('pelny_skan_max', [0, 10000])
+def test_znajdz_gpz_w_promieniu_matches_brute_force(pelny_skan_max, monkeypatch):
+    """Testuje, czy generator GPZ w promieniu zwraca komplet posortowany po odległości geodezyjnej."""
+    monkeypatch.setitem(app.config, 'GPZ_PELNY_SKAN_MAX', pelny_skan_max)
+    gpz = _losowe_gpz(800)
+    snapshot = GpzSnapshot(gpz, None, 1)
+
+    with patch.object(gpz_registry, 'snapshot', return_value=snapshot):
+        for lat, lon, promien in [(52.23, 21.01, 60.0), (50.06, 19.94, 150.0), (55.5, 14.0, 10.0)]:
+            pelne = sorted(
+                (d, i) for i, g in enumerate(gpz)
+                if (d := geodesic((lat, lon), (g['latitude'], g['longitude'])).kilometers) <= promien
+            )
+            wynik = znajdz_gpz_w_promieniu(lat, lon, promien)
+
+            assert not isinstance(wynik, list)
+            wynik = list(wynik)
+            assert [g['nazwa'] for g, _ in wynik] == [gpz[i]['nazwa'] for _, i in pelne]
+            assert [d for _, d in wynik] == [d for d, _ in pelne]
+
+@pytest.mark.parametrize('pelny_skan_max', [0, 10000])
+def test_search_cache_results_are_exact(pelny_skan_max, monkeypatch):
+    """Testuje, czy wyniki z pamięci podręcznej (komórki siatki) są identyczne jak liczone od zera."""
+    monkeypatch.setitem(app.config, 'GPZ_PELNY_SKAN_MAX', pelny_skan_max)
+    monkeypatch.setitem(app.config, 'SEARCH_CACHE_GRID_DEG', 0.2)
+    rng = np.random.default_rng(21)
+    gpz = tuple(dict(g, dostepna_moc=float(rng.uniform(0, 20)), dystrybutor=['PGE', 'Enea'][i % 2])
+                for i, g in enumerate(_losowe_gpz(500)))
+    snapshot = GpzSnapshot(gpz, None, 1)
+    punkty = [(52.0 + dlat, 19.0 + dlon) for dlat, dlon in rng.uniform(0, 0.35, (40, 2))] + [(52.1, 19.1)] * 3
+
+    with patch.object(gpz_registry, 'snapshot', return_value=snapshot):
+        oczekiwane = [(znajdz_najblizsze_gpz(lat, lon, 3), znajdz_najblizsze_gpz_z_moca(lat, lon, 12.0, None, 'pge', 2))
+                      for lat, lon in punkty]
+        monkeypatch.setitem(app.config, 'SEARCH_CACHE_SIZE', 100)
+        z_pamieci = [(znajdz_najblizsze_gpz(lat, lon, 3), znajdz_najblizsze_gpz_z_moca(lat, lon, 12.0, None, 'pge', 2))
+                     for lat, lon in punkty]
+
+    nazwy = lambda wyniki: [[(g['nazwa'], d) for g, d in wynik] for para in wyniki for wynik in para]
+    assert nazwy(z_pamieci) == nazwy(oczekiwane)
+    statystyki = search_cache.statystyki()
+    assert statystyki['chybienia'] <= 8  # Najwyżej 4 komórki x 2 rodzaje wyszukiwania
+    assert statystyki['trafienia_punktu'] == 4
+    assert statystyki['wspolczynnik_trafien'] > 0.9
+
+    # Nowa wersja danych czyści pamięć podręczną
+    with patch.object(gpz_registry, 'snapshot', return_value=GpzSnapshot(gpz[:10], None, 2)):
+        assert znajdz_najblizsze_gpz(52.1, 19.1, 3)[0][0]['nazwa'] in {g['nazwa'] for g in gpz[:10]}
+    assert search_cache.statystyki()['rozmiar'] == 1
+
+def test_spatial_index_radius_query():
+    """Testuje zapytanie o punkty w promieniu względem przeszukania pełnego."""
+    gpz = _losowe_gpz(1000)
+    lat = np.array([g['latitude'] for g in gpz])
+    lon = np.array([g['longitude'] for g in gpz])
+    indeks = GpzSpatialIndex(lat, lon)
+
+    cieciwa = km_na_cieciwe(40.0)
+    indeksy, _ = indeks.w_promieniu(51.0, 19.0, cieciwa)
+    roznica = wektory_jednostkowe(lat, lon) - wektory_jednostkowe(51.0, 19.0)
+    oczekiwane = np.flatnonzero((roznica ** 2).sum(axis=1) <= cieciwa ** 2)
+
+    assert sorted(indeksy.tolist()) == oczekiwane.tolist()
+
+def test_snapshot_haversine_matches_geodesic():
+    """Testuje wektorowe odległości sferyczne względem geodezyjnych (różnica poniżej 1%)."""
+    gpz = _losowe_gpz(50) + ({'nazwa': 'Bez współrzędnych', 'latitude': float('nan'), 'longitude': float('nan')},)
+    snapshot = GpzSnapshot(gpz, None, 1)
+
+    odleglosci = snapshot.odleglosci_sferyczne(52.0, 19.0)
+
+    assert snapshot.lat.dtype == np.float64 and snapshot.lat.flags['C_CONTIGUOUS']
+    assert odleglosci[-1] == np.inf
+    for g, d in zip(gpz[:-1], odleglosci[:-1]):
+        assert d == pytest.approx(geodesic((52.0, 19.0), (g['latitude'], g['longitude'])).kilometers, rel=0.01)
+
+
+# --- Testy dla rejestru GPZ ---
+
+def test_gpz_registry_reuses_snapshot(tmp_path, monkeypatch):
+    """Testuje, czy rejestr nie parsuje ponownie niezmienionego pliku CSV."""
+    monkeypatch.setitem(app.config, 'GPZ_CSV_PATH', str(tmp_path / 'gpz.csv'))
+
+    with patch('app.load_gpz_data', wraps=load_gpz_data) as mock_load:
+        pierwszy = gpz_registry.snapshot()
+        drugi = gpz_registry.snapshot()
+
+    assert pierwszy is drugi
+    assert mock_load.call_count == 1
+    assert len(pierwszy.gpz) == 3  # Domyślne wpisy utworzonego pliku
+
+def test_gpz_registry_reloads_on_change(tmp_path, monkeypatch):
+    """Testuje przeładowanie rejestru po zmianie pliku i po unieważnieniu."""
+    sciezka = tmp_path / 'gpz.csv'
+    monkeypatch.setitem(app.config, 'GPZ_CSV_PATH', str(sciezka))
+    pierwszy = gpz_registry.snapshot()
+
+    with open(sciezka, 'a', encoding='utf-8') as f:
+        f.write('GPZ Nowy,ul. Nowa 1,Kraków,30-001,50.06,19.94,5.0,Tauron,5,5,5,5,5,5\n')
+    drugi = gpz_registry.snapshot()
+
+    assert drugi is not pierwszy
+    assert drugi.wersja > pierwszy.wersja
+    assert drugi.gpz[-1]['nazwa'] == 'GPZ Nowy'
+
+    gpz_registry.invalidate()
+    assert gpz_registry.snapshot() is not drugi
+
+def test_gpz_binary_snapshot_shared_and_swapped(tmp_path, monkeypatch):
+    """Testuje binarny zrzut: zgodność z CSV, start bez parsowania CSV i podmianę po zapisie."""
+    sciezka = tmp_path / 'gpz.csv'
+    monkeypatch.setitem(app.config, 'GPZ_CSV_PATH', str(sciezka))
+    monkeypatch.setitem(app.config, 'GPZ_BINARY_SNAPSHOT', True)
+    z_csv = load_gpz_data()
+
+    pierwszy = gpz_registry.snapshot()
+    assert (tmp_path / 'gpz.csv.snap').exists()
+    assert isinstance(pierwszy.lat, np.memmap)
+    assert [dict(g) for g in pierwszy.gpz] == [dict(g) for g in z_csv]
+
+    # Kolejny proces (tu: nowy rejestr) mapuje gotowy zrzut bez parsowania CSV
+    with patch('app.load_gpz_data', wraps=load_gpz_data) as mock_load:
+        drugi = GpzRegistry().snapshot()
+    assert mock_load.call_count == 0
+    assert drugi.gpz[1]['pelny_adres'] == z_csv[1]['pelny_adres']
+    assert znajdz_najblizsze_gpz(52.23, 21.0, limit=1)[0][0]['nazwa'] == 'GPZ Centrum'
+
+    gpz_csv_writer.dopisz([{'nazwa': 'GPZ Nowy', 'adres': 'ul. Nowa 1', 'miasto': 'Kraków', 'kod_pocztowy': '30-001',
+                            'latitude': 50.06, 'longitude': 19.94, 'dostepna_moc': 5.0, 'dystrybutor': 'Tauron'}])
+    trzeci = gpz_registry.snapshot()
+    assert len(trzeci.gpz) == 4 and trzeci.gpz[-1]['miasto'] == 'Kraków'
+    assert pierwszy.gpz[-1]['nazwa'] == 'GPZ Zachód'  # Stary zrzut nadal czytelny po podmianie pliku
+    assert GpzBinarySnapshot.otworz(str(tmp_path / 'gpz.csv.snap'), [0, 0, 0]) is None
+
+
+def test_gpz_binary_snapshot_corrupt_file_rebuilt(tmp_path, monkeypatch):
+    """Testuje odbudowę uszkodzonego (obciętego lub z błędnym nagłówkiem) zrzutu binarnego."""
+    monkeypatch.setitem(app.config, 'GPZ_CSV_PATH', str(tmp_path / 'gpz.csv'))
+    monkeypatch.setitem(app.config, 'GPZ_BINARY_SNAPSHOT', True)
+    load_gpz_data()
+    gpz_registry.snapshot()
+    sciezka = tmp_path / 'gpz.csv.snap'
+    poprawny = sciezka.read_bytes()
+
+    for uszkodzony in (poprawny[:len(poprawny) // 2], poprawny[:8] + b'\xff\xff\x00\x00' + poprawny[12:],
+                       poprawny[:12] + b'{"liczba": 3}' + poprawny[25:]):
+        sciezka.write_bytes(uszkodzony)
+        assert GpzBinarySnapshot.otworz(str(sciezka)) is None
+
+        # Rejestr nie przestaje działać - zrzut powstaje ponownie z pliku CSV
+        assert [g['nazwa'] for g in GpzRegistry().snapshot().gpz] == ['GPZ Centrum', 'GPZ Wschód', 'GPZ Zachód']
+        assert sciezka.read_bytes() == poprawny
+
+
+# --- Testy zapisu pliku CSV z danymi GPZ ---
+
+def test_gpz_csv_writer_concurrent_appends(tmp_path, monkeypatch):
+    """Testuje równoczesne dopisywanie wierszy z wielu wątków."""
+    monkeypatch.setitem(app.config, 'GPZ_CSV_PATH', str(tmp_path / 'gpz.csv'))
+    gpz_registry.snapshot()
+    wersja = gpz_csv_writer.wersja()
+
+    def dopisz(watek):
+        for i in range(10):
+            gpz_csv_writer.dopisz([{'nazwa': f'GPZ {watek}-{i}', 'adres': 'ul. A 1', 'miasto': 'B',
+                                    'latitude': 50.0, 'longitude': 20.0, 'dostepna_moc': 1.0}])
+
+    watki = [threading.Thread(target=dopisz, args=(n,)) for n in range(8)]
+    for watek in watki:
+        watek.start()
+    for watek in watki:
+        watek.join()
+
+    gpz = gpz_registry.snapshot().gpz
+    assert len(gpz) == 3 + 80
+    assert {g['nazwa'] for g in gpz[3:]} == {f'GPZ {w}-{i}' for w in range(8) for i in range(10)}
+    assert gpz_csv_writer.wersja() == wersja + 80
+
+def test_gpz_csv_writer_delete_is_atomic(tmp_path, monkeypatch):
+    """Testuje usuwanie przez zapis do pliku tymczasowego i podmianę pliku."""
+    sciezka = tmp_path / 'gpz.csv'
+    monkeypatch.setitem(app.config, 'GPZ_CSV_PATH', str(sciezka))
+    przed = gpz_registry.snapshot()
+
+    assert not gpz_csv_writer.usun(1, 'Inna nazwa')
+    assert gpz_csv_writer.usun(1, 'GPZ Wschód')
+    po = gpz_registry.snapshot()
+
+    assert [g['nazwa'] for g in po.gpz] == ['GPZ Centrum', 'GPZ Zachód']
+    assert po.wersja > przed.wersja
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['gpz.csv', 'gpz.csv.lock', 'gpz.csv.version']
+
+def test_gpz_csv_writer_appends_after_missing_newline(tmp_path, monkeypatch):
+    """Testuje dopisanie do pliku bez znaku nowej linii na końcu."""
+    sciezka = tmp_path / 'gpz.csv'
+    sciezka.write_text('nazwa,adres,miasto,latitude,longitude,dostepna_moc\nGPZ A,ul. A,M,50,20,1', encoding='utf-8')
+    monkeypatch.setitem(app.config, 'GPZ_CSV_PATH', str(sciezka))
+
+    gpz_csv_writer.dopisz([{'nazwa': 'GPZ B', 'adres': 'ul. B', 'miasto': 'M', 'latitude': 51, 'longitude': 21,
+                            'dostepna_moc': 2, 'dystrybutor': 'PGE'}])
+
+    # Dopisany wiersz ma takie samo zakończenie jak plik zapisany przez pandas (LF)
+    assert sciezka.read_bytes() == (
+        b'nazwa,adres,miasto,latitude,longitude,dostepna_moc\nGPZ A,ul. A,M,50,20,1\nGPZ B,ul. B,M,51,21,2\n'
+    )
+
+
+# --- Testy indeksu tabeli GPZ w panelu administracyjnym ---
+
+def test_gpz_table_index_matches_brute_force():
+    """Testuje, czy filtrowanie i sortowanie indeksu tabeli zgadza się z pełnym przeglądem."""
+    rng = np.random.default_rng(3)
+    dystrybutorzy = ['Tauron', 'Enea', 'PGE']
+    miasta = ['Warszawa', 'Wrocław', 'Kraków', 'Warka']
+    gpz = tuple({
+        'nazwa': f'GPZ {i:03d}', 'adres': f'ul. Testowa {i}', 'miasto': miasta[i % 4],
+        'kod_pocztowy': f'{i % 90:02d}-{i:03d}', 'dostepna_moc': float(rng.integers(0, 30)),
+        'dystrybutor': dystrybutorzy[i % 3],
+    } for i in range(300))
+    tabela = GpzTableIndex(gpz)
+
+    pozycje, wszystkie = tabela.strona({'dystrybutor': 'pge', 'miasto': 'war', 'min_moc': 10.0},
+                                       'dostepna_moc', True, strona=2, na_strone=5)
+    oczekiwane = [i for i, g in enumerate(gpz) if g['dystrybutor'] == 'PGE'
+                  and g['miasto'].lower().startswith('war') and g['dostepna_moc'] >= 10.0]
+    oczekiwane.sort(key=lambda i: gpz[i]['dostepna_moc'])
+    oczekiwane.reverse()
+    assert wszystkie == len(oczekiwane)
+    assert [gpz[i]['dostepna_moc'] for i in pozycje] == [gpz[i]['dostepna_moc'] for i in oczekiwane[5:10]]
+
+    pozycje, wszystkie = tabela.strona({'min_moc': 25.0}, None, False, strona=1, na_strone=1000)
+    assert sorted(pozycje.tolist()) == [i for i, g in enumerate(gpz) if g['dostepna_moc'] >= 25.0]
+    assert tabela.strona({'kod_pocztowy': '99-'}, None)[1] == 0
+
+# --- Testy prognoz mocy GPZ ---
+
+def test_gpz_forecast_aggregates_and_interpolation():
+    """Testuje macierz prognoz: interpolację lat oraz sumy i mediany według dystrybutora."""
+    rng = np.random.default_rng(5)
+    gpz = tuple(dict({f'moc_{rok}': float(rng.uniform(0, 20)) for rok in range(2025, 2031)},
+                     dystrybutor=['PGE', 'Enea', 'Tauron'][i % 3], miasto=f'Miasto {i % 7}') for i in range(101))
+    prognoza = GpzForecast(gpz)
+
+    assert prognoza.macierz.dtype == np.float32 and prognoza.macierz.shape == (101, 6)
+    np.testing.assert_allclose(prognoza.dla_roku(2027), [g['moc_2027'] for g in gpz], rtol=1e-6)
+    np.testing.assert_allclose(prognoza.dla_roku(2027.25), [0.75 * g['moc_2027'] + 0.25 * g['moc_2028'] for g in gpz],
+                               rtol=1e-5)
+    np.testing.assert_allclose(prognoza.dla_roku(2040), [g['moc_2030'] for g in gpz], rtol=1e-6)
+
+    for rok in (2026, 2028.5):
+        nazwy, liczby, sumy, mediany = prognoza.agregaty_dla_roku('dystrybutor', rok)
+        wektor = prognoza.dla_roku(rok)
+        for nazwa, liczba, suma, mediana in zip(nazwy, liczby, sumy, mediany):
+            wartosci = wektor[[g['dystrybutor'] == nazwa for g in gpz]]
+            assert liczba == len(wartosci)
+            assert suma == pytest.approx(float(wartosci.sum(dtype=np.float64)), rel=1e-5)
+            assert mediana == pytest.approx(float(np.median(wartosci)), rel=1e-6)
+
+    agregaty = prognoza.agregaty('miasto')
+    assert agregaty['grupy'] == [f'Miasto {i}' for i in range(7)]
+    assert agregaty['suma'].shape == (7, 6)
+
+# --- Testy konfiguracji bazy danych ---
+
+def test_sqlite_connection_pragmas():
+    """Testuje ustawienia WAL, synchronous=NORMAL i busy_timeout połączeń SQLite."""
+    with app.app_context():
+        assert db.session.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        assert db.session.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+        assert db.session.execute(text('PRAGMA busy_timeout')).scalar() == app.config['SQLITE_BUSY_TIMEOUT']
+
+def test_engine_options_pool_settings():
+    """Testuje opcje puli połączeń dla różnych adresów baz danych."""
+    assert 'pool_size' not in opcje_silnika('sqlite:///:memory:')
+    assert opcje_silnika('sqlite:///baza.db')['pool_size'] == app.config['DB_POOL_SIZE']
+    assert 'pool_recycle' not in opcje_silnika('sqlite:///baza.db')
+    assert opcje_silnika('postgresql://gpz@localhost/gpz')['pool_recycle'] == app.config['DB_POOL_RECYCLE']